@@ -1,4 +1,5 @@
 import os
+import sys
 from fileinput import filename
 from pathlib import Path
 
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'simple_history',
     'axes',
     "django_tailwind_cli",
@@ -97,9 +99,50 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD'),
         'HOST': os.environ.get('DB_HOST', 'localhost'),
         'PORT': os.environ.get('DB_PORT', '5432'),
+        'OPTIONS': {
+            # "Similar" search: pg_trgm's default of 0.6 misses common
+            # misspellings such as Pereira / Perera
+            'options': '-c pg_trgm.word_similarity_threshold=0.5',
+        },
     }
 }
 
+# Waitress serves the app from a single process, so the local-memory cache is
+# shared by every request; it holds the dashboard counters (letters/counters.py).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+LETTER_COUNTERS_CACHE_TIMEOUT = 60 * 10
+
+# Uploaded scans are cleaned up in the background ('sync' does it inside the
+# upload request instead). The worker runs inside the waitress process unless
+# ATTACHMENT_WORKER_IN_PROCESS is off, in which case run
+# "manage.py process_attachments" next to the server.
+ATTACHMENT_PROCESSING = 'background'
+ATTACHMENT_WORKER_IN_PROCESS = True
+ATTACHMENT_WORKERS = 2
+
+# Excel exports queued from the admin letter list (letters/export_jobs.py) are
+# built by a worker in the waitress process, or by "manage.py process_exports"
+# with EXPORT_WORKER_IN_PROCESS off. The same filters asked for again within
+# EXPORT_REUSE_WINDOW get the file already built; files go after EXPORT_RETENTION.
+EXPORT_WORKER_IN_PROCESS = True
+EXPORT_REUSE_WINDOW = timedelta(minutes=10)
+EXPORT_RETENTION = timedelta(days=1)
+
+# Processes the scan clean-up (Pillow, CPU bound) is spread over, see
+# letters/imaging.py. 1 keeps it in the web/worker process - the default in a
+# frozen (pyinstaller) build, whose spawned pool workers would need
+# multiprocessing.freeze_support() in a server entry point that waitress
+# does not have.
+IMAGE_PROCESS_WORKERS = 1 if getattr(sys, 'frozen', False) else min(4, os.cpu_count() or 1)
+
+# Processes "manage.py import_legacy_letters" parses and validates rows on
+# (letters/legacy_import.py); --workers overrides it.
+IMPORT_VALIDATION_WORKERS = min(4, os.cpu_count() or 1)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -149,6 +192,14 @@ LOGOUT_REDIRECT_URL = '/accounts/login/'
 LOGIN_URL = '/accounts/login/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.environ.get('MEDIA_ROOT', BASE_DIR / 'media')
+
+# How serve_attachment sends a file after the sector check (letters/delivery.py).
+# 'x-accel-redirect' leaves it to Caddy - the Caddyfile must get the same
+# MEDIA_ROOT - so no image bytes go through a waitress thread.
+PROTECTED_FILE_DELIVERY = os.environ.get('PROTECTED_FILE_DELIVERY', 'python')
+PROTECTED_FILE_URL = '/protected/'
+# Browser-only (private) caching of attachments; revalidated by ETag after that
+ATTACHMENT_CACHE_MAX_AGE = 60 * 60
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 AXES_FAILURE_LIMIT = 5
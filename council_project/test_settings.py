@@ -26,6 +26,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'simple_history',
     'axes',
     "django_tailwind_cli",
@@ -118,6 +119,11 @@ LOGIN_URL = '/accounts/login/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Tests expect processed attachments straight after save
+ATTACHMENT_PROCESSING = 'sync'
+IMAGE_PROCESS_WORKERS = 1
+IMPORT_VALIDATION_WORKERS = 1
+
 AXES_FAILURE_LIMIT = 5
 AXES_COOLOFF_TIME = timedelta(minutes=5)
 AXES_RESET_ON_SUCCESS = True
@@ -1,7 +1,7 @@
 # Register your models here.
 
 from django.contrib import admin
-from .models import Letter, SectorProfile
+from .models import AttachmentJob, Blob, ExportJob, Letter, SectorProfile
 
 class LetterAdmin(admin.ModelAdmin):
     list_display = ('serial_number', 'date_received', 'sender_details', 'administrated_by', 'status')
@@ -11,3 +11,20 @@ class LetterAdmin(admin.ModelAdmin):
 admin.site.register(Letter, LetterAdmin)
 admin.site.register(SectorProfile)
 
+class AttachmentJobAdmin(admin.ModelAdmin):
+    list_display = ('letter', 'field_name', 'status', 'attempts', 'created_at')
+    list_filter = ('status',)
+
+admin.site.register(AttachmentJob, AttachmentJobAdmin)
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'rows_done', 'rows_total', 'requested_by', 'created_at', 'finished_at')
+    list_filter = ('status',)
+
+admin.site.register(ExportJob, ExportJobAdmin)
+
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'ref_count', 'created_at')
+    readonly_fields = ('sha256', 'name', 'size', 'ref_count', 'created_at')
+
+admin.site.register(Blob, BlobAdmin)
@@ -10,11 +10,21 @@ class LettersConfig(AppConfig):
     name = 'letters'
 
     def ready(self):
+        from . import signals  # noqa: F401
+
         if 'runserver' not in sys.argv and 'waitress' not in sys.modules:
             return
 
         threading.Thread(target=self.run_startup_backup, daemon=True).start()
 
+        from django.conf import settings
+        if getattr(settings, 'ATTACHMENT_WORKER_IN_PROCESS', False):
+            from .attachments import run_worker
+            threading.Thread(target=run_worker, daemon=True).start()
+        if getattr(settings, 'EXPORT_WORKER_IN_PROCESS', False):
+            from .export_jobs import run_export_worker
+            threading.Thread(target=run_export_worker, daemon=True).start()
+
     def run_startup_backup(self):
         time.sleep(3)
 
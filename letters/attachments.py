@@ -0,0 +1,171 @@
+"""
+Background processing of uploaded attachments.
+
+With ``ATTACHMENT_PROCESSING = 'background'`` (the default) ``Letter.save``
+stores a phone photo or scan exactly as uploaded and queues an
+``AttachmentJob`` for it, so the clerk is not kept waiting while six 12MP
+images are cleaned up.  The worker here - run by ``manage.py
+process_attachments`` or, under waitress, started in-process from
+``LettersConfig.ready`` - takes jobs from that table, runs the scan clean-up
+on a small pool of threads and swaps the processed JPEG in (a PDF stays as it
+is and only gets its previews).  The threads only do the I/O; the Pillow work
+itself is handed to the process pool in ``letters/imaging.py`` so it runs on
+every core.  The database is the queue; there is no broker to install.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import F
+from django.utils import timezone
+
+from .imaging import PDF, process_upload, run_in_pool, sniff_content_type
+from .models import AttachmentJob, Blob, Letter, MetaEntry, file_fingerprint
+from .renditions import has_renditions, save_renditions
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+
+# A job still marked PROCESSING after this long belongs to a worker that died
+# (server restarted mid-upload); it is put back in the queue.
+STALE_AFTER = timedelta(minutes=10)
+
+DEFAULT_WORKERS = 2
+
+
+def worker_count():
+    return max(1, getattr(settings, 'ATTACHMENT_WORKERS', DEFAULT_WORKERS))
+
+
+def requeue_stale_jobs():
+    return AttachmentJob.objects.filter(
+        status=AttachmentJob.PROCESSING,
+        started_at__lt=timezone.now() - STALE_AFTER,
+    ).update(status=AttachmentJob.QUEUED)
+
+
+def claim_jobs(limit):
+    """
+    Mark up to ``limit`` queued jobs as PROCESSING and return them. Each claim
+    is a conditional UPDATE, so two workers never get the same job, on any
+    database.
+    """
+    claimed = []
+    candidates = AttachmentJob.objects.filter(status=AttachmentJob.QUEUED).values_list('pk', flat=True)
+    for pk in candidates[:limit * 2]:
+        won = AttachmentJob.objects.filter(pk=pk, status=AttachmentJob.QUEUED).update(
+            status=AttachmentJob.PROCESSING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if won:
+            claimed.append(pk)
+        if len(claimed) == limit:
+            break
+
+    return list(AttachmentJob.objects.select_related('letter').filter(pk__in=claimed))
+
+
+def swap_in(job, new_name, fingerprint=None):
+    """
+    Point the letter at the processed file (and record its ``fingerprint``) -
+    only if it still points at the upload this job was made for. Returns
+    False when a newer upload or an edit got there first.
+    """
+    updated = Letter.objects.filter(
+        pk=job.letter_id, **{job.field_name: job.source_name}
+    ).update(**{job.field_name: new_name, 'attachment_meta': MetaEntry(job.field_name, fingerprint)})
+    return bool(updated)
+
+
+def process_job(job):
+    try:
+        letter = job.letter
+        field = getattr(letter, job.field_name)
+
+        if field.name != job.source_name:
+            # Replaced or cleared since it was queued; a newer job covers it
+            job.delete()
+            return
+
+        storage = field.storage
+        with storage.open(job.source_name, 'rb') as source:
+            data = source.read()
+        processed, renditions, pages = run_in_pool(process_upload, data)
+
+        if sniff_content_type(data[:16]) == PDF:
+            # Stays as it is; only the previews were missing
+            save_renditions(storage, job.source_name, renditions)
+            swap_in(job, job.source_name, file_fingerprint(job.source_name, data, renditions, pages))
+            job.delete()
+            return
+
+        blob, created = Blob.objects.store(storage, processed, '.jpg')
+        if created or not has_renditions(storage, blob.name):
+            save_renditions(storage, blob.name, renditions)
+
+        # Either way one reference goes: the upload's, or the unused result's
+        if swap_in(job, blob.name, file_fingerprint(blob.name, processed, renditions)):
+            Blob.objects.release(storage, job.source_name)
+        else:
+            Blob.objects.release(storage, blob.name)
+        job.delete()
+
+    except Exception as e:
+        logger.exception("Processing %s of letter %s failed", job.field_name, job.letter_id)
+        status = AttachmentJob.FAILED if job.attempts >= MAX_ATTEMPTS else AttachmentJob.QUEUED
+        AttachmentJob.objects.filter(pk=job.pk).update(status=status, error=str(e))
+
+
+def process_job_in_thread(job):
+    try:
+        process_job(job)
+    finally:
+        # Pool threads each opened their own connection
+        connections.close_all()
+
+
+def process_pending(workers=None, limit=None):
+    """Work through the queue until it is empty (or ``limit`` jobs are done). Returns the number handled."""
+    workers = workers or worker_count()
+    handled = 0
+
+    # A single worker runs in the calling thread (and its transaction)
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while limit is None or handled < limit:
+            batch = workers if limit is None else min(workers, limit - handled)
+            jobs = claim_jobs(batch)
+            if not jobs:
+                break
+            if pool:
+                list(pool.map(process_job_in_thread, jobs))
+            else:
+                list(map(process_job, jobs))
+            handled += len(jobs)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    return handled
+
+
+def run_worker(workers=None, poll_interval=2.0, stop_event=None):
+    """Process attachments forever (until ``stop_event`` is set), polling the queue when idle."""
+    stop_event = stop_event or threading.Event()
+    requeue_stale_jobs()
+
+    while not stop_event.is_set():
+        try:
+            if not process_pending(workers):
+                stop_event.wait(poll_interval)
+        except Exception:
+            # Database restarting and the like: wait and try again
+            logger.exception("Attachment worker error")
+            close_old_connections()
+            time.sleep(poll_interval)
@@ -0,0 +1,101 @@
+"""
+Letter counters shown above the sector dashboard and the admin letter list.
+
+All of them come out of a single ``aggregate()`` with conditional counts.
+The counters of a whole sector (or of every sector) - what the dashboards
+show whenever no search is active - are additionally kept in the cache, so
+an ordinary dashboard load does not touch the letters table.
+
+The cache is per process (LocMemCache), and letters are written from more
+than one: the waitress server, the attachment worker, management commands
+such as the legacy import. So the cached counters are keyed by the
+``CounterVersion`` row, which ``invalidate_counters`` bumps - from the
+signals in ``signals.py`` on every save and delete, and from anything that
+writes letters in bulk. Reading the version is one primary-key lookup.
+The bump runs once the write has committed, in its own statement, so
+writers never queue on the version row's lock; counts cached in between are
+filed under the old version and retired by the bump.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import CounterVersion, Letter, SECTOR_CHOICES, STATUS_CHOICES
+
+ALL_SECTORS = 'ALL'
+
+CACHE_KEY = 'letters:counters:{}:{}'
+
+# Safety net for writes that do not bump the version (raw SQL); the version
+# normally retires the counters long before this.
+DEFAULT_CACHE_TIMEOUT = 60 * 10
+
+
+def count_letters(letters):
+    """
+    Total and per-status counts for ``letters`` in one query, e.g.
+    ``{'total': 12, 'pending': 5, 'replied': 4, 'not_required': 2,
+    'admin_updated': 1, 'resolved': 7}``.
+    """
+    counts = letters.aggregate(
+        total=Count('pk'),
+        **{
+            status.lower(): Count('pk', filter=Q(status=status))
+            for status, _label in STATUS_CHOICES
+        }
+    )
+    counts['resolved'] = counts['total'] - counts['pending']
+    return counts
+
+
+def cached_sectors():
+    return [ALL_SECTORS] + [code for code, _label in SECTOR_CHOICES]
+
+
+def sector_counters(sector=ALL_SECTORS):
+    """Counters for every letter of ``sector``, served from the cache when possible."""
+    letters = Letter.objects.all()
+    if sector != ALL_SECTORS:
+        letters = letters.filter(target_sector=sector)
+
+    if sector not in cached_sectors():
+        return count_letters(letters)
+
+    key = CACHE_KEY.format(counters_version(), sector)
+    counts = cache.get(key)
+    if counts is None:
+        counts = count_letters(letters)
+        cache.set(key, counts, getattr(settings, 'LETTER_COUNTERS_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT))
+    return counts
+
+
+def status_counters(counts, status):
+    """
+    Narrow the counters of a whole sector down to the letters with one
+    ``status`` - the admin status filter - without another query.
+    """
+    narrowed = {code.lower(): 0 for code, _label in STATUS_CHOICES}
+    narrowed[status.lower()] = counts.get(status.lower(), 0)
+    narrowed['total'] = narrowed[status.lower()]
+    narrowed['resolved'] = narrowed['total'] - narrowed['pending']
+    return narrowed
+
+
+def counters_version():
+    return CounterVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+def invalidate_counters():
+    """
+    Retire the cached counters in every process once the current transaction
+    commits (straight away outside one). Call after writing letters without
+    their signals.
+    """
+    transaction.on_commit(bump_counters_version)
+
+
+def bump_counters_version():
+    if not CounterVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        # The row is made by migration 0012; only a database emptied since has none
+        CounterVersion.objects.get_or_create(pk=1, defaults={'version': 1})
@@ -0,0 +1,182 @@
+"""
+Delivery of protected files (attachments) once a view has authorized the
+request.
+
+``PROTECTED_FILE_DELIVERY`` chooses how the bytes reach the browser:
+
+    'python'            stream the file from a waitress thread (FileResponse);
+                        works everywhere, the default
+    'x-accel-redirect'  answer with an empty response carrying
+                        ``X-Accel-Redirect: <PROTECTED_FILE_URL><name>`` and
+                        let the front-end server (Caddy or nginx) send the
+                        file from MEDIA_ROOT - see the Caddyfile
+    'x-sendfile'        the same with ``X-Sendfile: <absolute path>``, for
+                        Apache mod_xsendfile and lighttpd
+
+Only 'python' deals with ``Range`` requests itself (a single byte range,
+see ``requested_range``); Caddy, nginx and Apache answer them from the file
+for the other two.
+
+The internal URL must only be reachable through the header, never from
+outside: Caddy only serves it inside ``handle_response``, nginx with an
+``internal`` location.  A storage without local paths, or a file missing on
+disk, falls back to streaming so a misconfiguration shows as a 404 rather
+than a broken image.
+"""
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+DEFAULT_PROTECTED_FILE_URL = '/protected/'
+DEFAULT_MAX_AGE = 60 * 60
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def requested_range(request, size, etag=None):
+    """
+    The (first, last) byte positions asked for by a single-range ``Range``
+    header, or None to send the whole file: no header, a syntax we ignore as
+    RFC 9110 allows, or an ``If-Range`` the file no longer matches. Raises
+    RangeNotSatisfiable for a range outside the file, and for multiple
+    ranges, which are not worth the multipart/byteranges body for scans.
+    """
+    header = request.headers.get('Range', '').strip() if request else ''
+    if not header:
+        return None
+
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and (etag is None or if_range.strip() != etag):
+        return None
+
+    if ',' in header:
+        raise RangeNotSatisfiable()
+    match = RANGE_PATTERN.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # "bytes=-500": the last 500 bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise RangeNotSatisfiable()
+    return first, last
+
+
+def read_range(source, first, last):
+    try:
+        source.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = source.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        source.close()
+
+
+def stream(storage, name, content_type, request=None, etag=None):
+    try:
+        source = storage.open(name, 'rb')
+    except FileNotFoundError:
+        raise Http404()
+
+    size = source.size
+    try:
+        byte_range = requested_range(request, size, etag)
+    except RangeNotSatisfiable:
+        source.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(source, content_type=content_type)
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(read_range(source, first, last), status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {first}-{last}/{size}"
+        response['Content-Length'] = last - first + 1
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def x_accel_redirect(storage, name, content_type):
+    prefix = getattr(settings, 'PROTECTED_FILE_URL', DEFAULT_PROTECTED_FILE_URL)
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name)
+    return response
+
+
+def x_sendfile(storage, name, content_type):
+    response = HttpResponse(content_type=content_type)
+    response['X-Sendfile'] = storage.path(name)
+    return response
+
+
+BACKENDS = {
+    'python': stream,
+    'x-accel-redirect': x_accel_redirect,
+    'x-sendfile': x_sendfile,
+}
+
+
+def backend():
+    mode = getattr(settings, 'PROTECTED_FILE_DELIVERY', 'python')
+    try:
+        return BACKENDS[mode]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"PROTECTED_FILE_DELIVERY must be one of {', '.join(BACKENDS)}, not {mode!r}."
+        )
+
+
+def deliver(storage, name, content_type, request=None, etag=None):
+    """
+    Response sending the stored file ``name``. Call only after the request
+    has been authorized; ``request`` and ``etag`` are for Range / If-Range.
+    """
+    handoff = backend()
+    if handoff is not stream:
+        try:
+            if storage.exists(name) and storage.path(name):
+                return handoff(storage, name, content_type)
+        except NotImplementedError:
+            # Remote storage: there is no file for the web server to send
+            pass
+
+    return stream(storage, name, content_type, request, etag)
+
+
+def add_cache_headers(response, etag, last_modified):
+    """
+    Validators plus browser-only caching. ``private`` keeps the scans out of
+    shared caches; ``Vary: Cookie`` stops the browser reusing them once a
+    different user logs in (the session cookie changes), so a cached copy is
+    only ever shown to someone who already passed the sector check.
+    """
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, max_age=getattr(settings, 'ATTACHMENT_CACHE_MAX_AGE', DEFAULT_MAX_AGE))
+    patch_vary_headers(response, ['Cookie'])
+    return response
@@ -0,0 +1,179 @@
+"""
+Excel exports built in the background.
+
+A big register takes longer to write than the proxy waits for a response, so
+the admin letter list can queue an ``ExportJob`` with its current filters
+instead (``submit_export``).  The worker here - ``manage.py process_exports``
+or, under waitress, a thread started from ``LettersConfig.ready`` - claims
+queued jobs one at a time, writes the file with ``write_register`` into
+media storage under ``exports/`` and records its progress on the row as it
+goes, which the admin dashboard polls.  Like the attachment worker, the
+database is the queue.
+
+Asking again for the same filters within ``EXPORT_REUSE_WINDOW`` returns the
+job already queued, running or done rather than building the file a second
+time.  Finished exports are removed after ``EXPORT_RETENTION``.
+"""
+import hashlib
+import json
+import logging
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .exports import filtered_letters, write_register
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+# The admin letter list filters an export is made with, and their defaults
+EXPORT_PARAMS = {
+    'q': '',
+    'search_type': 'all',
+    'sector': 'all',
+    'status': 'all',
+}
+
+DEFAULT_REUSE_WINDOW = timedelta(minutes=10)
+DEFAULT_RETENTION = timedelta(days=1)
+
+# A RUNNING job whose progress has not moved for this long belongs to a worker
+# that died (server restarted mid-export); it is put back in the queue.
+STALE_AFTER = timedelta(minutes=10)
+
+
+def export_params(query):
+    """The export filters in ``query`` (a QueryDict or dict), with defaults filled in."""
+    params = {}
+    for name, default in EXPORT_PARAMS.items():
+        value = (query.get(name) or '').strip()
+        params[name] = value or default
+    if not params['q']:
+        # Only means something with a search
+        params['search_type'] = EXPORT_PARAMS['search_type']
+    return params
+
+
+def params_key(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def reuse_window():
+    return getattr(settings, 'EXPORT_REUSE_WINDOW', DEFAULT_REUSE_WINDOW)
+
+
+def submit_export(query, user=None):
+    """
+    Queue an export of the letters matching ``query``. Returns ``(job,
+    reused)``: an identical export queued, running, or finished within the
+    reuse window is returned instead of a new one.
+    """
+    params = export_params(query)
+    key = params_key(params)
+
+    recent = ExportJob.objects.filter(params_key=key).filter(
+        Q(status__in=[ExportJob.QUEUED, ExportJob.RUNNING])
+        | Q(status=ExportJob.DONE, finished_at__gte=timezone.now() - reuse_window())
+    ).first()
+    if recent and (recent.status != ExportJob.DONE or recent.file.storage.exists(recent.file.name)):
+        return recent, True
+
+    job = ExportJob.objects.create(params=params, params_key=key, requested_by=user)
+    return job, False
+
+
+def requeue_stale_exports():
+    return ExportJob.objects.filter(
+        status=ExportJob.RUNNING,
+        updated_at__lt=timezone.now() - STALE_AFTER,
+    ).update(status=ExportJob.QUEUED, rows_done=0)
+
+
+def claim_export():
+    """
+    Mark the oldest queued export as RUNNING and return it, or None. The claim
+    is a conditional UPDATE, so two workers never build the same file.
+    """
+    for pk in ExportJob.objects.filter(status=ExportJob.QUEUED).order_by('id').values_list('pk', flat=True)[:5]:
+        now = timezone.now()
+        won = ExportJob.objects.filter(pk=pk, status=ExportJob.QUEUED).update(
+            status=ExportJob.RUNNING, started_at=now, updated_at=now, rows_done=0,
+        )
+        if won:
+            return ExportJob.objects.get(pk=pk)
+    return None
+
+
+def run_export(job):
+    """Build the file of a claimed ``job`` and mark it DONE (or FAILED)."""
+    try:
+        letters, filename = filtered_letters(job.params)
+        rows_total = letters.count()
+        ExportJob.objects.filter(pk=job.pk).update(rows_total=rows_total, filename=filename)
+
+        def progress(rows_done):
+            ExportJob.objects.filter(pk=job.pk).update(rows_done=rows_done, updated_at=timezone.now())
+
+        with tempfile.TemporaryFile() as target:
+            rows_done = write_register(letters, target, progress)
+            target.seek(0)
+            job.file.save(f"export-{job.pk}.xlsx", File(target), save=False)
+
+        ExportJob.objects.filter(pk=job.pk).update(
+            status=ExportJob.DONE, file=job.file.name, rows_done=rows_done,
+            rows_total=max(rows_total, rows_done), finished_at=timezone.now(),
+        )
+    except Exception as e:
+        logger.exception("Export %s failed", job.pk)
+        ExportJob.objects.filter(pk=job.pk).update(
+            status=ExportJob.FAILED, error=str(e), finished_at=timezone.now(),
+        )
+
+
+def purge_old_exports():
+    """Delete finished exports (and their files) older than EXPORT_RETENTION. Returns how many."""
+    cutoff = timezone.now() - getattr(settings, 'EXPORT_RETENTION', DEFAULT_RETENTION)
+    purged = 0
+    for job in ExportJob.objects.filter(status__in=[ExportJob.DONE, ExportJob.FAILED], finished_at__lt=cutoff):
+        with transaction.atomic():
+            deleted, _ = ExportJob.objects.filter(pk=job.pk).delete()
+            if deleted and job.file:
+                transaction.on_commit(lambda name=job.file.name, storage=job.file.storage: storage.delete(name))
+        purged += deleted
+    return purged
+
+
+def process_pending_exports(limit=None):
+    """Build queued exports until there are none (or ``limit`` are done). Returns the number handled."""
+    handled = 0
+    while limit is None or handled < limit:
+        job = claim_export()
+        if job is None:
+            break
+        run_export(job)
+        handled += 1
+    return handled
+
+
+def run_export_worker(poll_interval=2.0, stop_event=None):
+    """Build exports forever (until ``stop_event`` is set), polling the queue when idle."""
+    stop_event = stop_event or threading.Event()
+    requeue_stale_exports()
+
+    while not stop_event.is_set():
+        try:
+            if not process_pending_exports():
+                purge_old_exports()
+                stop_event.wait(poll_interval)
+        except Exception:
+            # Database restarting and the like: wait and try again
+            logger.exception("Export worker error")
+            close_old_connections()
+            time.sleep(poll_interval)
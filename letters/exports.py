@@ -0,0 +1,291 @@
+"""
+The letter register as an Excel file, for the admin export, and as raw rows
+(CSV or newline-delimited JSON) for the statistics office.
+
+Rows are read with ``values_list(...).iterator()``, so the letters are never
+all in memory at once, and appended to an openpyxl write-only workbook, which
+writes each row out to a temporary file as it goes.  Cell styles are
+``NamedStyle``s registered once per sector and shared by every row of that
+sector.  A write-only sheet needs its column widths before the first row, so
+they come from one aggregate query (the longest value of each column) instead
+of a second pass over the cells.
+
+The raw formats skip openpyxl altogether: the stored values (codes, ISO
+dates) go from the same cursor straight into text chunks, so a full dump
+costs about what reading the rows does.
+"""
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+from itertools import chain
+
+from django.db.models import Max
+from django.db.models.functions import Length
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from .models import OFFICER_CHOICES, SECTOR_SINHALA_NAMES, Letter
+from .search import apply_search
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_CONTENT_TYPE = 'text/csv; charset=utf-8'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson; charset=utf-8'
+
+# Rows fetched per round trip (a server-side cursor on PostgreSQL)
+ITERATOR_CHUNK_SIZE = 2000
+STREAM_CHUNK_SIZE = 64 * 1024
+# Rows between two calls of write_register's ``progress``
+PROGRESS_EVERY = 1000
+
+TITLE = "ලිපි ලේඛන කළමනාකරණ පද්ධතිය - වැලිගෙපොල ප්‍රාදේශීය සභාව"
+
+SECTOR_COLORS = {
+    'ADMINISTRATION': 'bf716f',
+    'HEALTH': '8e74ad',
+    'DEVELOPMENT': 'e46c0a',
+    'REVENUE': 'ffff00',
+    'ACCOUNTS': '6997cf',
+}
+NO_SECTOR_COLOR = 'FFFFFF'
+
+STATUS_LABELS = {
+    'REPLIED': "පිළිතුරු යොමු කර ඇත",
+    'NOT_REQUIRED': "අවශ්‍ය නොවේ",
+    'ADMIN_UPDATED': "Admin Updated",
+}
+PENDING_LABEL = "විමර්ශනය වෙමින් පවතී"
+
+HEADERS = [
+    'ලිපි අංකය (Serial)',
+    'ලැබුණු දිනය (Date)',
+    'එවූ අයගේ විස්තර (Sender Details)',
+    'ලිපියේ වර්ගය (Type)',
+    'අංශය (Sector)',
+    'පරිපාලනය කළේ (Admin By)',
+    'භාරගත් නිලධාරී (Accepting Officer)',
+    'තත්වය (Status)',
+    'පිළිතුරු දුන් දිනය (Replied Date)',
+]
+
+# One per column, in the order of HEADERS
+COLUMNS = [
+    'serial_number', 'date_received', 'sender_details', 'letter_type', 'target_sector',
+    'administrated_by', 'accepting_officer_id', 'status', 'replied_at',
+]
+# 'center', 'date' or 'left' style of each column
+ALIGNMENTS = ['center', 'date', 'left', 'left', 'center', 'left', 'left', 'center', 'center']
+# Free text, whose longest value is asked of the database
+TEXT_COLUMNS = ['sender_details', 'letter_type', 'accepting_officer_id']
+
+MAX_COLUMN_WIDTH = 50
+
+
+def filtered_letters(params):
+    """
+    The letters an export covers, in register order, and the name (without
+    extension) it is downloaded as. ``params`` are the admin letter list's
+    q, search_type, sector and status.
+    """
+    letters = Letter.objects.all().order_by('serial_number')
+    search_query = params.get('q', '')
+    search_type = params.get('search_type', 'all')
+    filter_sector = params.get('sector', 'all')
+    filter_status = params.get('status', 'all')
+
+    if search_query:
+        # The register is always printed in serial order, ranked or not
+        letters = apply_search(letters, search_query, search_type).order_by('serial_number')
+
+        clean_query = "".join([c for c in search_query if c.isalnum() or c in (' ', '-', '_')]).strip()
+        filename = f"Search_Results_{clean_query}"
+    else:
+        filename = f"Weligepola_Pradeshiya_sabha_letters_database_{datetime.now().year}"
+
+    if filter_sector != 'all':
+        letters = letters.filter(target_sector=filter_sector)
+
+    if filter_status != 'all':
+        letters = letters.filter(status=filter_status)
+
+    return letters, filename
+
+
+def register_rows(letters):
+    """The register columns of ``letters`` as printed: Sinhala sector and status names, dates as text."""
+    officers = {code: str(label) for code, label in OFFICER_CHOICES}
+
+    rows = letters.values_list(*COLUMNS).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    for serial, received, sender, letter_type, sector, admin_by, officer, status, replied_at in rows:
+        yield sector, [
+            serial,
+            received,
+            sender,
+            letter_type,
+            SECTOR_SINHALA_NAMES.get(sector, sector),
+            officers.get(admin_by, admin_by),
+            officer,
+            STATUS_LABELS.get(status, PENDING_LABEL),
+            replied_at.strftime("%Y-%m-%d") if replied_at else "",
+        ]
+
+
+def column_widths(letters):
+    """Width of each column: its longest value or header plus a margin, at most MAX_COLUMN_WIDTH."""
+    longest = letters.order_by().aggregate(
+        serial_number=Max('serial_number'),
+        **{column: Max(Length(column)) for column in TEXT_COLUMNS},
+    )
+    lengths = {
+        'serial_number': len(str(longest['serial_number'] or '')),
+        'date_received': len('2026-01-01'),
+        'target_sector': max(len(name) for name in SECTOR_SINHALA_NAMES.values()),
+        'administrated_by': max(len(str(label)) for _, label in OFFICER_CHOICES),
+        'status': max(len(label) for label in [*STATUS_LABELS.values(), PENDING_LABEL]),
+        'replied_at': len('2026-01-01'),
+        **{column: longest[column] or 0 for column in TEXT_COLUMNS},
+    }
+    return [min(max(len(header), lengths[column]) + 3, MAX_COLUMN_WIDTH) for header, column in zip(HEADERS, COLUMNS)]
+
+
+def add_styles(workbook):
+    """Register the named styles the register uses: title, legend, header, and per sector 'SECTOR.alignment'."""
+    side = Side(style='thin')
+    border = Border(left=side, right=side, top=side, bottom=side)
+    centered = Alignment(horizontal='center', vertical='center')
+
+    workbook.add_named_style(NamedStyle(name='title', font=Font(bold=True, color="1f4e78", size=16), alignment=centered))
+    workbook.add_named_style(NamedStyle(name='legend', font=Font(bold=True, underline="single")))
+    workbook.add_named_style(NamedStyle(name='bordered', border=border))
+    workbook.add_named_style(NamedStyle(
+        name='header', font=Font(bold=True, color="FFFFFF", size=11), alignment=centered, border=border,
+        fill=PatternFill(start_color='2b2b2b', end_color='2b2b2b', fill_type='solid'),
+    ))
+
+    for sector, color in [*SECTOR_COLORS.items(), (None, NO_SECTOR_COLOR)]:
+        fill = PatternFill(start_color=color, end_color=color, fill_type='solid')
+        workbook.add_named_style(NamedStyle(name=f"{sector}.left", fill=fill, border=border,
+                                            alignment=Alignment(vertical='center')))
+        workbook.add_named_style(NamedStyle(name=f"{sector}.center", fill=fill, border=border, alignment=centered))
+        workbook.add_named_style(NamedStyle(name=f"{sector}.date", fill=fill, border=border, alignment=centered,
+                                            number_format='yyyy-mm-dd'))
+
+
+def styled(sheet, value, style):
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.style = style
+    return cell
+
+
+def write_register(letters, target, progress=None):
+    """
+    Write the register of ``letters`` as an .xlsx file to ``target`` (a path
+    or a binary file). ``progress``, if given, is called with the number of
+    rows written every PROGRESS_EVERY rows and once at the end.
+    """
+    workbook = Workbook(write_only=True)
+    add_styles(workbook)
+    sheet = workbook.create_sheet("Letters Data")
+
+    for number, width in enumerate(column_widths(letters), 1):
+        sheet.column_dimensions[get_column_letter(number)].width = width
+
+    sheet.append([styled(sheet, TITLE, 'title')])
+    sheet.merged_cells.add(f"A1:{get_column_letter(len(HEADERS))}1")
+    sheet.append([])
+
+    sheet.append([styled(sheet, "වර්ණ දර්ශකය (Color legend)", 'legend')])
+    for sector in SECTOR_COLORS:
+        sheet.append([styled(sheet, SECTOR_SINHALA_NAMES.get(sector, sector), 'bordered'),
+                      styled(sheet, None, f"{sector}.center")])
+    sheet.append([])
+    sheet.append([])
+
+    sheet.append([styled(sheet, header, 'header') for header in HEADERS])
+
+    row_styles = {
+        sector: [f"{sector}.{alignment}" for alignment in ALIGNMENTS]
+        for sector in [*SECTOR_COLORS, None]
+    }
+    written = 0
+    for sector, row in register_rows(letters):
+        styles = row_styles.get(sector, row_styles[None])
+        sheet.append([styled(sheet, value, style) for value, style in zip(row, styles)])
+        written += 1
+        if progress and written % PROGRESS_EVERY == 0:
+            progress(written)
+
+    workbook.save(target)
+    if progress:
+        progress(written)
+    return written
+
+
+def register_chunks(letters):
+    """
+    The .xlsx file of ``letters`` in pieces, for a StreamingHttpResponse.
+    The zip container is assembled in a temporary file, so memory use does
+    not grow with the number of letters - but the whole workbook is written
+    before the first chunk goes out (about 45 s at 100,000 letters), so a
+    proxy timeout in front of the server can still cut a large export off.
+    Large registers are exported by the worker instead, see export_jobs.py.
+    """
+    with tempfile.TemporaryFile() as target:
+        write_register(letters, target)
+        target.seek(0)
+        while chunk := target.read(STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+def raw_rows(letters):
+    """The COLUMNS of ``letters`` as stored, dates as ISO text."""
+    rows = letters.values_list(*COLUMNS).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    for row in rows:
+        yield [value.isoformat() if hasattr(value, 'isoformat') else value for value in row]
+
+
+def buffered(lines):
+    """Join ``lines`` (text) into UTF-8 chunks of about STREAM_CHUNK_SIZE."""
+    buffer = io.StringIO()
+    for line in lines:
+        buffer.write(line)
+        if buffer.tell() >= STREAM_CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class Echo:
+    """Pseudo-buffer handing back what csv.writer writes, as in Django's streaming CSV example."""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(letters):
+    """The raw rows of ``letters`` as CSV with a header row, in pieces for a StreamingHttpResponse."""
+    writer = csv.writer(Echo())
+    # Byte order mark, so Excel opens the Sinhala text as UTF-8
+    lines = chain(['\ufeff', writer.writerow(COLUMNS)], (writer.writerow(row) for row in raw_rows(letters)))
+    return buffered(lines)
+
+
+def ndjson_chunks(letters):
+    """The raw rows of ``letters`` as one JSON object per line, in pieces for a StreamingHttpResponse."""
+    return buffered(
+        json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n'
+        for row in raw_rows(letters)
+    )
+
+
+# ?format= of the export view: content type, file extension and body
+EXPORT_FORMATS = {
+    'xlsx': (XLSX_CONTENT_TYPE, 'xlsx', register_chunks),
+    'csv': (CSV_CONTENT_TYPE, 'csv', csv_chunks),
+    'ndjson': (NDJSON_CONTENT_TYPE, 'ndjson', ndjson_chunks),
+}
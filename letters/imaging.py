@@ -0,0 +1,267 @@
+"""
+Scan clean-up shared by Letter.save, the attachment worker and the benchmark,
+and the smaller renditions the viewers show (see letters/renditions.py).
+PDFs are stored as uploaded; with PyMuPDF installed their pages are rendered
+to JPEG for the same viewers.
+
+``clean_scan`` is plain bytes in, bytes out, with no Django in sight, so it
+can be shipped to a ``ProcessPoolExecutor`` and use every core: the Pillow
+work (EXIF rotate, grayscale, contrast, sharpen, LANCZOS resize, optimized
+JPEG) is CPU bound, and threads alone would keep it on one.
+
+On Windows the pool starts its workers with *spawn*, which re-imports this
+module in each child - keep it free of model imports.  Frozen (pyinstaller)
+children also need ``multiprocessing.freeze_support()`` first thing in
+``__main__``: manage.py calls it, and a frozen server, which has no such
+entry point, runs with a single worker unless IMAGE_PROCESS_WORKERS says
+otherwise.
+"""
+import atexit
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image, ImageEnhance, ImageOps
+
+try:
+    import pymupdf
+except ImportError:
+    # Optional: without it PDF attachments are served as they are, no previews
+    pymupdf = None
+
+PDF = 'application/pdf'
+# Anything whose first bytes match none of SIGNATURES
+UNKNOWN = 'application/octet-stream'
+
+# Leading bytes of the formats clerks upload, most common first. These are
+# the only types an attachment is ever served as inline; the type is never
+# taken from the uploaded name, which the uploader chooses (.html, .svg...).
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'%PDF-', PDF),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+]
+WEBP = 'image/webp'
+
+# The extension a stored file of each type gets
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    PDF: '.pdf',
+    'image/tiff': '.tif',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    WEBP: '.webp',
+}
+INLINE_TYPES = frozenset(EXTENSIONS)
+
+MAX_SIZE = (1200, 1600)
+JPEG_QUALITY = 60
+
+# Bounding boxes of the renditions made from each processed scan: 'thumb' for
+# the viewer sidebar and detail page tiles, 'preview' shown while the full
+# scan loads.
+RENDITION_SIZES = {
+    'thumb': (240, 320),
+    'preview': (600, 800),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def clean_scan(data):
+    """Turn a phone photo or scan (any format Pillow reads) into a small, legible grayscale JPEG."""
+    img = Image.open(BytesIO(data))
+
+    img = ImageOps.exif_transpose(img)
+
+    img = img.convert('L')
+
+    contrast_enhancer = ImageEnhance.Contrast(img)
+    img = contrast_enhancer.enhance(1.8)
+
+    sharpness_enhancer = ImageEnhance.Sharpness(img)
+    img = sharpness_enhancer.enhance(2.0)
+
+    img.thumbnail(MAX_SIZE, Image.Resampling.LANCZOS)
+
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def make_renditions(data):
+    """Every rendition of a processed scan, as {variant: JPEG bytes}."""
+    source = Image.open(BytesIO(data))
+    source.load()
+
+    renditions = {}
+    for variant, size in RENDITION_SIZES.items():
+        img = source.copy()
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+        renditions[variant] = output.getvalue()
+
+    return renditions
+
+
+def sniff_content_type(head):
+    """MIME type of a file from its first bytes: one of INLINE_TYPES, or UNKNOWN."""
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return WEBP
+    return UNKNOWN
+
+
+def extension_for(content_type):
+    """Extension of a stored file of ``content_type``; '.bin' for anything not in INLINE_TYPES."""
+    return EXTENSIONS.get(content_type, '.bin')
+
+
+def open_pdf(source):
+    # A path lets PyMuPDF read just the pages it needs
+    if isinstance(source, (bytes, bytearray)):
+        return pymupdf.open(stream=source, filetype='pdf')
+    return pymupdf.open(source)
+
+
+def render_pdf_page(source, page_number=1):
+    """Page ``page_number`` (from 1) of a PDF, as a JPEG no bigger than a processed scan."""
+    with open_pdf(source) as document:
+        page = document[page_number - 1]
+        zoom = min(MAX_SIZE[0] / page.rect.width, MAX_SIZE[1] / page.rect.height)
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+
+    img = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def pdf_page_count(source):
+    if pymupdf is None:
+        return None
+    with open_pdf(source) as document:
+        return document.page_count
+
+
+def make_previews(data):
+    """
+    (renditions, pages) of a stored attachment: the renditions of a scan, or
+    of page 1 of a PDF along with its page count. A PDF without PyMuPDF gets
+    ({}, None).
+    """
+    if sniff_content_type(data[:16]) == PDF:
+        if pymupdf is None:
+            return {}, None
+        return make_renditions(render_pdf_page(data)), pdf_page_count(data)
+    return make_renditions(data), None
+
+
+def process_upload(data):
+    """
+    What is stored for one upload, all CPU work done: (file bytes,
+    renditions, PDF page count). A scan is cleaned up and its renditions made
+    from the result; a PDF is kept as it is, with previews of page 1.
+    """
+    if sniff_content_type(data[:16]) == PDF:
+        renditions, pages = make_previews(data)
+        return data, renditions, pages
+
+    cleaned = clean_scan(data)
+    return cleaned, make_renditions(cleaned), None
+
+
+def worker_count():
+    from django.conf import settings
+
+    default = 1 if getattr(sys, 'frozen', False) else min(4, os.cpu_count() or 1)
+    return max(1, getattr(settings, 'IMAGE_PROCESS_WORKERS', default))
+
+
+def get_pool():
+    """The shared process pool, started on first use; None when configured for a single worker."""
+    global _pool
+
+    workers = worker_count()
+    if workers == 1:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def reset_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(reset_pool)
+
+
+def clean_scans(images):
+    """
+    ``clean_scan`` over a list of images, in parallel when there is more
+    than one. Returns the results in order; an image that could not be read
+    comes back as the exception raised for it instead.
+    """
+    return map_images(clean_scan, images)
+
+
+def map_images(func, images):
+    """Run the module-level ``func`` over ``images`` on the pool; results (or exceptions) in order."""
+    pool = get_pool() if len(images) > 1 else None
+    if pool is None:
+        return [_call_or_error(func, data) for data in images]
+
+    try:
+        futures = [pool.submit(func, data) for data in images]
+        # exception() waits; a dead worker fails its future with BrokenProcessPool
+        # rather than raising here, so it has to be picked out of the results
+        errors = [future.exception() for future in futures]
+    except BrokenProcessPool:
+        errors = [BrokenProcessPool()]
+    if any(isinstance(error, BrokenProcessPool) for error in errors):
+        # A worker died (out of memory on a huge scan, killed, ...): start a
+        # fresh pool next time and finish this batch here.
+        reset_pool()
+        return [_call_or_error(func, data) for data in images]
+    return [error or future.result() for error, future in zip(errors, futures)]
+
+
+def run_in_pool(func, *args):
+    """``func(*args)`` on a pool process, for callers that are threads themselves."""
+    pool = get_pool()
+    if pool is None:
+        return func(*args)
+
+    try:
+        return pool.submit(func, *args).result()
+    except BrokenProcessPool:
+        reset_pool()
+        return func(*args)
+
+
+def _call_or_error(func, data):
+    try:
+        return func(data)
+    except Exception as e:
+        return e
@@ -0,0 +1,205 @@
+"""
+Row parsing and validation for ``manage.py import_legacy_letters``.
+
+The importer reads the ledger as a stream of rows, cuts it into chunks of
+``CHUNK_ROWS`` and has ``validate_chunk`` turn each one into field values,
+warnings and rejections - on a process pool once there is more than one
+chunk, since trying every date format on every cell of a 60k-row ledger is
+CPU bound.  The command stays the single writer: it checks serials against
+the register (a set lookup) and inserts the batches in file order.
+
+Like letters/imaging.py this module is plain Python with no Django in sight,
+because on Windows the pool workers re-import it with *spawn*.  Datetimes
+come back naive unless the cell carried an offset; the writer makes them
+aware in the server's time zone.
+"""
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from itertools import chain, islice
+from typing import NamedTuple
+
+# The date formats found in the ledgers - 2019.03.04, 2019-03-04, 04/03/2019
+# and 04.03.2019 - as (pattern, order of year/month/day in its groups).
+# Matching these is several times cheaper than strptime trying each format.
+DATE_PATTERNS = (
+    (re.compile(r'(\d{4})\.(\d{1,2})\.(\d{1,2})'), (0, 1, 2)),
+    (re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})'), (0, 1, 2)),
+    (re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})'), (2, 1, 0)),
+    (re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})'), (2, 1, 0)),
+)
+# For timestamps fromisoformat does not take
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f%z', '%Y-%m-%d %H:%M:%S%z', '%Y-%m-%d %H:%M:%S')
+
+# Rows sent to a worker at a time
+CHUNK_ROWS = 2000
+# Chunks waiting on each worker; bounds how much of the file is in memory
+CHUNKS_IN_FLIGHT = 2
+
+BLANK = 'blank'
+REJECTED = 'rejected'
+VALID = 'valid'
+
+
+class ParsedRow(NamedTuple):
+    row_num: int
+    outcome: str
+    # Letter field values plus ``created_at``; for a rejected row only the raw serial_number
+    fields: dict
+    # Warnings for a valid row, the reason for a rejected one
+    issues: list
+    # Fields not taken from the sheet as given - the cell could not be read or
+    # was not a known value, or was blank and a default stands in. An upsert
+    # leaves these alone rather than overwrite what is stored.
+    defaulted: frozenset = frozenset()
+
+
+def parse_serial(value):
+    # Excel hands numbers over as floats, and some sheets have them as text
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(value)
+        return int(value)
+    return int(str(value).strip())
+
+
+def parse_date(value):
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        for pattern, (year, month, day) in DATE_PATTERNS:
+            match = pattern.fullmatch(value)
+            if match:
+                parts = match.groups()
+                try:
+                    return date(int(parts[year]), int(parts[month]), int(parts[day]))
+                except ValueError:
+                    # 2019.02.30 and the like
+                    return None
+    return None
+
+
+def parse_datetime(value):
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            # Takes the usual "2019-03-04 09:30:00" far faster than strptime
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+        for fmt in DATETIME_FORMATS:
+            try:
+                return datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+    return None
+
+
+def validate_row(row_num, data, sectors, statuses):
+    """A ``ParsedRow`` for the row ``data`` (column name -> cell value)."""
+    serial_number = data.get('serial_number')
+
+    # Fully blank rows are common in exported Excel sheets
+    if serial_number is None:
+        return ParsedRow(row_num, BLANK, {}, [])
+
+    try:
+        serial_number = parse_serial(serial_number)
+    except ValueError:
+        return ParsedRow(row_num, REJECTED, {'serial_number': serial_number},
+                         [f"invalid serial_number '{serial_number}'"])
+
+    warnings = []
+    defaulted = set()
+    target_sector = data.get('target_sector')
+    if target_sector and target_sector not in sectors:
+        warnings.append(f"unrecognised sector '{target_sector}' - importing anyway, please verify.")
+        defaulted.add('target_sector')
+
+    status = data.get('status')
+    if not status:
+        status = 'PENDING'
+        defaulted.add('status')
+    elif status not in statuses:
+        warnings.append(f"unrecognised status '{status}', defaulting to PENDING.")
+        status = 'PENDING'
+        defaulted.add('status')
+
+    created_by = data.get('created_by')
+    if not created_by:
+        created_by = 'LEGACY_IMPORT'
+        defaulted.add('created_by')
+
+    parsed = {}
+    for name, parse in (('date_received', parse_date), ('replied_at', parse_date), ('created_at', parse_datetime)):
+        value = data.get(name)
+        parsed[name] = parse(value)
+        if value and parsed[name] is None:
+            warnings.append(f"unrecognised {name} '{value}', left empty.")
+            defaulted.add(name)
+
+    fields = {
+        'serial_number': serial_number,
+        'date_received': parsed['date_received'],
+        'sender_details': data.get('sender_details'),
+        'letter_type': data.get('letter_type'),
+        'accepting_officer_id': data.get('accepting_officer_id'),
+        'target_sector': target_sector,
+        'administrated_by': data.get('administrated_by'),
+        'status': status,
+        'replied_at': parsed['replied_at'],
+        'created_by': created_by,
+        'updated_by': data.get('updated_by'),
+        'created_at': parsed['created_at'],
+    }
+    return ParsedRow(row_num, VALID, fields, warnings, frozenset(defaulted))
+
+
+def validate_chunk(headers, rows, sectors, statuses):
+    """``validate_row`` over ``rows``, a list of (row number, cell values) pairs."""
+    return [validate_row(row_num, dict(zip(headers, values)), sectors, statuses) for row_num, values in rows]
+
+
+def validate_rows(headers, rows, sectors, statuses, workers=1):
+    """
+    ``ParsedRow``s for the (row number, cell values) pairs of ``rows``, in
+    order. With more than one worker and more than one chunk of rows the
+    chunks are validated on a process pool, at most ``CHUNKS_IN_FLIGHT`` per
+    worker at a time.
+    """
+    chunks = _chunked(rows, CHUNK_ROWS)
+    head = list(islice(chunks, 2))
+    chunks = chain(head, chunks)
+
+    if workers == 1 or len(head) < 2:
+        for chunk in chunks:
+            yield from validate_chunk(headers, chunk, sectors, statuses)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(validate_chunk, headers, chunk, sectors, statuses))
+            if len(pending) >= workers * CHUNKS_IN_FLIGHT:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -0,0 +1,245 @@
+import random
+import statistics
+import time
+import tracemalloc
+from io import BytesIO
+
+try:
+    import resource
+except ImportError:
+    # Windows: peak RSS is not reported
+    resource = None
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from openpyxl import Workbook
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from PIL import Image
+
+from letters.counters import invalidate_counters
+from letters.exports import HEADERS, SECTOR_COLORS, csv_chunks, ndjson_chunks, register_chunks, register_rows
+from letters.imaging import clean_scan, clean_scans, get_pool, worker_count
+from letters.models import Letter, SECTOR_CHOICES, STATUS_CHOICES
+from letters.pagination import KeysetPaginator
+from letters.search import search_letters
+
+SENDER_NAMES = [
+    'කිරි බණ්ඩා', 'සුමනාවතී පෙරේරා', 'ජයසේකර මුදලිගේ', 'නිමල් සිරිවර්ධන', 'ලක්ෂ්මන් රත්නායක',
+    'Kiri Banda', 'Sunil Perera', 'Ananda Wickramasinghe', 'Kamala Jayawardena', 'Ruwan Dissanayake',
+]
+SENDER_ORGS = [
+    'ප්‍රාදේශීය ලේකම් කාර්යාලය', 'ග්‍රාම නිලධාරී', 'Provincial Council', 'Divisional Secretariat',
+    'Road Development Authority', 'Water Board', 'Ceylon Electricity Board',
+]
+LETTER_TYPES = [
+    'වරිපනම් බදු', 'ගොඩනැගිලි අවසර පත්‍ර', 'මාර්ග අලුත්වැඩියාව', 'ජල සැපයුම',
+    'Trade licence renewal', 'Building approval', 'Tax assessment appeal', 'Street lamp complaint',
+]
+
+BENCH_QUERIES = ['Kiri', 'Perera', 'ගොඩනැගිලි', 'Water Board']
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure letter listing/search latency against a synthetic registry. '
+        'Rows are seeded inside a transaction that is always rolled back, so '
+        'nothing is left behind - but run it against a copy, not the live server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=['search', 'serial_jump', 'images', 'export'], help='What to measure')
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                            help='Registry sizes to measure at (ascending)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query (median is reported)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_create batch size while seeding')
+        parser.add_argument('--images', type=int, default=6,
+                            help='images: scans per upload (12MP each; a letter takes up to 6)')
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['rows'])
+        if not sizes or sizes[0] <= 0:
+            raise CommandError("--rows must be positive numbers.")
+
+        self.repeat = options['repeat']
+
+        if options['scenario'] == 'images':
+            # CPU only, no registry to seed
+            self.bench_images(options['images'])
+            return
+
+        self.stdout.write(f"Database: {connection.vendor}, scenario: {options['scenario']}")
+
+        with transaction.atomic():
+            seeded = 0
+            for size in sizes:
+                self.seed(size - seeded, seeded, options['batch_size'])
+                seeded = size
+                self.analyze()
+                self.stdout.write(self.style.MIGRATE_HEADING(f"\n{size:,} letters"))
+                getattr(self, f"bench_{options['scenario']}")()
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("\nDone, seeded rows rolled back."))
+
+    def seed(self, count, offset, batch_size):
+        if count <= 0:
+            return
+
+        rng = random.Random(offset)
+        start = (Letter.objects.aggregate(top=Max('serial_number'))['top'] or 0) + 1
+        sectors = [code for code, _ in SECTOR_CHOICES]
+        statuses = [code for code, _ in STATUS_CHOICES]
+
+        started = time.perf_counter()
+        batch = []
+        for serial in range(start, start + count):
+            batch.append(Letter(
+                serial_number=serial,
+                sender_details=f"{rng.choice(SENDER_NAMES)}, {rng.choice(SENDER_ORGS)}",
+                letter_type=rng.choice(LETTER_TYPES),
+                target_sector=rng.choice(sectors),
+                status=rng.choice(statuses),
+                accepting_officer_id=f"D/{rng.randint(1, 40)}",
+                created_by='BENCHMARK',
+            ))
+            if len(batch) >= batch_size:
+                Letter.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Letter.objects.bulk_create(batch)
+        # bulk_create sends no post_save
+        invalidate_counters()
+
+        self.stdout.write(f"Seeded {count:,} letters in {time.perf_counter() - started:.1f}s")
+
+    def analyze(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE letters_letter")
+
+    def timed(self, func):
+        runs = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            func()
+            runs.append((time.perf_counter() - started) * 1000)
+        return statistics.median(runs)
+
+    def report(self, label, millis):
+        self.stdout.write(f"  {label:<40} {millis:>10.2f} ms")
+
+    def bench_search(self):
+        letters = Letter.objects.order_by('serial_number')
+
+        for text in BENCH_QUERIES:
+            legacy = letters.filter(
+                Q(serial_number__icontains=text) |
+                Q(sender_details__icontains=text) |
+                Q(letter_type__icontains=text)
+            )
+            backend = search_letters(letters, text)
+
+            # What one dashboard search costs: the count plus the first page
+            self.report(f"icontains '{text}'", self.timed(lambda: (legacy.count(), list(legacy[:20]))))
+            self.report(f"search backend '{text}'", self.timed(lambda: (backend.count(), list(backend[:20]))))
+
+    def bench_serial_jump(self):
+        top = Letter.objects.aggregate(top=Max('serial_number'))['top']
+        rng = random.Random(top)
+        targets = [rng.randint(1, top) for _ in range(5)]
+
+        def offset_jump(letters, serial):
+            # The old jump: text-cast lookup, rows-before count, OFFSET page
+            target = letters.filter(serial_number__iexact=str(serial)).first()
+            if target:
+                position = letters.filter(serial_number__lt=target.serial_number).count()
+                start = (position // 20) * 20
+                list(letters[start:start + 20])
+
+        def keyset_jump(letters, serial):
+            target = letters.filter(serial_number=serial).first()
+            if target:
+                paginator = KeysetPaginator(letters, 20)
+                list(paginator.get_page(paginator.cursor_ending_at(serial)))
+
+        for label, letters in [
+            ('all sectors', Letter.objects.order_by('serial_number')),
+            ('HEALTH, pending', Letter.objects.filter(target_sector='HEALTH', status='PENDING').order_by('serial_number')),
+        ]:
+            self.report(f"offset jump ({label})",
+                        statistics.median(self.timed(lambda: offset_jump(letters, t)) for t in targets))
+            self.report(f"keyset jump ({label})",
+                        statistics.median(self.timed(lambda: keyset_jump(letters, t)) for t in targets))
+
+    def bench_images(self, count):
+        self.stdout.write(f"Cleaning up {count} synthetic 4000x3000 scans, {worker_count()} image worker(s)")
+
+        scans = []
+        for i in range(count):
+            # Noise rather than a flat colour, so JPEG decode/encode costs what a real photo does
+            noise = Image.effect_noise((4000, 3000), 40 + i)
+            data = BytesIO()
+            Image.merge('RGB', (noise, noise.rotate(90, expand=False), noise)).save(data, format='JPEG', quality=90)
+            scans.append(data.getvalue())
+
+        pool = get_pool()
+        if pool:
+            # Start the worker processes before timing, as a running server would have
+            clean_scans(scans[:2])
+
+        self.report("one after another", self.timed(lambda: [clean_scan(scan) for scan in scans]))
+        self.report("process pool", self.timed(lambda: clean_scans(scans)))
+
+    def measure(self, label, func):
+        """Wall time of one run of ``func``, then a second run under tracemalloc for its peak allocation."""
+        started = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - started
+
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        rss = ""
+        if resource:
+            # ru_maxrss is the peak of the whole process so far (KiB on Linux)
+            rss = f"  process peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.0f} MiB"
+        self.stdout.write(f"  {label:<40} {seconds:>8.2f} s  {peak / 2 ** 20:>8.1f} MiB allocated{rss}")
+
+    def bench_export(self):
+        letters = Letter.objects.order_by('serial_number')
+
+        def streamed(chunks=register_chunks):
+            for _ in chunks(letters):
+                pass
+
+        def in_memory():
+            # The export as it was: a full Workbook, new style objects per
+            # cell, then a pass over every cell for the column widths
+            workbook = Workbook()
+            sheet = workbook.active
+            side = Side(style='thin')
+            for number, header in enumerate(HEADERS, 1):
+                sheet.cell(row=1, column=number, value=header)
+            for row_number, (sector, row) in enumerate(register_rows(letters), 2):
+                color = SECTOR_COLORS.get(sector, 'FFFFFF')
+                for number, value in enumerate(row, 1):
+                    cell = sheet.cell(row=row_number, column=number, value=value)
+                    cell.fill = PatternFill(start_color=color, end_color=color, fill_type='solid')
+                    cell.border = Border(left=side, right=side, top=side, bottom=side)
+                    cell.alignment = Alignment(vertical='center')
+                    cell.font = Font()
+            for column in sheet.columns:
+                width = max(len(str(cell.value)) for cell in column)
+                sheet.column_dimensions[get_column_letter(column[0].column)].width = min(width + 3, 50)
+            workbook.save(BytesIO())
+
+        # Streamed first: the process peak RSS only ever goes up
+        self.measure("csv, streamed", lambda: streamed(csv_chunks))
+        self.measure("ndjson, streamed", lambda: streamed(ndjson_chunks))
+        self.measure("write-only, streamed", streamed)
+        self.measure("in-memory Workbook (before)", in_memory)
@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from letters.imaging import make_previews, map_images
+from letters.models import ATTACHMENT_FIELDS, AttachmentJob, Letter, MetaEntry, file_fingerprint
+from letters.renditions import has_renditions, save_renditions
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the thumbnail and preview renditions of attachments (scans, and '
+        'page 1 of PDFs) that do not have them yet, e.g. letters uploaded before '
+        'renditions existed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Recreate renditions that already exist')
+        parser.add_argument('--batch-size', type=int, default=12,
+                            help='Attachments rendered in parallel at a time (see IMAGE_PROCESS_WORKERS)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        self.force = options['force']
+        self.created = self.skipped = self.failed = 0
+
+        # Still-queued uploads get their renditions from the attachment worker
+        self.pending = set(AttachmentJob.objects.values_list('letter_id', 'field_name'))
+
+        has_attachment = Q()
+        for field_name in ATTACHMENT_FIELDS:
+            has_attachment |= Q(**{f"{field_name}__gt": ''})
+        letters = Letter.objects.filter(has_attachment).only('pk', 'serial_number', *ATTACHMENT_FIELDS)
+
+        batch = []
+        for letter in letters.iterator():
+            for field_name in ATTACHMENT_FIELDS:
+                field = getattr(letter, field_name)
+                if self.wanted(letter, field_name, field):
+                    batch.append((letter, field_name, field))
+            if len(batch) >= options['batch_size']:
+                self.render(batch)
+                batch = []
+        if batch:
+            self.render(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created renditions for {self.created} attachment(s); "
+            f"{self.skipped} already had them, {self.failed} could not be rendered."
+        ))
+
+    def wanted(self, letter, field_name, field):
+        if not field or (letter.pk, field_name) in self.pending:
+            return False
+        if not self.force and has_renditions(field.storage, field.name):
+            self.skipped += 1
+            return False
+        return True
+
+    def render(self, batch):
+        images = []
+        for _, _, field in batch:
+            try:
+                with field.storage.open(field.name, 'rb') as source:
+                    images.append(source.read())
+            except OSError as e:
+                images.append(e)
+
+        readable = [data for data in images if not isinstance(data, Exception)]
+        results = iter(map_images(make_previews, readable))
+
+        for (letter, field_name, field), data in zip(batch, images):
+            result = data if isinstance(data, Exception) else next(results)
+            if not isinstance(result, Exception) and not result[0]:
+                result = ValueError("PDF previews need PyMuPDF")
+            if isinstance(result, Exception):
+                # Other files stored as uploaded are served in full
+                self.failed += 1
+                self.stderr.write(f"  {field.name}: {result}")
+                continue
+
+            renditions, pages = result
+            save_renditions(field.storage, field.name, renditions)
+            Letter.objects.filter(pk=letter.pk, **{field_name: field.name}).update(
+                attachment_meta=MetaEntry(field_name, file_fingerprint(field.name, data, renditions, pages))
+            )
+            self.created += 1
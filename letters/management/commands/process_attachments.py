@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from letters.attachments import process_pending, requeue_stale_jobs, run_worker, worker_count
+from letters.models import AttachmentJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Process uploaded attachments queued by Letter.save (rotate, grayscale, '
+        'contrast, resize). Runs until stopped unless --once is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Attachments processed in parallel (default: settings.ATTACHMENT_WORKERS)')
+        parser.add_argument('--once', action='store_true', help='Empty the queue once and exit')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between checks when idle')
+        parser.add_argument('--retry-failed', action='store_true', help='Put failed jobs back in the queue first')
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or worker_count()
+        if workers < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        if options['retry_failed']:
+            retried = AttachmentJob.objects.filter(status=AttachmentJob.FAILED).update(
+                status=AttachmentJob.QUEUED, attempts=0, error=''
+            )
+            self.stdout.write(f"Re-queued {retried} failed attachment(s).")
+
+        if options['once']:
+            requeue_stale_jobs()
+            handled = process_pending(workers)
+            failed = AttachmentJob.objects.filter(status=AttachmentJob.FAILED).count()
+            self.stdout.write(self.style.SUCCESS(f"Processed {handled} attachment(s), {failed} failed."))
+            return
+
+        self.stdout.write(f"Processing attachments with {workers} worker(s). Press Ctrl+C to stop.")
+        try:
+            run_worker(workers, options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
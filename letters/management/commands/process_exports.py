@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from letters.export_jobs import process_pending_exports, purge_old_exports, requeue_stale_exports, run_export_worker
+from letters.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the Excel exports queued from the admin letter list. Runs until '
+        'stopped unless --once is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Empty the queue once and exit')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between checks when idle')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            requeue_stale_exports()
+            handled = process_pending_exports()
+            purged = purge_old_exports()
+            failed = ExportJob.objects.filter(status=ExportJob.FAILED).count()
+            self.stdout.write(self.style.SUCCESS(
+                f"Built {handled} export(s), {failed} failed; removed {purged} old export(s)."
+            ))
+            return
+
+        self.stdout.write("Building exports. Press Ctrl+C to stop.")
+        try:
+            run_export_worker(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
@@ -0,0 +1,125 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:06
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Labels are frozen here on purpose: a migration must keep producing the same
+# trigger even if the choices in models.py are reworded later.
+SECTOR_SEARCH_LABELS = {
+    'ADMINISTRATION': 'Administration Section පාලන අංශය',
+    'HEALTH': 'Health Section සෞඛ්‍ය අංශය',
+    'DEVELOPMENT': 'Development Section සංවර්ධන අංශය',
+    'REVENUE': 'Revenue Section ආදායම් අංශය',
+    'ACCOUNTS': 'Accounts Section ගිණුම් අංශය',
+}
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Kept out of Letter.Meta (and so out of the migration state): SQLite cannot
+# build a GIN index, and would try to whenever it rebuilds letters_letter.
+CREATE_GIN_INDEX_SQL = "CREATE INDEX letters_letter_search_gin ON letters_letter USING gin (search_vector)"
+DROP_GIN_INDEX_SQL = "DROP INDEX IF EXISTS letters_letter_search_gin"
+
+
+def sector_label_sql():
+    cases = "\n".join(
+        f"            WHEN '{code}' THEN '{code} {label}'"
+        for code, label in SECTOR_SEARCH_LABELS.items()
+    )
+    return f"""CASE NEW.target_sector
+{cases}
+            ELSE coalesce(NEW.target_sector, '')
+        END"""
+
+
+CREATE_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION letters_letter_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', NEW.serial_number::text), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.sender_details, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.letter_type, '')), 'B') ||
+        setweight(to_tsvector('simple', {sector_label_sql()}), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS letters_letter_search_vector_trigger ON letters_letter;
+CREATE TRIGGER letters_letter_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF serial_number, sender_details, letter_type, target_sector
+    ON letters_letter
+    FOR EACH ROW EXECUTE FUNCTION letters_letter_search_vector_update();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS letters_letter_search_vector_trigger ON letters_letter;
+DROP FUNCTION IF EXISTS letters_letter_search_vector_update();
+"""
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_TRIGGER_SQL)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_TRIGGER_SQL)
+
+
+def backfill_search_vector(apps, schema_editor):
+    """
+    Touch every existing row in id-range batches so the trigger fills in the
+    vector. The migration is non-atomic, so each batch commits on its own and
+    a large registry is never locked as a whole.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT min(id), max(id) FROM letters_letter")
+        min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            return
+
+        for start in range(min_id, max_id + 1, BACKFILL_BATCH_SIZE):
+            cursor.execute(
+                "UPDATE letters_letter SET sender_details = sender_details "
+                "WHERE id >= %s AND id < %s",
+                [start, start + BACKFILL_BATCH_SIZE],
+            )
+
+
+def create_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_GIN_INDEX_SQL)
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_GIN_INDEX_SQL)
+
+
+class Migration(migrations.Migration):
+
+    # Backfill batches commit one by one
+    atomic = False
+
+    dependencies = [
+        ('letters', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='letter',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_trigger, drop_trigger),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+        migrations.RunPython(create_gin_index, drop_gin_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:20
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Built on UPPER(column) because that is exactly what Django's icontains
+# lookup compares against on PostgreSQL, so the substring search can use them.
+# Like the search index in 0002 they are PostgreSQL only and not part of the
+# model state.
+TRIGRAM_INDEXES = {
+    'letters_letter_sender_trgm': 'sender_details',
+    'letters_letter_type_trgm': 'letter_type',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(f"CREATE INDEX {name} ON letters_letter USING gin ((UPPER({column})) gin_trgm_ops)")
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0002_letter_search_vector'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0.1 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+LISTING_INDEXES = [
+    models.Index(fields=['target_sector', 'serial_number'], name='letters_letter_sector_serial'),
+    models.Index(fields=['status', 'serial_number'], name='letters_letter_status_serial'),
+    models.Index(
+        fields=['target_sector', 'serial_number'],
+        condition=models.Q(status='PENDING'),
+        name='letters_letter_pending_sector',
+    ),
+    models.Index(fields=['date_received'], name='letters_letter_date_received'),
+]
+
+
+# On PostgreSQL the indexes are built CONCURRENTLY so that applying this
+# migration on the live registry does not lock out the clerks while it runs.
+def create_listing_indexes(apps, schema_editor):
+    model = apps.get_model('letters', 'Letter')
+    concurrently = schema_editor.connection.vendor == 'postgresql'
+    for index in LISTING_INDEXES:
+        if concurrently:
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+
+def drop_listing_indexes(apps, schema_editor):
+    model = apps.get_model('letters', 'Letter')
+    concurrently = schema_editor.connection.vendor == 'postgresql'
+    for index in LISTING_INDEXES:
+        if concurrently:
+            schema_editor.remove_index(model, index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('letters', '0003_letter_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='letter', index=index)
+                for index in LISTING_INDEXES
+            ],
+            database_operations=[
+                migrations.RunPython(create_listing_indexes, drop_listing_indexes),
+            ],
+        ),
+    ]
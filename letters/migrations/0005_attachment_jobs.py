@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0004_letter_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field_name', models.CharField(choices=[('attachment_1', 'attachment_1'), ('attachment_2', 'attachment_2'), ('attachment_3', 'attachment_3'), ('attachment_4', 'attachment_4'), ('attachment_5', 'attachment_5'), ('attachment_6', 'attachment_6')], max_length=20)),
+                ('source_name', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('QUEUED', 'Queued'), ('PROCESSING', 'Processing'), ('FAILED', 'Failed')], default='QUEUED', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('letter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachment_jobs', to='letters.letter')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='letters_job_status_id')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0005_attachment_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='letter',
+            name='attachment_meta',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
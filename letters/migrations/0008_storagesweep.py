@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0007_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageSweep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phase', models.CharField(choices=[('FILES', 'Files'), ('LETTERS', 'Letters')], default='FILES', max_length=10)),
+                ('position', models.CharField(blank=True, max_length=255)),
+                ('files_checked', models.PositiveIntegerField(default=0)),
+                ('orphans', models.PositiveIntegerField(default=0)),
+                ('orphan_bytes', models.PositiveBigIntegerField(default=0)),
+                ('bytes_reclaimed', models.PositiveBigIntegerField(default=0)),
+                ('missing', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
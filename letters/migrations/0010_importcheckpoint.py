@@ -0,0 +1,33 @@
+# Generated by Django 6.0.1 on 2026-10-18 22:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0009_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_sha256', models.CharField(max_length=64)),
+                ('sheet', models.CharField(blank=True, max_length=255)),
+                ('file_name', models.CharField(blank=True, max_length=255)),
+                ('last_row', models.PositiveIntegerField(default=1)),
+                ('created', models.PositiveIntegerField(default=0)),
+                ('skipped_blank', models.PositiveIntegerField(default=0)),
+                ('skipped_duplicate', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('file_sha256', 'sheet'), name='import_checkpoint_file_sheet')],
+            },
+        ),
+    ]
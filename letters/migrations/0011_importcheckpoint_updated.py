@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0010_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importcheckpoint',
+            name='updated',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.1 on 2026-10-18 23:20
+
+from django.db import migrations, models
+
+
+def create_row(apps, schema_editor):
+    # The one row writers bump; created here so the first bump is a plain UPDATE
+    apps.get_model('letters', 'CounterVersion').objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0011_importcheckpoint_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_row, migrations.RunPython.noop),
+    ]
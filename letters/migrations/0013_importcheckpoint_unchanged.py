@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0012_counterversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importcheckpoint',
+            name='field_changes',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='importcheckpoint',
+            name='unchanged',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
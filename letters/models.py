@@ -1,12 +1,22 @@
+import hashlib
+import json
 import os
+import uuid
 from io import BytesIO
-from PIL import Image, ImageEnhance, ImageOps
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
+from django.core.files.base import ContentFile, File
 from django.core.files.uploadedfile import UploadedFile, InMemoryUploadedFile
+from django.db.models import F, Func, JSONField
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from simple_history.models import HistoricalRecords
 
+from .imaging import PDF, clean_scan, extension_for, map_images, pdf_page_count, process_upload, sniff_content_type
+from .renditions import delete_renditions, has_renditions, save_renditions
+
 # Create your models here.
 
 from django.db import models
@@ -27,6 +37,15 @@ SECTOR_CHOICES = [
     ('ACCOUNTS', _('Accounts Section')),
 ]
 
+# Sinhala sector names as printed on the Excel register and indexed for search
+SECTOR_SINHALA_NAMES = {
+    'ADMINISTRATION': 'පාලන අංශය',
+    'HEALTH': 'සෞඛ්‍ය අංශය',
+    'DEVELOPMENT': 'සංවර්ධන අංශය',
+    'REVENUE': 'ආදායම් අංශය',
+    'ACCOUNTS': 'ගිණුම් අංශය',
+}
+
 STATUS_CHOICES = [
     ('PENDING', _('Pending')),
     ('REPLIED', _('Replied')),
@@ -34,47 +53,105 @@ STATUS_CHOICES = [
     ('ADMIN_UPDATED', _('Admin Updated')),
 ]
 
+ATTACHMENT_FIELDS = [
+    'attachment_1', 'attachment_2', 'attachment_3',
+    'attachment_4', 'attachment_5', 'attachment_6',
+]
+
 def letter_directory_path (instance, filename):
     return f'letters/{instance.serial_number}/{filename}'
 
-def process_scanned_image(image_field, field_name, serial_number):
-    if not image_field:
-        return image_field
-
-    img = Image.open(image_field)
-
-    img = ImageOps.exif_transpose(img)
-
-    img = img.convert('L')
+# Attachments are stored once per content, see Blob
+BLOB_DIRECTORY = 'blobs'
+# Where a blob is written before it is linked onto its name; a file left here
+# by a crash is an orphan to manage.py sweep_attachments like any other
+STAGING_DIRECTORY = f'{BLOB_DIRECTORY}/tmp'
 
-    contrast_enhancer = ImageEnhance.Contrast(img)
-    img = contrast_enhancer.enhance(1.8)
+def blob_name(digest, ext):
+    return f'{BLOB_DIRECTORY}/{digest[:2]}/{digest}{ext.lower()}'
 
-    sharpness_enhancer = ImageEnhance.Sharpness(img)
-    img = sharpness_enhancer.enhance(2.0)
-
-    max_size = (1200, 1600)
-    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-
-    output = BytesIO()
-
-    img.save(output, format='JPEG', quality=60, optimize=True)
-    output.seek(0)
+def blob_digest(name):
+    """The SHA-256 a blob is named after, or None for a file stored before blobs existed."""
+    if not name.startswith(f'{BLOB_DIRECTORY}/'):
+        return None
+    return os.path.splitext(os.path.basename(name))[0]
 
+def processed_upload(data, field_name, serial_number):
+    """Wrap the JPEG bytes from ``clean_scan`` as the upload stored for ``field_name``."""
     attachment_number = field_name.split('_')[-1]
     filename = f"Attachment_{serial_number}_{attachment_number}.jpg"
 
     new_image = InMemoryUploadedFile (
-        output,
+        BytesIO(data),
         'FileField',
         filename,
         'image/jpeg',
-        output.tell(),
+        len(data),
         None
     )
 
     return new_image
 
+def file_fingerprint(name, data, renditions=None, pages=None):
+    """
+    What serve_attachment needs to know about a stored attachment, taken
+    when it is stored: validators for conditional requests, its type and
+    size, whether it has renditions and, for a PDF, its page count.
+    ``data`` is the file's content, or the upload itself when that was
+    stored as a blob without being read into memory.
+    """
+    if isinstance(data, bytes):
+        head, size = data[:16], len(data)
+    else:
+        data.seek(0)
+        head, size = data.read(16), data.size
+    fingerprint = {
+        'name': name,
+        'sha256': blob_digest(name) or hashlib.sha256(data).hexdigest(),
+        'size': size,
+        'content_type': sniff_content_type(head),
+        'modified': timezone.now().isoformat(),
+        'renditions': bool(renditions),
+    }
+    if pages:
+        fingerprint['pages'] = pages
+    return fingerprint
+
+
+class MetaEntry(Func):
+    """
+    ``attachment_meta`` with the entry ``key`` set to ``value`` (or removed
+    when it is None), computed by the database inside the UPDATE - so jobs
+    for different attachments of one letter never overwrite each other.
+    Several entries are set by passing one MetaEntry as the ``source`` of
+    the next.
+    """
+    output_field = JSONField()
+
+    def __init__(self, key, value, source=None):
+        self.key = key
+        self.value = value
+        super().__init__(source or F('attachment_meta'))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        if self.value is None:
+            return f"JSON_REMOVE({column}, %s)", (*params, f"$.{self.key}")
+        return f"JSON_SET({column}, %s, JSON(%s))", (*params, f"$.{self.key}", json.dumps(self.value))
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        if self.value is None:
+            return f"({column} - %s)", (*params, self.key)
+        return f"({column} || jsonb_build_object(%s, %s::jsonb))", (*params, self.key, json.dumps(self.value))
+
+
+def process_scanned_image(image_field, field_name, serial_number):
+    if not image_field:
+        return image_field
+
+    return processed_upload(clean_scan(image_field.read()), field_name, serial_number)
+
 
 class Letter(models.Model):
 
@@ -99,33 +176,207 @@ class Letter(models.Model):
     created_by = models.CharField(max_length=150, blank=True, null=True)
     updated_by = models.CharField(max_length=150, blank=True, null=True)
 
-    history = HistoricalRecords()
+    # Maintained by a PostgreSQL trigger (see migration 0002), never written from Python.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # {field_name: file_fingerprint(...)} for the stored attachments,
+    # giving their ETag and Last-Modified without opening the files.
+    attachment_meta = models.JSONField(default=dict, blank=True, editable=False)
+
+    history = HistoricalRecords(excluded_fields=['search_vector', 'attachment_meta'])
 
     class Meta:
         ordering = ['serial_number']
+        # The GIN indexes behind letters/search.py - letters_letter_search_gin
+        # and the pg_trgm ones - are PostgreSQL only and made by migrations
+        # 0002 and 0003 outside the model state, so SQLite never sees them.
+        indexes = [
+            # Listing filters, each followed by the serial_number the pages are ordered by
+            models.Index(fields=['target_sector', 'serial_number'], name='letters_letter_sector_serial'),
+            models.Index(fields=['status', 'serial_number'], name='letters_letter_status_serial'),
+            models.Index(fields=['target_sector', 'serial_number'], condition=models.Q(status='PENDING'),
+                         name='letters_letter_pending_sector'),
+            models.Index(fields=['date_received'], name='letters_letter_date_received'),
+        ]
 
     def __str__(self):
         return f"{self.serial_number} ({self.get_target_sector_display()})"
 
-    def save(self, *args, **kwargs):
-        attachment_fields = [
-            'attachment_1', 'attachment_2', 'attachment_3',
-            'attachment_4', 'attachment_5', 'attachment_6'
-        ]
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored attachment names, so the pre_save signal can tell which
+        # ones an edit replaced without reading the row again
+        instance._loaded_attachments = {
+            field_name: value for field_name, value in zip(field_names, values) if field_name in ATTACHMENT_FIELDS
+        }
+        return instance
 
-        for field_name in attachment_fields:
+    def save(self, *args, **kwargs):
+        # 'background' stores the upload as-is and leaves the scan clean-up to
+        # the attachment worker (letters/attachments.py), 'sync' does it here.
+        background = getattr(settings, 'ATTACHMENT_PROCESSING', 'background') == 'background'
+        queued = []
+        uploads = []
+        stored = {}
+        previews = {}
+
+        for field_name in ATTACHMENT_FIELDS:
             field = getattr(self, field_name)
 
-            if field and isinstance(field.file, UploadedFile):
-                try:
-                    processed_file = process_scanned_image(field, field_name, self.serial_number)
-                    setattr(self, field_name, processed_file)
-                except Exception as e:
-                    ext = os.path.splitext(field.name)[1]
-                    attachment_number = field_name.split('_')[-1]
-                    field.name = f"Attachment_{self.serial_number}_{attachment_number}{ext}"
+            # Not field.file alone: for a stored file that opens it, and the
+            # worker may have swapped it out since this letter was loaded
+            if field and not field._committed and isinstance(field.file, UploadedFile):
+                field.seek(0)
+                # From the content, never the uploaded name: a blob is not
+                # stored as .html or .svg whatever it was uploaded as
+                content_type = sniff_content_type(field.read(16))
+                field.seek(0)
+
+                if background:
+                    # Streamed into storage as uploaded, hashed on the way
+                    # (see BlobManager.store); the worker reads it
+                    stored[field_name] = (field.file, extension_for(content_type))
+                    queued.append(field_name)
+                    continue
+
+                data = field.read()
+                field.seek(0)
+                if content_type == PDF:
+                    # Kept as uploaded; only its previews are made
+                    stored[field_name] = (data, '.pdf')
+                uploads.append((field_name, data))
+
+        if uploads:
+            # All of this save's uploads at once, one per core (letters/imaging.py)
+            results = map_images(process_upload, [data for _, data in uploads])
+
+            for (field_name, data), result in zip(uploads, results):
+                if isinstance(result, Exception):
+                    # Not an image Pillow can read: store it as uploaded
+                    stored[field_name] = (data, extension_for(sniff_content_type(data[:16])))
+                    continue
+
+                processed, renditions, pages = result
+                if field_name not in stored:
+                    stored[field_name] = (processed, '.jpg')
+                previews[field_name] = (renditions, pages)
+
+        # Only a save storing files needs the savepoint
+        with transaction.atomic(savepoint=bool(stored)):
+            # An identical file already stored for another letter is reused
+            blobs = {}
+            for field_name, (data, ext) in stored.items():
+                storage = getattr(self, field_name).storage
+                blobs[field_name] = Blob.objects.store(storage, data, ext)
+                setattr(self, field_name, blobs[field_name][0].name)
+            # Tells the pre_save signal to release the old reference even if the
+            # same file was uploaded again
+            self._stored_attachments = set(stored)
+
+            if not self._state.adding and 'update_fields' not in kwargs:
+                kwargs['update_fields'] = self.changed_fields(stored)
+            super().save(*args, **kwargs)
+
+            # Entry by entry, like the worker: the rest may be newer than ours
+            changes = {
+                field_name: None for field_name in self.attachment_meta
+                if field_name not in stored and not getattr(self, field_name)
+            }
+            for field_name, (data, _ext) in stored.items():
+                field = getattr(self, field_name)
+                created = blobs[field_name][1]
+                renditions, pages = previews.get(field_name, ({}, None))
+                if created or not has_renditions(field.storage, field.name):
+                    save_renditions(field.storage, field.name, renditions)
+                changes[field_name] = file_fingerprint(field.name, data, renditions, pages)
+            if changes:
+                meta = F('attachment_meta')
+                for field_name, fingerprint in changes.items():
+                    meta = MetaEntry(field_name, fingerprint, meta)
+                    if fingerprint is None:
+                        self.attachment_meta.pop(field_name, None)
+                    else:
+                        self.attachment_meta[field_name] = fingerprint
+                Letter.objects.filter(pk=self.pk).update(attachment_meta=meta)
+
+            if queued:
+                AttachmentJob.objects.filter(letter=self, field_name__in=queued).delete()
+                AttachmentJob.objects.bulk_create([
+                    AttachmentJob(letter=self, field_name=field_name, source_name=getattr(self, field_name).name)
+                    for field_name in queued
+                ])
+
+        self._loaded_attachments = {field_name: getattr(self, field_name).name or '' for field_name in ATTACHMENT_FIELDS}
+
+    def changed_fields(self, stored):
+        """
+        The fields an edit writes: all but the attachments it left as they
+        were loaded, and attachment_meta. The attachment worker may have
+        swapped in a processed file since, which the names this letter was
+        loaded with would put back.
+        """
+        loaded = getattr(self, '_loaded_attachments', {})
+        deferred = self.get_deferred_fields()
+        unchanged = {
+            field_name for field_name in ATTACHMENT_FIELDS
+            if field_name in loaded and field_name not in stored
+            and (getattr(self, field_name).name or '') == (loaded[field_name] or '')
+        }
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname not in deferred
+            and field.name not in unchanged and field.name != 'attachment_meta'
+        ]
 
-        super().save(*args, **kwargs)
+    def attachment_fingerprint(self, field_name):
+        """
+        The stored fingerprint of an attachment; computed from the file and
+        saved the first time for attachments older than attachment_meta, or
+        when an edit raced the worker and left a stale one.
+        """
+        field = getattr(self, field_name)
+        fingerprint = self.attachment_meta.get(field_name)
+        if fingerprint and fingerprint['name'] == field.name and 'content_type' in fingerprint:
+            return fingerprint
+
+        digest = blob_digest(field.name)
+        with field.storage.open(field.name, 'rb') as source:
+            if digest:
+                # A blob is named after its hash: only the head is needed
+                head = source.read(16)
+                size = source.size
+            else:
+                hasher = hashlib.sha256()
+                size = 0
+                head = b''
+                for chunk in source.chunks():
+                    head = head or chunk[:16]
+                    hasher.update(chunk)
+                    size += len(chunk)
+                digest = hasher.hexdigest()
+        fingerprint = {
+            'name': field.name,
+            'sha256': digest,
+            'size': size,
+            'content_type': sniff_content_type(head),
+            'modified': field.storage.get_modified_time(field.name).isoformat(),
+            'renditions': has_renditions(field.storage, field.name),
+        }
+        if fingerprint['content_type'] == PDF:
+            with field.storage.open(field.name, 'rb') as source:
+                fingerprint['pages'] = pdf_page_count(source.read())
+
+        self.attachment_meta[field_name] = fingerprint
+        # Only this attachment's entry: the worker may be writing another one
+        Letter.objects.filter(pk=self.pk, **{field_name: field.name}).update(
+            attachment_meta=MetaEntry(field_name, fingerprint)
+        )
+        return fingerprint
+
+    def attachment_processing(self):
+        """Attachments whose processing is not finished yet, e.g. {'attachment_2': 'QUEUED'}."""
+        return dict(self.attachment_jobs.values_list('field_name', 'status'))
 
 class SectorProfile(models.Model):
     """
@@ -147,6 +398,295 @@ class LetterImage(models.Model):
         return f"Page for Letter #{self.letter.serial_number}"
 
 
+class HashingFile(File):
+    """``file`` hashed as the storage reads it through ``chunks()``."""
+
+    def __init__(self, file):
+        super().__init__(file)
+        self.hasher = hashlib.sha256()
+        self.bytes_read = 0
+
+    def chunks(self, chunk_size=None):
+        for chunk in super().chunks(chunk_size):
+            self.hasher.update(chunk)
+            self.bytes_read += len(chunk)
+            yield chunk
+
+
+class BlobManager(models.Manager):
+    # Single-statement updates, retried on a race, rather than locking
+    # transactions: several attachment workers store and release at once.
+
+    def store(self, storage, content, ext):
+        """
+        Take a reference to the blob holding ``content`` - bytes, or a file
+        such as an upload - writing the file only if no letter has it yet.
+        Returns (blob, created).
+
+        The content is written to a staging name and hashed in that same pass,
+        so an upload is never read into memory, then linked onto its content
+        address. Two saves of one file both stage it; the second link finds
+        the name taken and its copy is dropped, where storage.save() would
+        have kept it under a renamed duplicate.
+        """
+        if isinstance(content, bytes):
+            content = ContentFile(content)
+        hashed = HashingFile(content)
+        staged = storage.save(f'{STAGING_DIRECTORY}/{uuid.uuid4().hex}', hashed)
+        try:
+            digest = hashed.hasher.hexdigest()
+            while True:
+                if self.filter(pk=digest).update(ref_count=F('ref_count') + 1):
+                    blob, created = self.get(pk=digest), False
+                    break
+                try:
+                    with transaction.atomic():
+                        blob = self.create(
+                            sha256=digest, name=blob_name(digest, ext), size=hashed.bytes_read, ref_count=1,
+                        )
+                    created = True
+                    break
+                except IntegrityError:
+                    # Stored by someone else in the meantime
+                    continue
+
+            self.place(storage, staged, blob.name)
+        finally:
+            storage.delete(staged)
+        return blob, created
+
+    def place(self, storage, staged, name):
+        """Put the staged file at ``name`` unless a file is there already."""
+        try:
+            source, target = storage.path(staged), storage.path(name)
+        except NotImplementedError:
+            # Remote storage has no links: a copy saved under another name
+            # by the race is deleted again
+            if not storage.exists(name):
+                with storage.open(staged, 'rb') as source:
+                    saved = storage.save(name, source)
+                if saved != name:
+                    storage.delete(saved)
+            return
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            # Atomic: the name is either free and now this file, or taken
+            os.link(source, target)
+        except FileExistsError:
+            # The same content, written by another save
+            pass
+
+    def release(self, storage, name):
+        """
+        Drop one reference to the stored file ``name``; the file and its
+        renditions are deleted with the last one, once the transaction
+        commits - a rolled-back edit still has its files. Files stored before
+        blobs existed (letters/<serial>/...) have no row and are deleted
+        straight away. Returns whether the file is to be deleted.
+        """
+        while True:
+            if self.filter(name=name, ref_count__gt=1).update(ref_count=F('ref_count') - 1):
+                return False
+            if self.filter(name=name, ref_count__lte=1).delete()[0]:
+                break
+            if not self.filter(name=name).exists():
+                break
+
+        def delete_file():
+            if self.filter(name=name).exists():
+                # Stored again since
+                return
+            if storage.exists(name):
+                storage.delete(name)
+            delete_renditions(storage, name)
+
+        transaction.on_commit(delete_file)
+        return True
+
+
+class Blob(models.Model):
+    """
+    One stored attachment file, named after the SHA-256 of its content
+    (``blobs/ab/ab12...ef.jpg``), so the same circular or ID copy attached to
+    many letters is kept once. ``ref_count`` is the number of attachment
+    fields pointing at it; renditions are shared the same way.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BlobManager()
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} reference(s))"
+
+
+class AttachmentJob(models.Model):
+    """
+    A freshly uploaded attachment waiting to be cleaned up (rotated, grayscale,
+    contrast, resized) by the attachment worker. The row is deleted once the
+    processed file has been swapped in; what remains is queued, in progress
+    or failed.
+    """
+    QUEUED = 'QUEUED'
+    PROCESSING = 'PROCESSING'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (QUEUED, _('Queued')),
+        (PROCESSING, _('Processing')),
+        (FAILED, _('Failed')),
+    ]
+
+    letter = models.ForeignKey(Letter, related_name='attachment_jobs', on_delete=models.CASCADE)
+    field_name = models.CharField(max_length=20, choices=[(name, name) for name in ATTACHMENT_FIELDS])
+    # The stored upload this job was created for; if the attachment has been
+    # replaced since, the job is stale and its result is thrown away.
+    source_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='letters_job_status_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.field_name} of letter #{self.letter.serial_number} ({self.status})"
+
+
+class StorageSweep(models.Model):
+    """
+    Where ``manage.py sweep_attachments`` got to: first through the attachment
+    directories in media storage, then through the letters. An interrupted
+    run, or one stopped by --limit, carries on from here; the counters cover
+    the whole pass. A single row (id=1), removed when the pass is complete.
+    """
+    FILES = 'FILES'
+    LETTERS = 'LETTERS'
+    PHASE_CHOICES = [
+        (FILES, _('Files')),
+        (LETTERS, _('Letters')),
+    ]
+
+    phase = models.CharField(max_length=10, choices=PHASE_CHOICES, default=FILES)
+    # The last directory (FILES) or letter id (LETTERS) finished
+    position = models.CharField(max_length=255, blank=True)
+    files_checked = models.PositiveIntegerField(default=0)
+    orphans = models.PositiveIntegerField(default=0)
+    orphan_bytes = models.PositiveBigIntegerField(default=0)
+    bytes_reclaimed = models.PositiveBigIntegerField(default=0)
+    missing = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Storage sweep at {self.phase} {self.position or '(start)'}"
+
+
+class CounterVersion(models.Model):
+    """
+    Bumped by every write that changes what the letter counters count (see
+    letters/counters.py). The cached counters are keyed by it, so a write in
+    any process - the web server, a management command, the attachment
+    worker - retires the copies cached by all of them. A single row (id=1).
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Letter counters version {self.version}"
+
+
+class ImportCheckpoint(models.Model):
+    """
+    How far ``manage.py import_legacy_letters`` got with a file: the last
+    spreadsheet row whose batch was committed, and the counters so far. It is
+    saved in the same transaction as each batch, so a run cut short (power
+    cut, crash) can carry on with --resume after exactly the rows that went
+    in. Removed when the import completes.
+    """
+    # sha256 of the file's contents, so a renamed copy still resumes and an edited one does not
+    file_sha256 = models.CharField(max_length=64)
+    sheet = models.CharField(max_length=255, blank=True)
+    file_name = models.CharField(max_length=255, blank=True)
+    # Spreadsheet row number; 1 is the header
+    last_row = models.PositiveIntegerField(default=1)
+    created = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    unchanged = models.PositiveIntegerField(default=0)
+    # {field name: letters whose field an upsert changed}
+    field_changes = models.JSONField(default=dict, blank=True)
+    skipped_blank = models.PositiveIntegerField(default=0)
+    skipped_duplicate = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['file_sha256', 'sheet'], name='import_checkpoint_file_sheet'),
+        ]
+
+    def __str__(self):
+        return f"Import of {self.file_name or self.file_sha256[:12]} at row {self.last_row}"
+
+
+class ExportJob(models.Model):
+    """
+    An Excel export of the register asked for from the admin letter list and
+    built by the export worker (letters/export_jobs.py) instead of inside the
+    request. ``params`` are the list filters it was made with; a request for
+    the same filters soon after gets this job, and its file, back.
+    """
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (QUEUED, _('Queued')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    ]
+
+    params = models.JSONField(default=dict)
+    # sha256 of the normalized params, to find an identical export
+    params_key = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    rows_total = models.PositiveIntegerField(null=True, blank=True)
+    rows_done = models.PositiveIntegerField(default=0)
+    file = models.FileField(upload_to='exports/', blank=True)
+    # Name the file is downloaded as, without extension
+    filename = models.CharField(max_length=255, blank=True)
+    requested_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Touched with every progress update; a RUNNING job left behind by a dead worker stops moving
+    updated_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"Export #{self.pk} ({self.status})"
+
+    @property
+    def percent(self):
+        if self.status == self.DONE:
+            return 100
+        if not self.rows_total:
+            return 0
+        return min(100, self.rows_done * 100 // self.rows_total)
+
+
 class BackupSettings(models.Model):
     auto_backup_enabled = models.BooleanField(default=False)
     last_auto_backup_date = models.DateField(null=True, blank=True)
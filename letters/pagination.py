@@ -0,0 +1,131 @@
+"""
+Keyset ("seek") pagination for the letter registry.
+
+Django's ``Paginator`` needs a ``COUNT(*)`` and an ``OFFSET`` - both grow with
+the registry, and the dashboards open on the *last* page, the worst case for
+OFFSET.  Here pages are addressed by a cursor relative to ``serial_number``
+(unique and indexed), so every page is one ``ORDER BY ... LIMIT`` index range
+scan no matter how many letters there are.
+
+Cursors are short strings safe to put in a query string:
+
+    (none)    the latest letters
+    latest    the latest letters (overrides the serial jump)
+    first     the oldest letters
+    a<N>      the letters after serial N
+    b<N>      the letters before serial N
+"""
+import re
+
+CURSOR_PATTERN = re.compile(r'^([ab])(-?\d+)$')
+
+
+class KeysetPage:
+    is_keyset = True
+
+    def __init__(self, object_list, has_previous, has_next, key):
+        self.object_list = object_list
+        self._has_previous = has_previous
+        self._has_next = has_next
+        self.key = key
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    @property
+    def first_key(self):
+        return getattr(self.object_list[0], self.key) if self.object_list else None
+
+    @property
+    def last_key(self):
+        return getattr(self.object_list[-1], self.key) if self.object_list else None
+
+    @property
+    def previous_cursor(self):
+        return f"b{self.first_key}" if self._has_previous else None
+
+    @property
+    def next_cursor(self):
+        return f"a{self.last_key}" if self._has_next else None
+
+
+class KeysetPaginator:
+    """Paginate ``queryset`` by the unique integer field ``key`` (ascending within a page)."""
+
+    def __init__(self, queryset, per_page, key='serial_number'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.key = key
+
+    def get_page(self, cursor=None):
+        """
+        Return the page for ``cursor``. Like ``Paginator.get_page`` it never
+        raises: a malformed or out-of-range cursor gives the latest page.
+        """
+        if cursor == 'first':
+            return self._first()
+
+        match = CURSOR_PATTERN.match(cursor or '')
+        if match:
+            direction, value = match.group(1), int(match.group(2))
+            page = self._after(value) if direction == 'a' else self._before(value)
+            if page.object_list:
+                return page
+
+        return self._latest()
+
+    def cursor_ending_at(self, value):
+        """
+        Cursor of the page whose last row is ``value`` - used by the serial
+        jump, so a freshly added letter lands on the latest page.
+        """
+        return f"b{value + 1}"
+
+    def _fetch(self, queryset, descending):
+        order = f"-{self.key}" if descending else self.key
+        rows = list(queryset.order_by(order)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if descending:
+            rows.reverse()
+        return rows, has_more
+
+    def _exists(self, **lookup):
+        return self.queryset.filter(**lookup).exists()
+
+    def _first(self):
+        rows, has_next = self._fetch(self.queryset, descending=False)
+        return KeysetPage(rows, False, has_next, self.key)
+
+    def _latest(self):
+        rows, has_previous = self._fetch(self.queryset, descending=True)
+        return KeysetPage(rows, has_previous, False, self.key)
+
+    def _after(self, value):
+        rows, has_next = self._fetch(
+            self.queryset.filter(**{f"{self.key}__gt": value}), descending=False
+        )
+        has_previous = self._exists(**{f"{self.key}__lte": value})
+        return KeysetPage(rows, has_previous, has_next, self.key)
+
+    def _before(self, value):
+        rows, has_previous = self._fetch(
+            self.queryset.filter(**{f"{self.key}__lt": value}), descending=True
+        )
+        has_next = self._exists(**{f"{self.key}__gte": value})
+        return KeysetPage(rows, has_previous, has_next, self.key)
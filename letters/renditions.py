@@ -0,0 +1,93 @@
+"""
+Thumbnail and preview renditions of processed attachments.
+
+Each is a small JPEG stored next to its attachment - ``blobs/ab/ab12...ef.jpg``
+gets ``ab12...ef.thumb.jpg`` and ``ab12...ef.preview.jpg`` in the same
+directory - written when the scan is processed (``Letter.save`` in sync
+mode, the attachment worker otherwise) and served by ``serve_attachment``
+with ``?variant=thumb`` or ``?variant=preview``.  An attachment without them
+(uploaded before renditions existed, or not an image) is served in full;
+``manage.py generate_renditions`` fills them in for existing letters.
+
+A PDF's renditions show its first page.  Its pages are rendered one at a
+time when the viewer asks for them (``?page=3``) and kept next to it as
+``ab12...ef.page3.jpg``, so a long PDF is never sent whole to look at one
+page.  An attachment stored once for many letters (see ``Blob``) shares its
+renditions too; they are deleted with the file.
+"""
+import os
+
+from django.core.files.base import ContentFile
+
+from .imaging import RENDITION_SIZES, render_pdf_page, run_in_pool
+
+VARIANTS = list(RENDITION_SIZES)
+
+
+def rendition_name(name, variant):
+    root, _ = os.path.splitext(name)
+    return f"{root}.{variant}.jpg"
+
+
+def save_renditions(storage, name, renditions):
+    """Store ``renditions`` ({variant: bytes}, see ``make_renditions``) for the attachment ``name``."""
+    for variant, data in renditions.items():
+        # Fixed names, so the view can find them without a lookup table
+        replace_file(storage, rendition_name(name, variant), data)
+
+
+def page_name(name, page):
+    root, _ = os.path.splitext(name)
+    return f"{root}.page{page}.jpg"
+
+
+def page_rendition(file_field, page):
+    """Name of page ``page`` of the PDF ``file_field`` as a JPEG, rendering it the first time."""
+    storage = file_field.storage
+    target = page_name(file_field.name, page)
+    if storage.exists(target):
+        return target
+
+    try:
+        source = storage.path(file_field.name)
+    except NotImplementedError:
+        with storage.open(file_field.name, 'rb') as pdf:
+            source = pdf.read()
+    replace_file(storage, target, run_in_pool(render_pdf_page, source, page))
+    return target
+
+
+def replace_file(storage, target, data):
+    if storage.exists(target):
+        storage.delete(target)
+    storage.save(target, ContentFile(data))
+
+
+def delete_renditions(storage, name):
+    for variant in VARIANTS:
+        target = rendition_name(name, variant)
+        if storage.exists(target):
+            storage.delete(target)
+
+    directory, filename = os.path.split(name)
+    pages = f"{os.path.splitext(filename)[0]}.page"
+    try:
+        files = storage.listdir(directory)[1]
+    except FileNotFoundError:
+        return
+    for rendered in files:
+        if rendered.startswith(pages) and rendered.endswith('.jpg'):
+            storage.delete(f"{directory}/{rendered}")
+
+
+def has_renditions(storage, name):
+    return all(storage.exists(rendition_name(name, variant)) for variant in VARIANTS)
+
+
+def rendition_or_original(file_field, variant):
+    """Name of the ``variant`` rendition of ``file_field`` if it has been made, else the attachment itself."""
+    if variant:
+        target = rendition_name(file_field.name, variant)
+        if file_field.storage.exists(target):
+            return target
+    return file_field.name
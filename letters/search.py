@@ -0,0 +1,218 @@
+"""
+Letter search backend shared by the sector dashboard, the admin letter list
+and the Excel export.
+
+On PostgreSQL free-text queries run against ``Letter.search_vector`` (kept up
+to date by the trigger installed in migration 0002) through its GIN index and
+come back ranked, best match first.  Partial words inside sender names and
+subjects still match through ``icontains``, served by the trigram indexes from
+migration 0003, which also power the similarity ranked "fuzzy" search mode.
+Other databases - SQLite in the test suite - fall back to the plain
+``icontains`` chain.
+
+Date searches are parsed into ``date_received`` ranges, and serial searches
+into exact integer lookups, so that both are served by plain b-tree indexes.
+"""
+import calendar
+import re
+from datetime import date
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest, Upper
+
+# 'simple' does no stemming, which is what we want for Sinhala names and for
+# serial numbers / officer codes mixed in with English words.
+SEARCH_CONFIG = 'simple'
+
+RANK_ANNOTATION = 'search_rank'
+
+DATE_RANGE_SEPARATOR = '..'
+
+# 2026, 2026-03 or 2026-03-14 (slashes are accepted too)
+DATE_PATTERN = re.compile(r'^(\d{4})(?:[-/](\d{1,2})(?:[-/](\d{1,2}))?)?$')
+
+# Characters with a meaning in tsquery syntax; stripped from user input so a
+# clerk typing "Kiri (Banda)" cannot produce a syntax error.
+TSQUERY_SPECIAL_CHARS = re.compile(r"[&|!():*<>'\\]")
+
+
+def parse_serial(text):
+    """
+    The serial number typed into the jump box ("48213", "#48213"), or None.
+    Looked up as an integer so the jump is a unique-index probe - ``iexact``
+    would compare the column cast to text and scan the whole table.
+    """
+    try:
+        return int(text.strip().lstrip('#'))
+    except ValueError:
+        return None
+
+
+def parse_date_bounds(text):
+    """
+    First and last day covered by a year, a month or a single date:
+    "2026" -> (2026-01-01, 2026-12-31), "2026-03" -> (2026-03-01, 2026-03-31).
+    Returns None if ``text`` is not one of those.
+    """
+    match = DATE_PATTERN.match(text.strip())
+    if not match:
+        return None
+
+    year, month, day = (int(part) if part else None for part in match.groups())
+    try:
+        if day is not None:
+            single = date(year, month, day)
+            return single, single
+        if month is not None:
+            return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+        return date(year, 1, 1), date(year, 12, 31)
+    except ValueError:
+        return None
+
+
+def parse_date_range(text):
+    """
+    Parse a date search into inclusive ``(start, end)`` bounds. Accepts what
+    ``parse_date_bounds`` does plus ranges of them - "2026-01-01..2026-02-15",
+    "2026-01..2026-03" - which may be open on either side ("2026-03..").
+    Returns None when the text is not a date search.
+    """
+    text = text.strip()
+    if DATE_RANGE_SEPARATOR not in text:
+        return parse_date_bounds(text)
+
+    start_text, end_text = (part.strip() for part in text.split(DATE_RANGE_SEPARATOR, 1))
+    if not start_text and not end_text:
+        return None
+
+    start_bounds = parse_date_bounds(start_text) if start_text else (None, None)
+    end_bounds = parse_date_bounds(end_text) if end_text else (None, None)
+    if start_bounds is None or end_bounds is None:
+        return None
+
+    # Typed backwards ("2026-02..2026-01"): still both months
+    if start_text and end_text and start_bounds[0] > end_bounds[0]:
+        start_bounds, end_bounds = end_bounds, start_bounds
+    return start_bounds[0], end_bounds[1]
+
+
+def date_search_letters(letters, text):
+    """Letters received within the dates ``text`` describes; none if it is not a date."""
+    bounds = parse_date_range(text)
+    if bounds is None:
+        return letters.none()
+
+    start, end = bounds
+    if start and end:
+        return letters.filter(date_received__range=(start, end))
+    if start:
+        return letters.filter(date_received__gte=start)
+    return letters.filter(date_received__lte=end)
+
+
+def full_text_enabled(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def build_search_query(text):
+    """
+    Turn what the clerk typed into a prefix-matching tsquery, so that the
+    search box keeps matching while a name is still being typed.
+    Returns None when nothing searchable is left.
+    """
+    terms = []
+    for word in text.split():
+        word = TSQUERY_SPECIAL_CHARS.sub('', word)
+        if word:
+            terms.append(f"{word}:*")
+
+    if not terms:
+        return None
+
+    return SearchQuery(' & '.join(terms), config=SEARCH_CONFIG, search_type='raw')
+
+
+def search_letters(letters, text):
+    """Filter ``letters`` by free text across serial, sender, subject and sector."""
+    text = text.strip()
+    if not text:
+        return letters
+
+    if not full_text_enabled(letters):
+        return letters.filter(
+            Q(serial_number__icontains=text) |
+            Q(sender_details__icontains=text) |
+            Q(letter_type__icontains=text) |
+            Q(target_sector__icontains=text)
+        )
+
+    # Whole words go through the tsvector, fragments of Sinhala names and
+    # subjects ("බණ්ඩ", "licen") through the trigram-indexed icontains path.
+    matches = Q(sender_details__icontains=text) | Q(letter_type__icontains=text)
+
+    query = build_search_query(text)
+    if query is not None:
+        matches |= Q(search_vector=query)
+        rank = SearchRank(F('search_vector'), query)
+    else:
+        rank = Value(0.0)
+
+    return letters.filter(matches).annotate(
+        **{RANK_ANNOTATION: rank}
+    ).order_by(f'-{RANK_ANNOTATION}', '-serial_number')
+
+
+def fuzzy_search_letters(letters, text):
+    """
+    "Did you mean" search: senders and subjects that look like ``text`` even
+    when misspelt, most similar first.  Without PostgreSQL this degrades to a
+    plain substring match.
+    """
+    text = text.strip()
+    if not text:
+        return letters
+
+    if not full_text_enabled(letters):
+        return letters.filter(
+            Q(sender_details__icontains=text) |
+            Q(letter_type__icontains=text)
+        )
+
+    # Compare against the same UPPER() expressions the trigram indexes are
+    # built on; pg_trgm ignores case, so the similarity itself is unchanged.
+    return letters.alias(
+        sender_upper=Upper('sender_details'),
+        subject_upper=Upper('letter_type'),
+    ).filter(
+        Q(sender_upper__trigram_word_similar=text) |
+        Q(subject_upper__trigram_word_similar=text)
+    ).annotate(
+        **{RANK_ANNOTATION: Greatest(
+            TrigramWordSimilarity(text, 'sender_upper'),
+            TrigramWordSimilarity(text, 'subject_upper'),
+        )}
+    ).order_by(f'-{RANK_ANNOTATION}', '-serial_number')
+
+
+def is_ranked(letters):
+    return RANK_ANNOTATION in letters.query.annotations
+
+
+def apply_search(letters, text, search_type='all'):
+    """
+    Filter ``letters`` the way the search box does for ``search_type``
+    ('all', 'serial', 'date' or 'fuzzy'), e.g. for the Excel export.
+    """
+    if not text.strip():
+        return letters
+
+    if search_type == 'serial':
+        serial = parse_serial(text)
+        return letters.filter(serial_number=serial) if serial is not None else letters.none()
+    if search_type == 'date':
+        return date_search_letters(letters, text)
+    if search_type == 'fuzzy':
+        return fuzzy_search_letters(letters, text)
+    return search_letters(letters, text)
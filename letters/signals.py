@@ -1,7 +1,7 @@
-import os
-from django.db.models.signals import post_delete, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import Letter
+from .counters import invalidate_counters
+from .models import ATTACHMENT_FIELDS, Blob, Letter
 
 # 1. DELETE files when the Letter is deleted from Database
 @receiver(post_delete, sender=Letter)
@@ -14,26 +14,45 @@ def auto_delete_file_on_delete(sender, instance, **kwargs):
     ]
     for file in attachments:
         if file:
-            if os.path.isfile(file.path):
-                os.remove(file.path)
+            # Only deleted once no other letter uses the same file
+            Blob.objects.release(file.storage, file.name)
 
 # 2. DELETE old file when you upload a NEW one (or Clear it)
 @receiver(pre_save, sender=Letter)
 def auto_delete_file_on_change(sender, instance, **kwargs):
     if not instance.pk:
         return False
-    try:
-        old_obj = Letter.objects.get(pk=instance.pk)
-    except Letter.DoesNotExist:
-        return False
 
-    fields = ['attachment_1', 'attachment_2', 'attachment_3',
-              'attachment_4', 'attachment_5', 'attachment_6']
+    # Compared with the names the letter was loaded with; only a letter built
+    # by hand, or loaded without its attachments (.only()), needs the row read
+    loaded = getattr(instance, '_loaded_attachments', {})
+    missing = [field_name for field_name in ATTACHMENT_FIELDS if field_name not in loaded]
+    if missing:
+        stored = Letter.objects.filter(pk=instance.pk).values(*missing).first()
+        if stored is None:
+            return False
+        loaded = {**loaded, **stored}
+
+    # A file uploaded again is the same blob, with one more reference
+    replaced = getattr(instance, '_stored_attachments', ())
+    changed = [
+        field_name for field_name in ATTACHMENT_FIELDS
+        if loaded[field_name] and (loaded[field_name] != getattr(instance, field_name).name or field_name in replaced)
+    ]
+    if not changed:
+        return
 
-    for field_name in fields:
-        old_file = getattr(old_obj, field_name)
-        new_file = getattr(instance, field_name)
+    # The names stored now, not as loaded: the attachment worker may have
+    # swapped in a processed file since (and released the upload). Locked
+    # until the edit commits, so it cannot swap another one in meanwhile.
+    stored = Letter.objects.select_for_update().filter(pk=instance.pk).values(*changed).first() or {}
+    for field_name in changed:
+        if stored.get(field_name):
+            Blob.objects.release(getattr(instance, field_name).storage, stored[field_name])
 
-        if old_file and old_file != new_file:
-            if os.path.isfile(old_file.path):
-                os.remove(old_file.path)
\ No newline at end of file
+# 3. REFRESH the cached dashboard counters when a letter is added, edited or deleted
+@receiver(post_save, sender=Letter)
+@receiver(post_delete, sender=Letter)
+def invalidate_counters_on_change(sender, instance, **kwargs):
+    # Bumped once the change commits, see letters/counters.py
+    invalidate_counters()
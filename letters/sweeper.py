@@ -0,0 +1,126 @@
+"""
+Reconciliation of media storage with the database.
+
+Attachment files whose letter is gone (a delete that failed half-way, a
+server stopped between saving a file and committing the letter) are
+orphans; attachment fields naming a file that is not there are missing
+files.  ``manage.py sweep_attachments`` finds both without loading every
+letter: the storage side is walked one directory at a time, each checked
+against an indexed lookup (the ``Blob`` rows of one ``blobs/ab/`` shard, the
+letter a legacy ``letters/<serial>/`` directory belongs to), and the letters
+are read in primary-key batches.  Renditions and PDF pages belong to the
+file they were made from.
+"""
+import os
+import re
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ATTACHMENT_FIELDS, BLOB_DIRECTORY, Blob, Letter, LetterImage
+
+LEGACY_DIRECTORY = 'letters'
+
+RENDITION_SUFFIX = re.compile(r'\.(?:thumb|preview|page\d+)\.jpg$')
+
+# Files younger than this may belong to a save that has not committed yet
+DEFAULT_MIN_AGE = timedelta(hours=1)
+
+
+def owner_root(name):
+    """``name`` without its extension - and, for a rendition, the root of the file it was made from."""
+    stripped = RENDITION_SUFFIX.sub('', name)
+    if stripped != name:
+        return stripped
+    return os.path.splitext(name)[0]
+
+
+def attachment_directories(storage):
+    """The directories attachments are stored in, in the order they are swept."""
+    for top in (BLOB_DIRECTORY, LEGACY_DIRECTORY):
+        try:
+            directories = storage.listdir(top)[0]
+        except FileNotFoundError:
+            continue
+        for directory in sorted(directories):
+            yield f"{top}/{directory}"
+
+
+def referenced_roots(directory):
+    """Roots (see ``owner_root``) of the files in ``directory`` known to be in use."""
+    top, sub = directory.split('/', 1)
+    if top == BLOB_DIRECTORY:
+        # Hex digests: every one starting with the shard name sorts before it + 'g'
+        names = Blob.objects.filter(sha256__gte=sub, sha256__lt=f"{sub}g").values_list('name', flat=True)
+    elif sub.isdigit():
+        names = [
+            name for row in Letter.objects.filter(serial_number=int(sub)).values_list(*ATTACHMENT_FIELDS)
+            for name in row if name
+        ]
+    else:
+        names = LetterImage.objects.filter(image__startswith=f"{directory}/").values_list('image', flat=True)
+    return {owner_root(name) for name in names}
+
+
+def in_use(root):
+    """
+    Whether anything refers to a file with this root. Slow (unindexed) - only
+    asked for the few files the quick lookup could not account for, e.g. a
+    letter whose serial number changed after its files were stored.
+    """
+    prefix = f"{root}."
+    attachments = reduce(or_, (Q(**{f"{field_name}__startswith": prefix}) for field_name in ATTACHMENT_FIELDS))
+    return (
+        Letter.objects.filter(attachments).exists()
+        or Blob.objects.filter(name__startswith=prefix).exists()
+        or LetterImage.objects.filter(image__startswith=prefix).exists()
+    )
+
+
+def find_orphans(storage, directory, min_age=DEFAULT_MIN_AGE):
+    """
+    (files checked, [(name, size)] of the orphans) in ``directory``. Files
+    changed within ``min_age`` are left alone.
+    """
+    files = storage.listdir(directory)[1]
+    roots = referenced_roots(directory)
+    cutoff = timezone.now() - min_age
+    orphans = []
+    unknown = {}
+
+    for filename in sorted(files):
+        name = f"{directory}/{filename}"
+        root = owner_root(name)
+        if root in roots or storage.get_modified_time(name) > cutoff:
+            continue
+        if root not in unknown:
+            unknown[root] = in_use(root)
+        if not unknown[root]:
+            orphans.append((name, storage.size(name)))
+
+    return len(files), orphans
+
+
+def missing_attachments(storage, after_pk=0, batch_size=500):
+    """
+    Batches of (last letter id, [(letter id, field name, file name)]) for
+    attachment fields naming a file that is not in storage, reading the
+    letters ``batch_size`` at a time from ``after_pk`` on.
+    """
+    while True:
+        rows = list(
+            Letter.objects.filter(pk__gt=after_pk).order_by('pk').values_list('pk', *ATTACHMENT_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return
+        missing = [
+            (row[0], field_name, name)
+            for row in rows
+            for field_name, name in zip(ATTACHMENT_FIELDS, row[1:])
+            if name and not storage.exists(name)
+        ]
+        after_pk = rows[-1][0]
+        yield after_pk, missing
@@ -0,0 +1,29 @@
+import io
+
+import pytest
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+
+
+def photo(name='scan.png', size=(2400, 1800), image_format='PNG', color='red'):
+    # An upload of a scan, as the letter forms receive it
+    data = io.BytesIO()
+    Image.new('RGB', size, color=color).save(data, format=image_format)
+    return SimpleUploadedFile(name, data.getvalue(), content_type='image/png')
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Cached dashboard counters would otherwise leak between tests, since a
+    # test's rolled back letters never fire the signals that drop them.
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    # Attachments, renditions and exports are written under the test's own directory
+    settings.MEDIA_ROOT = tmp_path
+    return tmp_path
@@ -0,0 +1,383 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.urls import reverse
+from PIL import Image
+
+from letters.attachments import claim_jobs, process_pending, swap_in
+from letters.imaging import clean_scan, clean_scans, get_pool, map_images, reset_pool, worker_count
+from letters.renditions import has_renditions
+from letters.models import STAGING_DIRECTORY, AttachmentJob, Blob, Letter
+from letters.tests.conftest import photo
+
+
+def clean_scan_or_die(data):
+    # Kills the pool worker it runs on, as the OOM killer would; fine in the main process
+    if data == b'die' and multiprocessing.parent_process() is not None:
+        os._exit(1)
+    return clean_scan(data)
+
+
+def is_blob(name, ext='.jpg'):
+    return re.fullmatch(rf'blobs/([0-9a-f]{{2}})/\1[0-9a-f]{{62}}\{ext}', name) is not None
+
+
+@pytest.fixture
+def background(settings, media):
+    settings.ATTACHMENT_PROCESSING = 'background'
+
+
+@pytest.fixture
+def image_pool(settings):
+    settings.IMAGE_PROCESS_WORKERS = 2
+    yield
+    reset_pool()
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('background')
+class TestBackgroundProcessing:
+    # Tests for the attachment queue and worker
+
+    def test_save_stores_upload_and_queues_job(self):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo(), attachment_2=photo())
+
+        assert is_blob(letter.attachment_1.name, '.png')
+        assert letter.attachment_1.storage.exists(letter.attachment_1.name)
+        assert letter.attachment_processing() == {'attachment_1': 'QUEUED', 'attachment_2': 'QUEUED'}
+
+    def test_save_streams_upload_without_reading_it_whole(self):
+        class ChunkedUpload(SimpleUploadedFile):
+            def read(self, size=-1):
+                reads.append(size)
+                return self.file.read(size)
+
+        reads = []
+        upload = photo()
+        data = upload.read()
+        letter = Letter.objects.create(serial_number=7, attachment_1=ChunkedUpload('scan.png', data))
+
+        assert reads and all(size and size > 0 for size in reads)
+        assert letter.attachment_1.storage.open(letter.attachment_1.name).read() == data
+        blob = Blob.objects.get()
+        assert (blob.sha256, blob.size) == (hashlib.sha256(data).hexdigest(), len(data))
+        assert letter.attachment_meta['attachment_1']['size'] == len(data)
+        assert letter.attachment_meta['attachment_1']['content_type'] == 'image/png'
+
+    def test_worker_swaps_in_processed_file(self, django_capture_on_commit_callbacks):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+        raw_name = letter.attachment_1.name
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert process_pending(workers=1) == 1
+
+        letter.refresh_from_db()
+        assert is_blob(letter.attachment_1.name)
+        assert not letter.attachment_1.storage.exists(raw_name)
+        assert letter.attachment_processing() == {}
+
+        processed = Image.open(letter.attachment_1.path)
+        assert processed.mode == 'L'
+        assert processed.width <= 1200 and processed.height <= 1600
+
+    def test_edit_loaded_before_the_swap_keeps_the_processed_file(self, django_capture_on_commit_callbacks):
+        Letter.objects.create(serial_number=7, attachment_1=photo(), attachment_2=photo(color='blue'))
+        # An edit form opened while the upload was still queued
+        edited = Letter.objects.get()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert process_pending(workers=1) == 2
+        edited.status = 'REPLIED'
+        edited.attachment_2 = None
+        with django_capture_on_commit_callbacks(execute=True):
+            edited.save()
+
+        letter = Letter.objects.get()
+        assert letter.status == 'REPLIED' and not letter.attachment_2
+        assert is_blob(letter.attachment_1.name)
+        assert letter.attachment_1.storage.exists(letter.attachment_1.name)
+        assert list(Blob.objects.values_list('name', 'ref_count')) == [(letter.attachment_1.name, 1)]
+        assert list(letter.attachment_meta) == ['attachment_1']
+        assert letter.attachment_meta['attachment_1']['name'] == letter.attachment_1.name
+
+    def test_replaced_upload_is_not_overwritten(self, django_capture_on_commit_callbacks):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo('first.png'))
+        job = AttachmentJob.objects.get()
+
+        letter.attachment_1 = photo('second.png', color='blue')
+        with django_capture_on_commit_callbacks(execute=True):
+            letter.save()
+
+        # The first job was superseded and the stale result must not win
+        assert not swap_in(job, 'blobs/00/stale.jpg')
+        assert AttachmentJob.objects.count() == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            process_pending(workers=1)
+        letter.refresh_from_db()
+        assert is_blob(letter.attachment_1.name)
+        assert not letter.attachment_1.storage.exists(job.source_name)
+
+    def test_cleared_attachment_drops_job(self):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+        Letter.objects.filter(pk=letter.pk).update(attachment_1='')
+
+        process_pending(workers=1)
+
+        letter.refresh_from_db()
+        assert not letter.attachment_1
+        assert not AttachmentJob.objects.exists()
+
+    def test_unreadable_upload_fails_after_retries(self):
+        broken = SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg')
+        letter = Letter.objects.create(serial_number=7, attachment_1=broken)
+
+        process_pending(workers=1)
+
+        job = AttachmentJob.objects.get()
+        assert job.status == AttachmentJob.FAILED
+        assert job.attempts == 3
+        letter.refresh_from_db()
+        # The upload stays available as it was
+        assert letter.attachment_1.storage.exists(letter.attachment_1.name)
+
+    def test_jobs_are_claimed_once(self):
+        Letter.objects.create(serial_number=7, attachment_1=photo(), attachment_2=photo(), attachment_3=photo())
+
+        first = claim_jobs(2)
+        second = claim_jobs(2)
+
+        assert len(first) == 2
+        assert len(second) == 1
+        assert not {job.pk for job in first} & {job.pk for job in second}
+        assert all(job.status == AttachmentJob.PROCESSING for job in first + second)
+
+    def test_detail_view_shows_processing(self, client):
+        admin = User.objects.create_superuser(username='admin', password='pass')
+        client.force_login(admin)
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+
+        response = client.get(reverse('admin_letter_detail', args=[letter.pk]))
+
+        assert response.context['processing'] == {'attachment_1': 'QUEUED'}
+        assert 'fa-spinner' in response.content.decode()
+
+    def test_process_attachments_command(self):
+        Letter.objects.create(serial_number=7, attachment_1=photo())
+        out = io.StringIO()
+
+        call_command('process_attachments', '--once', '--workers', '1', stdout=out)
+
+        assert 'Processed 1 attachment(s), 0 failed.' in out.getvalue()
+        assert not AttachmentJob.objects.exists()
+
+
+@pytest.mark.django_db
+class TestContentAddressedStorage:
+    # Tests for storing each distinct attachment once, with reference counts
+
+    @pytest.fixture(autouse=True)
+    def sync(self, settings, media):
+        settings.ATTACHMENT_PROCESSING = 'sync'
+
+    def test_same_file_on_many_letters_is_stored_once(self):
+        first = Letter.objects.create(serial_number=7, attachment_1=photo('circular.png'))
+        second = Letter.objects.create(serial_number=8, attachment_3=photo('copy of circular.png'))
+
+        assert first.attachment_1.name == second.attachment_3.name
+        blob = Blob.objects.get()
+        assert blob.name == first.attachment_1.name
+        assert blob.ref_count == 2
+        assert blob.size == first.attachment_1.size
+
+    def test_file_deleted_with_last_reference(self, django_capture_on_commit_callbacks):
+        first = Letter.objects.create(serial_number=7, attachment_1=photo())
+        second = Letter.objects.create(serial_number=8, attachment_1=photo())
+        storage, name = first.attachment_1.storage, first.attachment_1.name
+
+        with django_capture_on_commit_callbacks(execute=True):
+            first.delete()
+        assert storage.exists(name)
+        assert has_renditions(storage, name)
+        assert Blob.objects.get().ref_count == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            second.delete()
+        assert not storage.exists(name)
+        assert not has_renditions(storage, name)
+        assert not Blob.objects.exists()
+
+    def test_replacing_releases_old_file(self, django_capture_on_commit_callbacks):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+        old_name = letter.attachment_1.name
+
+        letter.attachment_1 = photo(color='blue')
+        with django_capture_on_commit_callbacks(execute=True):
+            letter.save()
+
+        assert not letter.attachment_1.storage.exists(old_name)
+        assert list(Blob.objects.values_list('name', 'ref_count')) == [(letter.attachment_1.name, 1)]
+
+    def test_uploading_same_file_again_keeps_one_reference(self):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+
+        letter.attachment_1 = photo()
+        letter.save()
+
+        assert letter.attachment_1.storage.exists(letter.attachment_1.name)
+        assert Blob.objects.get().ref_count == 1
+
+    def test_file_stored_before_blobs_is_deleted(self, tmp_path, django_capture_on_commit_callbacks):
+        legacy = tmp_path / 'letters/7/Attachment_7_1.jpg'
+        legacy.parent.mkdir(parents=True)
+        legacy.write_bytes(photo().read())
+        letter = Letter.objects.create(serial_number=7)
+        Letter.objects.filter(pk=letter.pk).update(attachment_1='letters/7/Attachment_7_1.jpg')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Letter.objects.get(pk=letter.pk).delete()
+
+        assert not legacy.exists()
+
+    def test_rolled_back_edit_keeps_files(self):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+        old_name = letter.attachment_1.name
+
+        with pytest.raises(RuntimeError), transaction.atomic():
+            letter.attachment_1 = photo(color='blue')
+            letter.save()
+            raise RuntimeError()
+
+        assert letter.attachment_1.storage.exists(old_name)
+        assert Letter.objects.get().attachment_1.name == old_name
+        assert Blob.objects.get(name=old_name).ref_count == 1
+
+    def test_racing_store_of_the_same_file_keeps_one_copy(self, tmp_path, monkeypatch):
+        data = photo().read()
+        place = Blob.objects.place
+
+        def raced(storage, staged, name):
+            # Another save of the same file gets its copy there first
+            (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / name).write_bytes(data)
+            place(storage, staged, name)
+        monkeypatch.setattr(Blob.objects, 'place', raced)
+
+        blob, created = Blob.objects.store(default_storage, data, '.png')
+
+        assert created and blob.size == len(data)
+        assert os.listdir(tmp_path / os.path.dirname(blob.name)) == [os.path.basename(blob.name)]
+        assert (tmp_path / blob.name).read_bytes() == data
+        assert os.listdir(tmp_path / STAGING_DIRECTORY) == []
+
+    def test_status_only_edit_does_not_read_the_row_again(self, django_assert_num_queries):
+        Letter.objects.create(serial_number=7, attachment_1=photo())
+        letter = Letter.objects.get()
+
+        letter.status = 'REPLIED'
+        # The UPDATE and its history row; the counters version is bumped on commit
+        with django_assert_num_queries(2):
+            letter.save()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures('background')
+def test_worker_pool_processes_in_parallel():
+    letters = [
+        Letter.objects.create(serial_number=i, attachment_1=photo(), attachment_2=photo(), attachment_3=photo())
+        for i in range(1, 4)
+    ]
+
+    assert process_pending(workers=3) == 9
+
+    # Nine uploads of one scan: a single processed blob, the raw one released
+    names = set()
+    for letter in letters:
+        letter.refresh_from_db()
+        names.update(getattr(letter, field_name).name for field_name in ['attachment_1', 'attachment_2', 'attachment_3'])
+    assert len(names) == 1 and is_blob(names.pop())
+    assert list(Blob.objects.values_list('ref_count', flat=True)) == [9]
+    assert not AttachmentJob.objects.exists()
+
+
+@pytest.mark.django_db
+def test_sync_mode_processes_during_save(settings, media):
+    settings.ATTACHMENT_PROCESSING = 'sync'
+
+    letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+
+    assert is_blob(letter.attachment_1.name)
+    assert not AttachmentJob.objects.exists()
+
+
+@pytest.mark.usefixtures('image_pool')
+class TestImagePool:
+    # Tests for spreading the scan clean-up over worker processes
+
+    def test_results_in_order_with_errors_in_place(self):
+        scans = [photo(size=(1600, 1200)).read(), b'not an image', photo(size=(800, 2400)).read()]
+
+        results = clean_scans(scans)
+
+        assert get_pool() is not None
+        assert isinstance(results[1], Exception)
+        assert Image.open(io.BytesIO(results[0])).size == (1200, 900)
+        assert Image.open(io.BytesIO(results[2])).size == (533, 1600)
+
+    def test_frozen_build_defaults_to_one_worker(self, settings, monkeypatch):
+        del settings.IMAGE_PROCESS_WORKERS
+        monkeypatch.setattr(sys, 'frozen', True, raising=False)
+
+        assert worker_count() == 1
+        assert get_pool() is None
+
+    def test_dead_worker_resets_pool_and_finishes_inline(self):
+        scans = [photo(size=(1600, 1200)).read(), b'die', photo(size=(800, 2400)).read()]
+        pool = get_pool()
+
+        results = map_images(clean_scan_or_die, scans)
+
+        # Every scan processed, none left as the pool's error
+        assert Image.open(io.BytesIO(results[0])).size == (1200, 900)
+        assert Image.open(io.BytesIO(results[2])).size == (533, 1600)
+        assert isinstance(results[1], Exception) and not isinstance(results[1], BrokenProcessPool)
+        # A fresh pool replaces the broken one
+        assert get_pool() is not pool
+        assert map_images(clean_scan, scans[:1] * 2)[0] == results[0]
+
+    @pytest.mark.django_db
+    def test_sync_save_processes_all_attachments(self, settings, media):
+        settings.ATTACHMENT_PROCESSING = 'sync'
+        broken = SimpleUploadedFile('notes.pdf', b'%PDF-1.4 not an image', content_type='application/pdf')
+
+        letter = Letter.objects.create(
+            serial_number=7, attachment_1=photo(), attachment_2=broken, attachment_3=photo(image_format='JPEG'),
+        )
+
+        assert is_blob(letter.attachment_1.name)
+        assert is_blob(letter.attachment_3.name)
+        assert Image.open(letter.attachment_3.path).mode == 'L'
+        # Stored as uploaded
+        assert is_blob(letter.attachment_2.name, '.pdf')
+        assert letter.attachment_2.read() == b'%PDF-1.4 not an image'
+
+    @pytest.mark.django_db
+    @pytest.mark.usefixtures('background')
+    def test_worker_uses_pool(self):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo(), attachment_2=photo())
+
+        assert process_pending(workers=1) == 2
+
+        letter.refresh_from_db()
+        assert Image.open(letter.attachment_2.path).mode == 'L'
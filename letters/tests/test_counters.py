@@ -0,0 +1,147 @@
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from letters import counters
+from letters.counters import count_letters, invalidate_counters, sector_counters, status_counters
+from letters.models import CounterVersion, Letter, SectorProfile
+
+
+@pytest.mark.django_db
+class TestCountLetters:
+    # Tests for the single-query counters
+
+    @pytest.fixture(autouse=True)
+    def letters(self):
+        Letter.objects.create(serial_number=1, status='PENDING', target_sector='HEALTH')
+        Letter.objects.create(serial_number=2, status='PENDING', target_sector='REVENUE')
+        Letter.objects.create(serial_number=3, status='REPLIED', target_sector='HEALTH')
+        Letter.objects.create(serial_number=4, status='NOT_REQUIRED', target_sector='HEALTH')
+        Letter.objects.create(serial_number=5, status='ADMIN_UPDATED', target_sector='HEALTH')
+
+    def test_counts_every_status_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            counts = count_letters(Letter.objects.all())
+
+        assert len(queries.captured_queries) == 1
+        assert counts == {
+            'total': 5, 'pending': 2, 'replied': 1,
+            'not_required': 1, 'admin_updated': 1, 'resolved': 3,
+        }
+
+    def test_empty_queryset(self):
+        assert count_letters(Letter.objects.none())['total'] == 0
+
+    def test_sector_counters_are_cached(self):
+        assert sector_counters('HEALTH')['total'] == 4
+
+        with CaptureQueriesContext(connection) as queries:
+            counts = sector_counters('HEALTH')
+
+        # Only the counters version is read
+        assert len(queries.captured_queries) == 1
+        assert counts['pending'] == 1
+
+    def test_save_and_delete_refresh_the_cache(self, django_capture_on_commit_callbacks):
+        assert sector_counters()['pending'] == 2
+
+        letter = Letter.objects.get(serial_number=1)
+        letter.status = 'REPLIED'
+        with django_capture_on_commit_callbacks(execute=True):
+            letter.save()
+        assert sector_counters()['pending'] == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Letter.objects.create(serial_number=6, target_sector='HEALTH')
+        assert sector_counters('HEALTH')['total'] == 5
+
+        with django_capture_on_commit_callbacks(execute=True):
+            letter.delete()
+        assert sector_counters('HEALTH')['total'] == 4
+
+    def test_version_is_bumped_once_the_write_commits(self, django_capture_on_commit_callbacks):
+        version = CounterVersion.objects.get().version
+        letter = Letter.objects.get(serial_number=1)
+        letter.status = 'REPLIED'
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            letter.save()
+            # Other writers do not wait on the version row meanwhile
+            assert CounterVersion.objects.get().version == version
+
+        assert len(callbacks) == 1
+        callbacks[0]()
+        assert CounterVersion.objects.get().version == version + 1
+
+    def test_invalidate_reaches_the_cache_of_every_process(self, monkeypatch, django_capture_on_commit_callbacks):
+        server_cache = LocMemCache('server-process', {})
+        monkeypatch.setattr(counters, 'cache', server_cache)
+        assert sector_counters('HEALTH')['pending'] == 1
+
+        # A queryset update from another process, e.g. a management command
+        monkeypatch.setattr(counters, 'cache', LocMemCache('command-process', {}))
+        with django_capture_on_commit_callbacks(execute=True):
+            Letter.objects.filter(target_sector='HEALTH').update(status='PENDING')
+            invalidate_counters()
+
+        monkeypatch.setattr(counters, 'cache', server_cache)
+        assert sector_counters('HEALTH')['pending'] == 4
+
+    def test_invalidate_recreates_a_missing_version(self, django_capture_on_commit_callbacks):
+        CounterVersion.objects.all().delete()
+        assert sector_counters()['total'] == 5
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Letter.objects.bulk_create([Letter(serial_number=6)])
+            invalidate_counters()
+
+        assert CounterVersion.objects.get().version == 1
+        assert sector_counters()['total'] == 6
+
+    def test_status_counters_need_no_query(self):
+        counts = sector_counters()
+
+        with CaptureQueriesContext(connection) as queries:
+            pending = status_counters(counts, 'PENDING')
+            replied = status_counters(counts, 'REPLIED')
+
+        assert len(queries.captured_queries) == 0
+        assert (pending['total'], pending['pending'], pending['resolved']) == (2, 2, 0)
+        assert (replied['total'], replied['pending'], replied['resolved']) == (1, 0, 1)
+
+
+@pytest.mark.django_db
+class TestDashboardCounters:
+    # The unfiltered dashboards read their counters from the cache
+
+    def test_dashboard_counters_do_not_count_letters_twice(self, client):
+        user = User.objects.create_user(username='count_user', password='pass')
+        SectorProfile.objects.create(user=user, sector='HEALTH')
+        client.force_login(user)
+        Letter.objects.create(serial_number=1, status='PENDING')
+        Letter.objects.create(serial_number=2, status='REPLIED')
+
+        client.get(reverse('sector_dashboard'))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('sector_dashboard'))
+
+        assert response.context['total'] == 2
+        assert response.context['pending'] == 1
+        assert not any('COUNT(' in query['sql'].upper() for query in queries.captured_queries)
+
+    def test_admin_status_filter_counts(self, client):
+        admin = User.objects.create_superuser(username='admin', password='pass')
+        client.force_login(admin)
+        Letter.objects.create(serial_number=1, status='PENDING', target_sector='HEALTH')
+        Letter.objects.create(serial_number=2, status='REPLIED', target_sector='HEALTH')
+        Letter.objects.create(serial_number=3, status='REPLIED', target_sector='REVENUE')
+
+        response = client.get(reverse('custom_admin_letters'), {'sector': 'HEALTH', 'status': 'REPLIED'})
+
+        assert response.context['total_letters'] == 1
+        assert response.context['pending_letters'] == 0
+        assert response.context['replied_letters'] == 1
+        assert len(response.context['letters']) == 1
@@ -0,0 +1,347 @@
+import hashlib
+import io
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import unquote
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from django.utils.http import http_date
+from PIL import Image
+
+from letters.models import Letter, SectorProfile
+from letters.renditions import rendition_name
+from letters.tests.conftest import photo
+
+
+class FrontEnd:
+    """
+    Stand-in for Caddy/nginx in front of the app: passes the request on and,
+    like their X-Accel-Redirect / X-Sendfile handling, replaces an empty
+    hand-off response with the file read from disk.
+    """
+
+    def __init__(self, client, media_root, internal_url='/protected/'):
+        self.client = client
+        self.media_root = Path(media_root)
+        self.internal_url = internal_url
+
+    def get(self, url, data=None):
+        response = self.client.get(url, data)
+        self.upstream = response
+
+        if 'X-Accel-Redirect' in response:
+            location = response['X-Accel-Redirect']
+            assert location.startswith(self.internal_url)
+            path = self.media_root / unquote(location[len(self.internal_url):])
+        elif 'X-Sendfile' in response:
+            path = Path(response['X-Sendfile'])
+            assert path.resolve().is_relative_to(self.media_root.resolve())
+        else:
+            return response.status_code, b''.join(response.streaming_content) if response.streaming else response.content
+
+        return response.status_code, path.read_bytes()
+
+
+@pytest.fixture
+def letter(client, media):
+    user = User.objects.create_user(username='health', password='pass')
+    SectorProfile.objects.create(user=user, sector='HEALTH')
+    client.force_login(user)
+    return Letter.objects.create(serial_number=7, target_sector='HEALTH', attachment_1=photo())
+
+
+@pytest.fixture
+def no_python_reads(monkeypatch):
+    # Any attempt to read an attachment in Python fails the test
+    def refuse(storage, name, mode='rb'):
+        raise AssertionError(f"{name} was read by Django")
+    monkeypatch.setattr(FileSystemStorage, 'open', refuse)
+
+
+@pytest.mark.django_db
+class TestProtectedFileDelivery:
+    # Tests for handing attachment delivery to the front-end server
+
+    def url(self, letter):
+        return reverse('serve_attachment', args=[letter.pk, 'attachment_1'])
+
+    def test_python_streams_the_file(self, client, media, letter):
+        status, body = FrontEnd(client, media).get(self.url(letter))
+
+        assert status == 200
+        assert body == (media / letter.attachment_1.name).read_bytes()
+
+    @pytest.mark.usefixtures('no_python_reads')
+    def test_x_accel_redirect(self, client, media, letter, settings):
+        settings.PROTECTED_FILE_DELIVERY = 'x-accel-redirect'
+        front_end = FrontEnd(client, media)
+
+        status, body = front_end.get(self.url(letter))
+
+        assert status == 200
+        assert front_end.upstream['X-Accel-Redirect'] == f'/protected/{letter.attachment_1.name}'
+        assert front_end.upstream['Content-Type'] == 'image/jpeg'
+        assert front_end.upstream.content == b''
+        assert body == (media / letter.attachment_1.name).read_bytes()
+
+    @pytest.mark.usefixtures('no_python_reads')
+    def test_x_accel_redirect_variant(self, client, media, letter, settings):
+        settings.PROTECTED_FILE_DELIVERY = 'x-accel-redirect'
+        front_end = FrontEnd(client, media)
+
+        status, body = front_end.get(self.url(letter), {'variant': 'thumb'})
+
+        assert front_end.upstream['X-Accel-Redirect'] == f'/protected/{rendition_name(letter.attachment_1.name, "thumb")}'
+        assert Image.open(io.BytesIO(body)).width == 240
+
+    @pytest.mark.usefixtures('no_python_reads')
+    def test_x_sendfile(self, client, media, letter, settings):
+        settings.PROTECTED_FILE_DELIVERY = 'x-sendfile'
+        front_end = FrontEnd(client, media)
+
+        status, body = front_end.get(self.url(letter))
+
+        assert status == 200
+        assert front_end.upstream.content == b''
+        assert body == (media / letter.attachment_1.name).read_bytes()
+
+    @pytest.mark.usefixtures('no_python_reads')
+    def test_authorization_still_checked(self, client, media, letter, settings):
+        settings.PROTECTED_FILE_DELIVERY = 'x-accel-redirect'
+        Letter.objects.filter(pk=letter.pk).update(target_sector='REVENUE')
+        front_end = FrontEnd(client, media)
+
+        status, _ = front_end.get(self.url(letter))
+
+        assert status == 404
+        assert 'X-Accel-Redirect' not in front_end.upstream
+
+    def test_missing_file_is_404(self, client, media, letter, settings):
+        settings.PROTECTED_FILE_DELIVERY = 'x-accel-redirect'
+        (media / letter.attachment_1.name).unlink()
+
+        response = client.get(self.url(letter))
+
+        assert response.status_code == 404
+        assert 'X-Accel-Redirect' not in response
+
+    def test_unknown_mode_is_a_configuration_error(self, client, letter, settings):
+        settings.PROTECTED_FILE_DELIVERY = 'carrier-pigeon'
+
+        with pytest.raises(ImproperlyConfigured):
+            client.get(self.url(letter))
+
+
+@pytest.mark.django_db
+class TestConditionalRequests:
+    # Tests for ETag / Last-Modified / Cache-Control on attachments
+
+    def url(self, letter):
+        return reverse('serve_attachment', args=[letter.pk, 'attachment_1'])
+
+    def test_validators_and_cache_headers(self, client, media, letter):
+        response = client.get(self.url(letter))
+
+        digest = hashlib.sha256((media / letter.attachment_1.name).read_bytes()).hexdigest()
+        assert letter.attachment_meta['attachment_1']['sha256'] == digest
+        assert response['ETag'] == f'"{digest}"'
+        assert 'Last-Modified' in response
+        assert set(response['Cache-Control'].split(', ')) == {'private', 'max-age=3600'}
+        assert 'Cookie' in response['Vary']
+
+    @pytest.mark.usefixtures('no_python_reads')
+    def test_if_none_match_is_304_without_reading_the_file(self, client, letter):
+        etag = f'"{letter.attachment_meta["attachment_1"]["sha256"]}"'
+
+        response = client.get(self.url(letter), HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+        assert 'private' in response['Cache-Control']
+
+    @pytest.mark.usefixtures('no_python_reads')
+    def test_if_modified_since_is_304(self, client, letter):
+        modified = datetime.fromisoformat(letter.attachment_meta['attachment_1']['modified'])
+        last_modified = http_date(modified.timestamp() + 1)
+
+        response = client.get(self.url(letter), HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        assert response.status_code == 304
+
+    def test_renditions_have_their_own_tag(self, client, letter):
+        full = client.get(self.url(letter))['ETag']
+        thumb = client.get(self.url(letter), {'variant': 'thumb'})['ETag']
+
+        assert thumb != full
+        assert client.get(self.url(letter), {'variant': 'thumb'}, HTTP_IF_NONE_MATCH=full).status_code == 200
+
+    def test_new_upload_changes_the_tag(self, client, letter):
+        etag = client.get(self.url(letter))['ETag']
+
+        data = io.BytesIO()
+        Image.new('RGB', (800, 600), color='blue').save(data, format='PNG')
+        letter.attachment_1 = SimpleUploadedFile('rescan.png', data.getvalue(), content_type='image/png')
+        letter.save()
+
+        response = client.get(self.url(letter), HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+    def test_worker_records_fingerprint(self, client, media, letter, settings):
+        from letters.attachments import process_pending
+
+        settings.ATTACHMENT_PROCESSING = 'background'
+        letter.attachment_2 = photo()
+        letter.save()
+        assert letter.attachment_meta['attachment_2']['name'] == letter.attachment_2.name
+
+        process_pending(workers=1)
+
+        letter.refresh_from_db()
+        stored = (media / letter.attachment_2.name).read_bytes()
+        assert letter.attachment_meta['attachment_2']['name'] == letter.attachment_2.name
+        assert letter.attachment_meta['attachment_2']['sha256'] == hashlib.sha256(stored).hexdigest()
+        # Left as it was
+        assert letter.attachment_meta['attachment_1']['name'] == letter.attachment_1.name
+
+    def test_fingerprint_of_older_attachment_is_computed_once(self, client, media, letter):
+        Letter.objects.filter(pk=letter.pk).update(attachment_meta={})
+
+        etag = client.get(self.url(letter))['ETag']
+
+        letter.refresh_from_db()
+        assert etag == f'"{letter.attachment_meta["attachment_1"]["sha256"]}"'
+
+    def test_computed_fingerprint_leaves_other_entries_alone(self, media, letter):
+        from letters.models import MetaEntry
+
+        Letter.objects.filter(pk=letter.pk).update(attachment_meta={})
+        letter.refresh_from_db()
+        # The worker records attachment_2 after this letter was loaded
+        worker_entry = {'name': 'blobs/ab/abc.jpg', 'sha256': 'abc'}
+        Letter.objects.filter(pk=letter.pk).update(attachment_meta=MetaEntry('attachment_2', worker_entry))
+
+        letter.attachment_fingerprint('attachment_1')
+
+        letter.refresh_from_db()
+        assert letter.attachment_meta['attachment_2'] == worker_entry
+        assert letter.attachment_meta['attachment_1']['name'] == letter.attachment_1.name
+
+    def test_not_in_history(self, letter):
+        assert 'attachment_meta' not in {field.name for field in letter.history.model._meta.get_fields()}
+
+
+@pytest.mark.django_db
+class TestRangeRequests:
+    # Tests for byte-range requests on the streaming path
+
+    @pytest.fixture
+    def pdf(self, letter):
+        # A file processing left as uploaded, as legacy PDFs and TIFFs are
+        content = bytes(range(256)) * 1000
+        letter.attachment_2 = SimpleUploadedFile('register.pdf', content, content_type='application/pdf')
+        letter.save()
+        return content
+
+    def get(self, client, letter, **headers):
+        response = client.get(reverse('serve_attachment', args=[letter.pk, 'attachment_2']), **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_whole_file_advertises_ranges(self, client, letter, pdf):
+        response, body = self.get(client, letter)
+
+        assert response.status_code == 200
+        assert response['Accept-Ranges'] == 'bytes'
+        assert body == pdf
+
+    @pytest.mark.parametrize('header, first, last', [
+        ('bytes=0-99', 0, 99),
+        ('bytes=1000-', 1000, 255_999),
+        ('bytes=-500', 255_500, 255_999),
+        ('bytes=255000-999999', 255_000, 255_999),
+        ('bytes = 10-19', 10, 19),
+    ])
+    def test_single_range(self, client, letter, pdf, header, first, last):
+        response, body = self.get(client, letter, HTTP_RANGE=header)
+
+        assert response.status_code == 206
+        assert response['Content-Range'] == f'bytes {first}-{last}/256000'
+        assert response['Content-Length'] == str(last - first + 1)
+        assert body == pdf[first:last + 1]
+
+    @pytest.mark.parametrize('header', ['bytes=0-99,200-299', 'bytes=256000-', 'bytes=500-100', 'bytes=-0'])
+    def test_unsatisfiable(self, client, letter, pdf, header):
+        response, body = self.get(client, letter, HTTP_RANGE=header)
+
+        assert response.status_code == 416
+        assert response['Content-Range'] == 'bytes */256000'
+        assert body == b''
+
+    def test_other_units_are_ignored(self, client, letter, pdf):
+        response, body = self.get(client, letter, HTTP_RANGE='pages=1-2')
+
+        assert response.status_code == 200
+        assert body == pdf
+
+    def test_if_range(self, client, letter, pdf):
+        etag = f'"{letter.attachment_meta["attachment_2"]["sha256"]}"'
+
+        resumed, body = self.get(client, letter, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE=etag)
+        assert resumed.status_code == 206
+        assert body == pdf[100:]
+
+        # The file changed since the first part was fetched: start over
+        changed, body = self.get(client, letter, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE='"stale"')
+        assert changed.status_code == 200
+        assert body == pdf
+
+
+@pytest.mark.django_db
+class TestUntrustedContent:
+    # Tests that an upload which is not a scan or PDF is never rendered from the app origin
+
+    PAGE = b'<html><script>alert(document.cookie)</script></html>'
+
+    def upload(self, letter, name='notes.html'):
+        letter.attachment_2 = SimpleUploadedFile(name, self.PAGE, content_type='text/html')
+        letter.save()
+        letter.refresh_from_db()
+        return reverse('serve_attachment', args=[letter.pk, 'attachment_2'])
+
+    def assert_downloaded(self, response):
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/octet-stream'
+        assert response['Content-Disposition'].startswith('attachment;')
+        assert response['X-Content-Type-Options'] == 'nosniff'
+
+    @pytest.mark.parametrize('mode', ['sync', 'background'])
+    @pytest.mark.parametrize('name', ['notes.html', 'logo.svg'])
+    def test_served_as_a_download(self, client, letter, settings, mode, name):
+        settings.ATTACHMENT_PROCESSING = mode
+        url = self.upload(letter, name)
+
+        # The uploaded extension is not carried into the blob name
+        assert letter.attachment_2.name.endswith('.bin')
+        assert letter.attachment_meta['attachment_2']['content_type'] == 'application/octet-stream'
+        self.assert_downloaded(client.get(url))
+
+    def test_type_recorded_before_sniffing_only_is_not_trusted(self, client, letter):
+        url = self.upload(letter)
+        meta = {**letter.attachment_meta}
+        meta['attachment_2'] = {**meta['attachment_2'], 'content_type': 'text/html'}
+        Letter.objects.filter(pk=letter.pk).update(attachment_meta=meta)
+
+        self.assert_downloaded(client.get(url))
+
+    def test_scans_are_still_inline(self, client, letter):
+        response = client.get(reverse('serve_attachment', args=[letter.pk, 'attachment_1']))
+
+        assert response['Content-Type'] == 'image/jpeg'
+        assert not response.get('Content-Disposition', '').startswith('attachment')
+        assert response['X-Content-Type-Options'] == 'nosniff'
@@ -0,0 +1,271 @@
+import csv
+import io
+import json
+import re
+from datetime import date, datetime, timedelta
+from io import BytesIO
+
+import pytest
+from django.contrib.auth.models import User
+from django.urls import reverse
+from openpyxl import load_workbook
+
+from letters import exports
+from letters.export_jobs import process_pending_exports, purge_old_exports, submit_export
+from letters.exports import COLUMNS, HEADERS
+from letters.models import ExportJob, Letter
+
+
+@pytest.fixture
+def admin_client(client):
+    client.force_login(User.objects.create_superuser(username='admin', password='pass'))
+    return client
+
+
+def export(client, **params):
+    response = client.get(reverse('export_letters_excel'), params)
+    return response, load_workbook(BytesIO(b''.join(response.streaming_content))).active
+
+
+def data_rows(sheet):
+    rows = sheet.iter_rows(min_row=12, values_only=True)
+    return [row for row in rows if row[0] is not None]
+
+
+@pytest.mark.django_db
+class TestExcelExport:
+    # Tests for the write-only, streamed register export
+
+    @pytest.fixture
+    def letters(self):
+        Letter.objects.create(
+            serial_number=2, date_received=date(2026, 2, 3), sender_details='Kiri Banda', letter_type='Licence',
+            target_sector='HEALTH', administrated_by='SECRETARY', accepting_officer_id='D/4',
+            status='REPLIED', replied_at=date(2026, 2, 10),
+        )
+        Letter.objects.create(serial_number=1, sender_details='S' * 80, target_sector='REVENUE')
+        Letter.objects.create(serial_number=3)
+
+    def test_streams_the_register(self, admin_client, letters):
+        response, sheet = export(admin_client)
+
+        assert response.streaming
+        assert sheet.title == 'Letters Data'
+        assert 'A1:I1' in {str(cells) for cells in sheet.merged_cells.ranges}
+        assert [cell.value for cell in sheet[11]] == HEADERS
+        assert data_rows(sheet) == [
+            (1, None, 'S' * 80, None, 'ආදායම් අංශය', None, None, 'විමර්ශනය වෙමින් පවතී', None),
+            (2, datetime(2026, 2, 3), 'Kiri Banda', 'Licence', 'සෞඛ්‍ය අංශය', 'Secretary', 'D/4',
+             'පිළිතුරු යොමු කර ඇත', '2026-02-10'),
+            (3, None, None, None, None, None, None, 'විමර්ශනය වෙමින් පවතී', None),
+        ]
+
+    def test_rows_styled_by_sector(self, admin_client, letters):
+        _, sheet = export(admin_client)
+
+        revenue, health, none = sheet[12], sheet[13], sheet[14]
+        assert revenue[2].fill.start_color.rgb == '00ffff00'
+        assert health[4].fill.start_color.rgb == '008e74ad'
+        assert none[0].fill.start_color.rgb == '00FFFFFF'
+        assert health[0].alignment.horizontal == 'center'
+        assert health[1].number_format == 'yyyy-mm-dd'
+        assert health[2].border.left.style == 'thin'
+
+    def test_column_widths(self, admin_client, letters):
+        _, sheet = export(admin_client)
+
+        # Capped, and never narrower than the header
+        assert sheet.column_dimensions['C'].width == 50
+        assert sheet.column_dimensions['G'].width == len(HEADERS[6]) + 3
+
+    def test_filters(self, admin_client, letters):
+        response, sheet = export(admin_client, sector='HEALTH', status='REPLIED')
+
+        assert [row[0] for row in data_rows(sheet)] == [2]
+        assert 'Weligepola_Pradeshiya_sabha_letters_database_' in response['Content-Disposition']
+
+    def test_empty_register(self, admin_client):
+        _, sheet = export(admin_client)
+
+        assert data_rows(sheet) == []
+
+
+@pytest.mark.django_db
+class TestRawExports:
+    # Tests for the CSV and newline-delimited JSON exports
+
+    @pytest.fixture
+    def letters(self):
+        Letter.objects.create(
+            serial_number=2, date_received=date(2026, 2, 3), sender_details='කිරි බණ්ඩා, "Walauwa"',
+            target_sector='HEALTH', status='REPLIED', replied_at=date(2026, 2, 10),
+        )
+        Letter.objects.create(serial_number=1, sender_details='line one\nline two', target_sector='REVENUE')
+
+    def get(self, client, **params):
+        response = client.get(reverse('export_letters_excel'), params)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv(self, admin_client, letters):
+        response, body = self.get(admin_client, format='csv')
+
+        assert response.streaming
+        assert response['Content-Type'] == 'text/csv; charset=utf-8'
+        assert response['Content-Disposition'].endswith('.csv"')
+        assert body.startswith(b'\xef\xbb\xbf')
+        rows = list(csv.reader(io.StringIO(body.decode('utf-8-sig'))))
+        assert rows == [
+            COLUMNS,
+            ['1', '', 'line one\nline two', '', 'REVENUE', '', '', 'PENDING', ''],
+            ['2', '2026-02-03', 'කිරි බණ්ඩා, "Walauwa"', '', 'HEALTH', '', '', 'REPLIED', '2026-02-10'],
+        ]
+
+    def test_ndjson(self, admin_client, letters):
+        response, body = self.get(admin_client, format='ndjson', sector='HEALTH')
+
+        assert response['Content-Type'] == 'application/x-ndjson; charset=utf-8'
+        lines = body.decode().splitlines()
+        assert [json.loads(line) for line in lines] == [{
+            'serial_number': 2, 'date_received': '2026-02-03', 'sender_details': 'කිරි බණ්ඩා, "Walauwa"',
+            'letter_type': None, 'target_sector': 'HEALTH', 'administrated_by': None,
+            'accepting_officer_id': None, 'status': 'REPLIED', 'replied_at': '2026-02-10',
+        }]
+
+    def test_large_dump_comes_in_chunks(self, admin_client, monkeypatch):
+        monkeypatch.setattr(exports, 'STREAM_CHUNK_SIZE', 256)
+        Letter.objects.bulk_create(Letter(serial_number=serial, sender_details='x' * 40) for serial in range(50))
+
+        response = admin_client.get(reverse('export_letters_excel'), {'format': 'ndjson'})
+        chunks = list(response.streaming_content)
+
+        assert len(chunks) > 5
+        assert len(b''.join(chunks).splitlines()) == 50
+
+    def test_unknown_format(self, admin_client):
+        assert admin_client.get(reverse('export_letters_excel'), {'format': 'parquet'}).status_code == 404
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('media')
+class TestExportJobs:
+    # Tests for exports built by the background worker
+
+    @pytest.fixture
+    def letters(self):
+        for serial in range(1, 6):
+            Letter.objects.create(serial_number=serial, target_sector='HEALTH' if serial % 2 else 'REVENUE')
+
+    def test_queued_from_the_letter_list_and_built_by_the_worker(self, admin_client, letters):
+        response = admin_client.post(reverse('start_export'), {'sector': 'HEALTH', 'q': '', 'status': 'all'})
+
+        assert response.url == reverse('custom_admin_dashboard')
+        job = ExportJob.objects.get()
+        assert job.status == ExportJob.QUEUED
+        assert job.params == {'q': '', 'search_type': 'all', 'sector': 'HEALTH', 'status': 'all'}
+
+        assert process_pending_exports() == 1
+
+        job.refresh_from_db()
+        assert job.status == ExportJob.DONE
+        assert (job.rows_done, job.rows_total) == (3, 3)
+        assert job.filename.startswith('Weligepola_Pradeshiya_sabha_letters_database_')
+
+        download = admin_client.get(reverse('download_export', args=[job.pk]))
+        sheet = load_workbook(BytesIO(b''.join(download.streaming_content))).active
+        assert [row[0] for row in data_rows(sheet)] == [1, 3, 5]
+        assert f'{job.filename}.xlsx' in download['Content-Disposition']
+
+    def test_progress_is_recorded(self, letters, monkeypatch):
+        monkeypatch.setattr(exports, 'PROGRESS_EVERY', 2)
+        seen = []
+
+        def watched(letters, target, progress=None):
+            def record(rows):
+                progress(rows)
+                seen.append(ExportJob.objects.values_list('rows_done', 'rows_total').get())
+            return exports.write_register(letters, target, record)
+        monkeypatch.setattr('letters.export_jobs.write_register', watched)
+
+        submit_export({})
+        process_pending_exports()
+
+        assert seen == [(2, 5), (4, 5), (5, 5)]
+
+    def test_identical_filters_reuse_the_built_file(self, letters):
+        first, reused = submit_export({'sector': 'HEALTH'})
+        assert not reused
+        # Still queued: the same job
+        assert submit_export({'sector': 'HEALTH', 'status': ''}) == (first, True)
+
+        process_pending_exports()
+        again, reused = submit_export({'sector': 'HEALTH'})
+        assert (again, reused) == (first, True)
+        assert process_pending_exports() == 0
+
+        other, reused = submit_export({'sector': 'REVENUE'})
+        assert other != first and not reused
+
+    def test_not_reused_after_the_window(self, letters, settings):
+        settings.EXPORT_REUSE_WINDOW = timedelta(minutes=5)
+        first, _ = submit_export({})
+        process_pending_exports()
+        ExportJob.objects.filter(pk=first.pk).update(finished_at=first.created_at - timedelta(minutes=6))
+
+        job, reused = submit_export({})
+
+        assert job != first and not reused
+
+    def test_old_exports_are_removed(self, letters, media, django_capture_on_commit_callbacks):
+        job, _ = submit_export({})
+        process_pending_exports()
+        job.refresh_from_db()
+        assert (media / job.file.name).exists()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert purge_old_exports() == 0
+            ExportJob.objects.filter(pk=job.pk).update(finished_at=job.finished_at - timedelta(days=2))
+            assert purge_old_exports() == 1
+
+        assert not ExportJob.objects.exists()
+        assert not (media / job.file.name).exists()
+
+    def test_failure_is_recorded(self, letters, monkeypatch):
+        def broken(letters, target, progress=None):
+            raise OSError("disk full")
+        monkeypatch.setattr('letters.export_jobs.write_register', broken)
+
+        job, _ = submit_export({})
+        process_pending_exports()
+
+        job.refresh_from_db()
+        assert job.status == ExportJob.FAILED
+        assert job.error == 'disk full'
+
+    def test_status_and_download(self, admin_client, letters):
+        job, _ = submit_export({})
+        assert admin_client.get(reverse('download_export', args=[job.pk])).status_code == 404
+        assert admin_client.get(reverse('export_jobs_status')).json()['jobs'][0]['download_url'] is None
+
+        process_pending_exports()
+
+        jobs = admin_client.get(reverse('export_jobs_status')).json()['jobs']
+        assert jobs == [{
+            'id': job.pk, 'status': 'DONE', 'rows_done': 5, 'rows_total': 5, 'percent': 100,
+            'download_url': reverse('download_export', args=[job.pk]),
+        }]
+        dashboard = admin_client.get(reverse('custom_admin_dashboard')).content.decode()
+        assert 'export-jobs' in dashboard
+        # Saved through pywebview in the desktop client, like the direct exports
+        download = re.search(r'<a href="([^"]*)"\s+onclick="handleExport\(event, this.href\)"\s+class="job-download', dashboard)
+        assert download and download.group(1) == reverse('download_export', args=[job.pk])
+        assert 'function handleExport(' in dashboard
+
+    def test_admins_only(self, client, letters):
+        client.force_login(User.objects.create_user(username='clerk', password='pass'))
+        job, _ = submit_export({})
+        process_pending_exports()
+
+        client.post(reverse('start_export'), {})
+        assert ExportJob.objects.count() == 1
+        assert client.get(reverse('download_export', args=[job.pk])).status_code == 404
+        assert client.get(reverse('export_jobs_status')).status_code == 404
@@ -0,0 +1,384 @@
+import csv
+import hashlib
+import io
+import re
+from datetime import date, datetime
+
+import pytest
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from openpyxl import Workbook
+
+from letters import counters, legacy_import
+from letters.counters import sector_counters
+from letters.models import ImportCheckpoint, Letter
+
+HEADERS = ['serial_number', 'date_received', 'sender_details', 'target_sector', 'status', 'created_at']
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    def make(rows, headers=HEADERS, name='ledger.xlsx'):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(headers)
+        for row in rows:
+            sheet.append(row)
+        path = tmp_path / name
+        workbook.save(path)
+        return path
+    return make
+
+
+def run_import(path, *args):
+    out, err = io.StringIO(), io.StringIO()
+    call_command('import_legacy_letters', str(path), *args, stdout=out, stderr=err)
+    return out.getvalue(), err.getvalue()
+
+
+@pytest.mark.django_db
+class TestImportLegacyLetters:
+    # Tests for the batched legacy import
+
+    def test_letters_and_history_keep_the_legacy_dates(self, ledger):
+        path = ledger([
+            [1, '2019.03.04', 'Kiri Banda', 'HEALTH', 'REPLIED', '2019-03-04 09:30:00'],
+            [2, datetime(2019, 3, 5), 'Appu', 'REVENUE', None, None],
+        ])
+
+        out, _ = run_import(path)
+
+        assert 'Created: 2' in out and 'rows/s' in out
+        first, second = Letter.objects.order_by('serial_number')
+        legacy = timezone.make_aware(datetime(2019, 3, 4, 9, 30))
+        assert (first.date_received, first.status, first.created_at) == (date(2019, 3, 4), 'REPLIED', legacy)
+        assert (second.date_received, second.status, second.created_by) == (date(2019, 3, 5), 'PENDING', 'LEGACY_IMPORT')
+
+        record = first.history.get()
+        assert (record.history_type, record.history_date, record.created_at) == ('+', legacy, legacy)
+        assert record.history_change_reason == 'Legacy data import'
+        assert second.history.get().history_change_reason == 'Legacy data import'
+
+    def test_skips_blank_existing_and_repeated_serials(self, ledger):
+        Letter.objects.create(serial_number=1)
+        path = ledger([[1], [None], [2.0], ['2'], ['x7'], [3]])
+
+        out, err = run_import(path)
+
+        assert 'Created: 2, Blank rows skipped: 1, Already-existing skipped: 2, Errors: 1' in out
+        assert "invalid serial_number 'x7'" in err
+        assert list(Letter.objects.values_list('serial_number', flat=True)) == [1, 2, 3]
+
+    def test_queries_do_not_grow_with_rows(self, ledger, django_assert_max_num_queries):
+        path = ledger([[serial, None, 'Sender', 'HEALTH', None, '2019-01-01 08:00:00'] for serial in range(1, 201)])
+
+        # A few statements per batch of 100 (SQLite splits the INSERTs), not five per row
+        with django_assert_max_num_queries(30):
+            run_import(path, '--batch-size', '100')
+
+        assert Letter.objects.count() == 200
+        assert Letter.history.count() == 200
+
+    def test_failed_batch_is_retried_row_by_row(self, ledger, monkeypatch):
+        path = ledger([[1], [2], [3]])
+        original = Letter.objects.bulk_create
+
+        def refuse_serial_2(letters, *args, **kwargs):
+            if any(letter.serial_number == 2 for letter in letters):
+                raise ValueError("bad row")
+            return original(letters, *args, **kwargs)
+        monkeypatch.setattr(Letter.objects, 'bulk_create', refuse_serial_2)
+
+        out, err = run_import(path)
+
+        assert 'Created: 2' in out and 'Errors: 1' in out
+        assert 'Row 3: Error - bad row' in err
+        assert list(Letter.objects.values_list('serial_number', flat=True)) == [1, 3]
+        assert Letter.history.count() == 2
+
+    def test_dashboard_counters_are_refreshed(self, ledger, django_capture_on_commit_callbacks):
+        assert sector_counters()['total'] == 0
+
+        with django_capture_on_commit_callbacks(execute=True):
+            run_import(ledger([[1], [2]]))
+
+        assert sector_counters()['total'] == 2
+
+    def test_counters_cached_by_another_process_are_retired(self, ledger, monkeypatch,
+                                                            django_capture_on_commit_callbacks):
+        # The dashboard runs in the server process, with a cache of its own
+        server_cache = LocMemCache('server-process', {})
+        monkeypatch.setattr(counters, 'cache', server_cache)
+        assert sector_counters()['total'] == 0
+        monkeypatch.setattr(counters, 'cache', default_cache)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            run_import(ledger([[1], [2]]))
+
+        monkeypatch.setattr(counters, 'cache', server_cache)
+        assert sector_counters()['total'] == 2
+
+    def test_counters_are_retired_by_each_committed_batch(self, ledger, monkeypatch,
+                                                          django_capture_on_commit_callbacks):
+        assert sector_counters()['total'] == 0
+        original = Letter.objects.bulk_create
+
+        def power_cut(letters, *args, **kwargs):
+            if any(letter.serial_number == 3 for letter in letters):
+                raise KeyboardInterrupt
+            return original(letters, *args, **kwargs)
+        monkeypatch.setattr(Letter.objects, 'bulk_create', power_cut)
+
+        # Only the batch that committed leaves a version bump behind
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with pytest.raises(KeyboardInterrupt):
+                run_import(ledger([[1], [2], [3]]), '--batch-size', '2')
+
+        assert len(callbacks) == 1
+
+        assert sector_counters()['total'] == 2
+
+    def test_dry_run_saves_nothing(self, ledger):
+        out, _ = run_import(ledger([[1], [2]]), '--dry-run')
+
+        assert '[DRY RUN] Would import: 2' in out
+        assert not Letter.objects.exists()
+
+    def test_reads_csv_files(self, tmp_path):
+        path = tmp_path / 'ledger.csv'
+        path.write_text(
+            '\ufeffserial_number,date_received,sender_details,target_sector,status,created_at\n'
+            '1,2019.03.04,Kiri Banda,HEALTH,,2019-03-04 09:30:00\n'
+            ',,,,,\n'
+            '2,05/03/2019,Appu,,REPLIED,\n',
+            encoding='utf-8',
+        )
+
+        out, _ = run_import(path)
+
+        assert 'Created: 2, Blank rows skipped: 1' in out
+        first, second = Letter.objects.order_by('serial_number')
+        assert (first.date_received, first.status, first.target_sector) == (date(2019, 3, 4), 'PENDING', 'HEALTH')
+        assert first.created_at == timezone.make_aware(datetime(2019, 3, 4, 9, 30))
+        assert (second.date_received, second.status, second.target_sector) == (date(2019, 3, 5), 'REPLIED', None)
+
+    def test_reads_the_named_sheet(self, tmp_path):
+        workbook = Workbook()
+        workbook.active.append(['note'])
+        sheet = workbook.create_sheet('Register')
+        sheet.append(HEADERS)
+        sheet.append([7])
+        path = tmp_path / 'ledger.xlsx'
+        workbook.save(path)
+
+        with pytest.raises(CommandError, match="serial_number"):
+            run_import(path)
+        with pytest.raises(CommandError, match="Sheet 'Missing' not found"):
+            run_import(path, '--sheet', 'Missing')
+        run_import(path, '--sheet', 'Register')
+
+        assert list(Letter.objects.values_list('serial_number', flat=True)) == [7]
+
+    def test_summary_reports_peak_memory(self, ledger):
+        out, _ = run_import(ledger([[1]]))
+
+        assert re.search(r'rows/s, peak memory [\d,]+ MiB\.', out)
+
+    def test_resume_carries_on_after_the_last_committed_batch(self, ledger, monkeypatch):
+        path = ledger([[1], [2], [None], [3], [4], [5]])
+        original = Letter.objects.bulk_create
+
+        def power_cut(letters, *args, **kwargs):
+            if any(letter.serial_number == 3 for letter in letters):
+                raise KeyboardInterrupt
+            return original(letters, *args, **kwargs)
+        monkeypatch.setattr(Letter.objects, 'bulk_create', power_cut)
+
+        with pytest.raises(KeyboardInterrupt):
+            run_import(path, '--batch-size', '2')
+
+        # The second batch went nowhere, not even its savepointed rows
+        assert list(Letter.objects.values_list('serial_number', flat=True)) == [1, 2]
+        checkpoint = ImportCheckpoint.objects.get()
+        assert (checkpoint.last_row, checkpoint.created, checkpoint.file_name) == (3, 2, 'ledger.xlsx')
+
+        monkeypatch.setattr(Letter.objects, 'bulk_create', original)
+        out, _ = run_import(path, '--batch-size', '2', '--resume')
+
+        assert 'Resuming the import' in out and 'after row 3' in out
+        assert 'Created: 5, Blank rows skipped: 1, Already-existing skipped: 0' in out
+        assert list(Letter.objects.values_list('serial_number', flat=True)) == [1, 2, 3, 4, 5]
+        assert Letter.history.count() == 5
+        assert not ImportCheckpoint.objects.exists()
+
+    def test_without_resume_the_checkpoint_is_replaced(self, ledger):
+        path = ledger([[1], [2]])
+        ImportCheckpoint.objects.create(file_sha256=hashlib.sha256(path.read_bytes()).hexdigest(), last_row=2, created=1)
+
+        out, _ = run_import(path)
+
+        assert 'Created: 2' in out
+        assert not ImportCheckpoint.objects.exists()
+
+    def test_resume_of_an_unknown_file_starts_from_the_beginning(self, ledger):
+        out, _ = run_import(ledger([[1]]), '--resume')
+
+        assert 'starting from the beginning' in out and 'Created: 1' in out
+
+    def test_dry_run_writes_the_validation_report(self, ledger, tmp_path):
+        Letter.objects.create(serial_number=1)
+        path = ledger([
+            [1],
+            ['x7'],
+            [2, 'last Tuesday', None, 'PARKS', 'LOST', None],
+            [3, '2019.03.04'],
+        ])
+        report = tmp_path / 'rejected.csv'
+
+        out, _ = run_import(path, '--dry-run', '--report', str(report))
+
+        assert '[DRY RUN] Would import: 2, Blank rows skipped: 0, Already-existing skipped: 1, Rejected: 1' in out
+        with open(report, newline='', encoding='utf-8-sig') as f:
+            assert list(csv.reader(f)) == [
+                ['row', 'serial_number', 'issue', 'reason'],
+                ['2', '1', 'rejected', 'serial_number already exists'],
+                ['3', 'x7', 'rejected', "invalid serial_number 'x7'"],
+                ['4', '2', 'warning', "unrecognised sector 'PARKS' - importing anyway, please verify."],
+                ['4', '2', 'warning', "unrecognised status 'LOST', defaulting to PENDING."],
+                ['4', '2', 'warning', "unrecognised date_received 'last Tuesday', left empty."],
+            ]
+        assert not Letter.objects.filter(serial_number__gt=1).exists()
+
+    def test_resume_keeps_the_report_of_the_interrupted_run(self, ledger, tmp_path, monkeypatch):
+        path = ledger([[1], ['x'], [2], [3], ['y'], [4]])
+        report = tmp_path / 'rejected.csv'
+        original = Letter.objects.bulk_create
+
+        def power_cut(letters, *args, **kwargs):
+            if any(letter.serial_number == 3 for letter in letters):
+                raise KeyboardInterrupt
+            return original(letters, *args, **kwargs)
+        monkeypatch.setattr(Letter.objects, 'bulk_create', power_cut)
+
+        with pytest.raises(KeyboardInterrupt):
+            run_import(path, '--batch-size', '2', '--report', str(report))
+        monkeypatch.setattr(Letter.objects, 'bulk_create', original)
+        run_import(path, '--batch-size', '2', '--report', str(report), '--resume')
+
+        # Row 3 was reported by the first run only, row 6 by both but kept once
+        with open(report, newline='', encoding='utf-8-sig') as f:
+            assert list(csv.reader(f)) == [
+                ['row', 'serial_number', 'issue', 'reason'],
+                ['3', 'x', 'rejected', "invalid serial_number 'x'"],
+                ['6', 'y', 'rejected', "invalid serial_number 'y'"],
+            ]
+
+    def test_validation_on_worker_processes_keeps_file_order(self, ledger, monkeypatch):
+        monkeypatch.setattr(legacy_import, 'CHUNK_ROWS', 7)
+        rows = [[serial, '2019.01.02', f'Sender {serial}', 'HEALTH', None, '2019-01-02 10:00:00'] for serial in range(1, 61)]
+        rows[30] = [5]
+        path = ledger(rows)
+
+        out, _ = run_import(path, '--workers', '2', '--batch-size', '25')
+
+        assert 'Created: 59, Blank rows skipped: 0, Already-existing skipped: 1' in out
+        assert 'Row 32: serial_number 5 already exists' in out
+        letter = Letter.objects.get(serial_number=60)
+        assert (letter.sender_details, letter.date_received) == ('Sender 60', date(2019, 1, 2))
+        assert letter.created_at == timezone.make_aware(datetime(2019, 1, 2, 10))
+
+    def test_upsert_updates_only_changed_letters(self, ledger):
+        changed = Letter.objects.create(serial_number=1, sender_details='Kiri Banda', status='PENDING',
+                                        target_sector='HEALTH')
+        same = Letter.objects.create(serial_number=2, sender_details='Appu', status='REPLIED',
+                                     accepting_officer_id='12')
+        path = ledger([
+            [1, 'Kiri Banda', 'REPLIED', None],
+            [2, 'Appu', 'REPLIED', 12],
+            [3, 'Sunil', None, None],
+        ], headers=['serial_number', 'sender_details', 'status', 'accepting_officer_id'])
+        history_before = Letter.history.count()
+
+        out, _ = run_import(path, '--mode', 'upsert')
+
+        assert 'Created: 1, Updated: 1, Unchanged: 1, Blank rows skipped: 0, Already-existing skipped: 0' in out
+        assert 'Fields changed: status 1.' in out
+        changed.refresh_from_db()
+        # Columns the sheet does not have are left alone
+        assert (changed.status, changed.target_sector) == ('REPLIED', 'HEALTH')
+        record = changed.history.first()
+        assert (record.history_type, record.status, record.history_change_reason) == ('~', 'REPLIED', 'Spreadsheet sync')
+        assert same.history.count() == 1
+        assert Letter.history.count() == history_before + 2
+
+    def test_resumed_upsert_keeps_its_counts_and_the_serials_already_seen(self, ledger, monkeypatch):
+        Letter.objects.create(serial_number=1, status='PENDING')
+        Letter.objects.create(serial_number=2, status='REPLIED')
+        path = ledger([
+            [1, 'REPLIED'],
+            [2, 'REPLIED'],
+            [3, 'PENDING'],
+            # The same serial again, after the rows the first run committed
+            [1, 'NOT_REQUIRED'],
+        ], headers=['serial_number', 'status'])
+        original = Letter.objects.bulk_create
+
+        def power_cut(letters, *args, **kwargs):
+            if any(letter.serial_number == 3 for letter in letters):
+                raise KeyboardInterrupt
+            return original(letters, *args, **kwargs)
+        monkeypatch.setattr(Letter.objects, 'bulk_create', power_cut)
+
+        with pytest.raises(KeyboardInterrupt):
+            run_import(path, '--mode', 'upsert', '--batch-size', '2')
+        monkeypatch.setattr(Letter.objects, 'bulk_create', original)
+        out, _ = run_import(path, '--mode', 'upsert', '--batch-size', '2', '--resume')
+
+        assert 'Created: 1, Updated: 1, Unchanged: 1, Blank rows skipped: 0, Already-existing skipped: 1' in out
+        assert 'Fields changed: status 1.' in out
+        assert Letter.objects.get(serial_number=1).status == 'REPLIED'
+
+    def test_upsert_queries_do_not_grow_with_rows(self, ledger, django_assert_max_num_queries):
+        Letter.objects.bulk_create([Letter(serial_number=serial, status='PENDING') for serial in range(1, 201)])
+        path = ledger([[serial, 'REPLIED'] for serial in range(1, 201)], headers=['serial_number', 'status'])
+
+        with django_assert_max_num_queries(30):
+            out, _ = run_import(path, '--mode', 'upsert', '--batch-size', '100')
+
+        assert 'Updated: 200' in out
+        assert not Letter.objects.exclude(status='REPLIED').exists()
+        assert Letter.history.filter(history_type='~').count() == 200
+
+    def test_upsert_dry_run_reports_changes_without_saving(self, ledger):
+        Letter.objects.create(serial_number=1, status='PENDING')
+        path = ledger([[1, 'REPLIED'], [2, None]], headers=['serial_number', 'status'])
+
+        out, _ = run_import(path, '--mode', 'upsert', '--dry-run')
+
+        assert '[DRY RUN] Would import: 1, Would update: 1, Unchanged: 0' in out
+        assert 'Fields changed: status 1.' in out
+        assert Letter.objects.get().status == 'PENDING'
+
+    def test_upsert_leaves_unreadable_and_defaulted_cells_alone(self, ledger):
+        letter = Letter.objects.create(serial_number=1, status='REPLIED', date_received=date(2024, 3, 1),
+                                       target_sector='HEALTH', created_by='clerk', sender_details='Appu')
+        other = Letter.objects.create(serial_number=2, status='REPLIED', created_by='clerk')
+        path = ledger([
+            [1, 'Replied', '2024.13.01', 'Health', None, 'Appu Hamy'],
+            [2, None, None, None, None, None],
+        ], headers=['serial_number', 'status', 'date_received', 'target_sector', 'created_by', 'sender_details'])
+
+        out, _ = run_import(path, '--mode', 'upsert')
+
+        assert 'Updated: 1, Unchanged: 1' in out
+        assert 'Fields changed: sender_details 1.' in out
+        letter.refresh_from_db()
+        assert (letter.status, letter.date_received, letter.target_sector, letter.created_by) == (
+            'REPLIED', date(2024, 3, 1), 'HEALTH', 'clerk')
+        assert letter.sender_details == 'Appu Hamy'
+        other.refresh_from_db()
+        assert (other.status, other.created_by) == ('REPLIED', 'clerk')
+        assert other.history.count() == 1
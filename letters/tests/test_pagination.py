@@ -0,0 +1,151 @@
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from letters.models import Letter, SectorProfile
+from letters.pagination import KeysetPaginator
+
+
+def serials(page):
+    return [letter.serial_number for letter in page]
+
+
+@pytest.mark.django_db
+class TestKeysetPaginator:
+    # Tests for seek pagination over serial_number
+
+    @pytest.fixture(autouse=True)
+    def letters(self):
+        for i in range(45):
+            Letter.objects.create(serial_number=i + 1)
+
+    def test_opens_on_latest_letters_in_ascending_order(self):
+        page = KeysetPaginator(Letter.objects.all(), 20).get_page(None)
+
+        assert serials(page) == list(range(26, 46))
+        assert page.has_previous()
+        assert not page.has_next()
+
+    def test_walks_backwards_and_forwards(self):
+        paginator = KeysetPaginator(Letter.objects.all(), 20)
+
+        latest = paginator.get_page(None)
+        middle = paginator.get_page(latest.previous_cursor)
+        oldest = paginator.get_page(middle.previous_cursor)
+
+        assert serials(middle) == list(range(6, 26))
+        assert serials(oldest) == list(range(1, 6))
+        assert not oldest.has_previous()
+
+        assert serials(paginator.get_page(oldest.next_cursor)) == list(range(6, 26))
+
+    def test_first_page(self):
+        page = KeysetPaginator(Letter.objects.all(), 20).get_page('first')
+
+        assert serials(page) == list(range(1, 21))
+        assert not page.has_previous()
+        assert page.has_next()
+
+    def test_gaps_in_serials_are_skipped(self):
+        Letter.objects.filter(serial_number__in=[20, 21, 22]).delete()
+
+        page = KeysetPaginator(Letter.objects.all(), 5).get_page('a18')
+
+        assert serials(page) == [19, 23, 24, 25, 26]
+
+    def test_respects_filters(self):
+        Letter.objects.filter(serial_number__gt=40).update(target_sector='HEALTH')
+
+        page = KeysetPaginator(Letter.objects.filter(target_sector='HEALTH'), 20).get_page(None)
+
+        assert serials(page) == [41, 42, 43, 44, 45]
+        assert not page.has_other_pages()
+
+    def test_bad_cursor_falls_back_to_latest(self):
+        paginator = KeysetPaginator(Letter.objects.all(), 20)
+
+        assert serials(paginator.get_page('nonsense')) == list(range(26, 46))
+        assert serials(paginator.get_page('a9999')) == list(range(26, 46))
+
+    def test_cursor_ending_at_serial(self):
+        paginator = KeysetPaginator(Letter.objects.all(), 20)
+
+        page = paginator.get_page(paginator.cursor_ending_at(30))
+
+        assert serials(page)[-1] == 30
+        assert len(page) == 20
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(KeysetPaginator(Letter.objects.all(), 20).get_page(None))
+
+        assert not any('COUNT(' in query['sql'].upper() for query in queries.captured_queries)
+
+
+@pytest.mark.django_db
+class TestSerialJump:
+    # The serial search should land on the page that holds the letter
+
+    def test_jump_lands_on_target_page(self, client):
+        user = User.objects.create_user(username='jump_user', password='pass')
+        SectorProfile.objects.create(user=user, sector='HEALTH')
+        client.force_login(user)
+
+        for i in range(60):
+            Letter.objects.create(serial_number=i + 1)
+
+        response = client.get(reverse('sector_dashboard'), {'q': '17', 'search_type': 'serial'})
+
+        assert response.context['highlight_serial'] == 17
+        assert 17 in serials(response.context['letters'])
+
+    def test_new_letter_lands_on_latest_page(self, client):
+        admin = User.objects.create_superuser(username='admin', password='pass')
+        client.force_login(admin)
+
+        for i in range(30):
+            Letter.objects.create(serial_number=i + 1)
+
+        response = client.get(reverse('custom_admin_letters'), {'q': '30', 'search_type': 'serial'})
+
+        assert serials(response.context['letters']) == list(range(11, 31))
+
+    def test_jump_respects_filters(self, client):
+        admin = User.objects.create_superuser(username='admin', password='pass')
+        client.force_login(admin)
+
+        for i in range(60):
+            Letter.objects.create(serial_number=i + 1, target_sector='HEALTH' if i % 2 else 'REVENUE')
+
+        response = client.get(reverse('custom_admin_letters'), {'q': '40', 'search_type': 'serial', 'sector': 'HEALTH'})
+
+        page = serials(response.context['letters'])
+        assert page[-1] == 40
+        assert all(serial % 2 == 0 for serial in page)
+
+        # Serial 41 belongs to another sector, so it is not found here
+        response = client.get(reverse('custom_admin_letters'), {'q': '41', 'search_type': 'serial', 'sector': 'HEALTH'})
+        assert response.context['highlight_serial'] is None
+        assert response.context['total_letters'] == 0
+
+    def test_jump_ignores_non_numbers(self, client):
+        admin = User.objects.create_superuser(username='admin', password='pass')
+        client.force_login(admin)
+        Letter.objects.create(serial_number=1)
+
+        response = client.get(reverse('custom_admin_letters'), {'q': 'abc', 'search_type': 'serial'})
+
+        assert response.status_code == 200
+        assert response.context['total_letters'] == 0
+        assert response.context['highlight_serial'] is None
+
+    def test_jump_accepts_hash_prefix(self, client):
+        admin = User.objects.create_superuser(username='admin', password='pass')
+        client.force_login(admin)
+        Letter.objects.create(serial_number=48213)
+
+        response = client.get(reverse('custom_admin_letters'), {'q': '#48213', 'search_type': 'serial'})
+
+        assert response.context['highlight_serial'] == 48213
@@ -0,0 +1,264 @@
+import io
+from functools import cache
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from PIL import Image
+
+from letters.attachments import process_pending
+from letters.models import Letter, SectorProfile
+from letters.renditions import has_renditions, page_name, rendition_name
+from letters.tests.conftest import photo
+
+pytestmark = pytest.mark.usefixtures('media')
+
+
+@cache
+def pdf_bytes():
+    # Built once: Pillow stamps the creation time into the file
+    data = io.BytesIO()
+    first, *rest = [Image.new('RGB', (595, 842), color=colour) for colour in ['white', 'red', 'blue']]
+    first.save(data, format='PDF', save_all=True, append_images=rest)
+    return data.getvalue()
+
+
+def pdf(name='register.pdf'):
+    return SimpleUploadedFile(name, pdf_bytes(), content_type='application/pdf')
+
+
+def served_size(response):
+    return Image.open(io.BytesIO(b''.join(response.streaming_content))).size
+
+
+@pytest.mark.django_db
+class TestRenditions:
+    # Tests for the thumbnail and preview renditions made at processing time
+
+    def test_sync_save_stores_renditions_next_to_attachment(self):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+        storage = letter.attachment_1.storage
+
+        root = letter.attachment_1.name.removesuffix('.jpg')
+        assert rendition_name(letter.attachment_1.name, 'thumb') == f'{root}.thumb.jpg'
+        assert Image.open(storage.open(f'{root}.thumb.jpg')).size == (240, 180)
+        assert Image.open(storage.open(f'{root}.preview.jpg')).size == (600, 450)
+
+    def test_worker_stores_renditions(self, settings):
+        settings.ATTACHMENT_PROCESSING = 'background'
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+        assert not has_renditions(letter.attachment_1.storage, letter.attachment_1.name)
+
+        process_pending(workers=1)
+
+        letter.refresh_from_db()
+        assert has_renditions(letter.attachment_1.storage, letter.attachment_1.name)
+
+    def test_renditions_deleted_with_attachment(self, django_capture_on_commit_callbacks):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo(), attachment_2=photo(color='blue'))
+        storage = letter.attachment_1.storage
+        first, second = rendition_name(letter.attachment_1.name, 'thumb'), rendition_name(letter.attachment_2.name, 'thumb')
+
+        letter.attachment_2 = None
+        with django_capture_on_commit_callbacks(execute=True):
+            letter.save()
+        assert not storage.exists(second)
+        assert storage.exists(first)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            letter.delete()
+        assert not storage.exists(first)
+
+    def test_file_that_is_not_an_image_has_none(self):
+        pdf = SimpleUploadedFile('notes.pdf', b'%PDF-1.4', content_type='application/pdf')
+        letter = Letter.objects.create(serial_number=7, attachment_1=pdf)
+
+        assert not has_renditions(letter.attachment_1.storage, letter.attachment_1.name)
+
+
+@pytest.mark.django_db
+class TestServeVariant:
+    # Tests for serve_attachment's ?variant= parameter
+
+    @pytest.fixture
+    def letter(self, client):
+        user = User.objects.create_user(username='health', password='pass')
+        SectorProfile.objects.create(user=user, sector='HEALTH')
+        client.force_login(user)
+        return Letter.objects.create(serial_number=7, target_sector='HEALTH', attachment_1=photo())
+
+    def test_variants(self, client, letter):
+        url = reverse('serve_attachment', args=[letter.pk, 'attachment_1'])
+
+        assert served_size(client.get(url)) == (1200, 900)
+        assert served_size(client.get(url, {'variant': 'thumb'})) == (240, 180)
+        assert served_size(client.get(url, {'variant': 'preview'})) == (600, 450)
+
+    def test_unknown_variant_is_404(self, client, letter):
+        url = reverse('serve_attachment', args=[letter.pk, 'attachment_1'])
+
+        assert client.get(url, {'variant': '../../settings'}).status_code == 404
+
+    def test_missing_rendition_serves_full_attachment(self, client, letter):
+        letter.attachment_1.storage.delete(rendition_name(letter.attachment_1.name, 'thumb'))
+        url = reverse('serve_attachment', args=[letter.pk, 'attachment_1'])
+
+        assert served_size(client.get(url, {'variant': 'thumb'})) == (1200, 900)
+
+    def test_other_sector_cannot_fetch_variant(self, client, letter):
+        Letter.objects.filter(pk=letter.pk).update(target_sector='REVENUE')
+        url = reverse('serve_attachment', args=[letter.pk, 'attachment_1'])
+
+        assert client.get(url, {'variant': 'thumb'}).status_code == 404
+
+    def test_viewer_sidebar_uses_thumbnails(self, client, letter):
+        response = client.get(reverse('view_letter_images', args=[letter.pk]))
+
+        url = reverse('serve_attachment', args=[letter.pk, 'attachment_1'])
+        assert response.context['attachments'] == [{
+            'url': url, 'kind': 'image', 'pages': 0, 'full': url,
+            'thumb': f'{url}?variant=thumb', 'preview': f'{url}?variant=preview',
+        }]
+        assert f'src="{url}?variant=thumb"' in response.content.decode()
+
+
+@pytest.mark.django_db
+class TestGenerateRenditionsCommand:
+    # Tests for backfilling renditions of existing letters
+
+    def test_backfills_missing_renditions(self):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo(), attachment_2=photo(color='blue'))
+        broken = Letter.objects.create(
+            serial_number=8,
+            attachment_1=SimpleUploadedFile('notes.pdf', b'%PDF-1.4', content_type='application/pdf'),
+        )
+        storage = letter.attachment_1.storage
+        storage.delete(rendition_name(letter.attachment_2.name, 'thumb'))
+        storage.delete(rendition_name(letter.attachment_2.name, 'preview'))
+        out, err = io.StringIO(), io.StringIO()
+
+        call_command('generate_renditions', stdout=out, stderr=err)
+
+        assert has_renditions(storage, letter.attachment_2.name)
+        assert 'Created renditions for 1 attachment(s); 1 already had them, 1 could not be rendered.' in out.getvalue()
+        assert broken.attachment_1.name in err.getvalue()
+
+    def test_skips_queued_uploads(self, settings):
+        settings.ATTACHMENT_PROCESSING = 'background'
+        Letter.objects.create(serial_number=7, attachment_1=photo())
+        out = io.StringIO()
+
+        call_command('generate_renditions', stdout=out)
+
+        assert 'Created renditions for 0 attachment(s); 0 already had them, 0 could not be rendered.' in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestPdfAttachments:
+    # Tests for content types and PDFs kept as uploaded
+
+    @pytest.fixture
+    def letter(self, client):
+        user = User.objects.create_user(username='health', password='pass')
+        SectorProfile.objects.create(user=user, sector='HEALTH')
+        client.force_login(user)
+        return Letter.objects.create(serial_number=7, target_sector='HEALTH', attachment_1=photo(), attachment_2=pdf())
+
+    def url(self, letter):
+        return reverse('serve_attachment', args=[letter.pk, 'attachment_2'])
+
+    def test_pdf_is_stored_unchanged(self, letter):
+        assert letter.attachment_2.name.endswith('.pdf')
+        assert letter.attachment_2.read() == pdf_bytes()
+
+    def test_content_type_and_size_recorded_at_upload(self, letter):
+        scan, document = letter.attachment_meta['attachment_1'], letter.attachment_meta['attachment_2']
+
+        assert scan['content_type'] == 'image/jpeg'
+        assert document['content_type'] == 'application/pdf'
+        assert document['size'] == letter.attachment_2.size
+
+    def test_served_with_its_content_type(self, client, letter):
+        assert client.get(self.url(letter))['Content-Type'] == 'application/pdf'
+        assert client.get(reverse('serve_attachment', args=[letter.pk, 'attachment_1']))['Content-Type'] == 'image/jpeg'
+
+    def test_older_pdf_is_sniffed(self, client, letter):
+        Letter.objects.filter(pk=letter.pk).update(attachment_meta={})
+
+        assert client.get(self.url(letter))['Content-Type'] == 'application/pdf'
+
+    def test_worker_keeps_pdf(self, settings):
+        settings.ATTACHMENT_PROCESSING = 'background'
+        letter = Letter.objects.create(serial_number=7, attachment_2=pdf())
+        stored = letter.attachment_2.name
+        assert stored.endswith('.pdf')
+
+        process_pending(workers=1)
+
+        letter.refresh_from_db()
+        assert letter.attachment_2.name == stored
+        assert letter.attachment_meta['attachment_2']['content_type'] == 'application/pdf'
+
+
+@pytest.mark.django_db
+class TestPdfPages:
+    # Tests for page-1 previews and pages rendered on demand (needs PyMuPDF)
+
+    @pytest.fixture(autouse=True)
+    def pymupdf(self):
+        pytest.importorskip('pymupdf')
+
+    @pytest.fixture
+    def letter(self, client):
+        user = User.objects.create_user(username='health', password='pass')
+        SectorProfile.objects.create(user=user, sector='HEALTH')
+        client.force_login(user)
+        return Letter.objects.create(serial_number=7, target_sector='HEALTH', attachment_2=pdf())
+
+    def url(self, letter):
+        return reverse('serve_attachment', args=[letter.pk, 'attachment_2'])
+
+    def test_page_count_and_first_page_renditions(self, client, letter):
+        assert letter.attachment_meta['attachment_2']['pages'] == 3
+        assert letter.attachment_meta['attachment_2']['renditions']
+        thumb = client.get(self.url(letter), {'variant': 'thumb'})
+
+        assert thumb['Content-Type'] == 'image/jpeg'
+        assert served_size(thumb)[1] == 320
+
+    def test_page_rendered_when_asked_for(self, client, letter):
+        storage = letter.attachment_2.storage
+        assert not storage.exists(page_name(letter.attachment_2.name, 2))
+
+        response = client.get(self.url(letter), {'page': 2})
+
+        assert response['Content-Type'] == 'image/jpeg'
+        assert served_size(response)[1] == 1600
+        assert Image.open(storage.open(page_name(letter.attachment_2.name, 2))).getpixel((300, 400))[0] > 200
+
+    @pytest.mark.parametrize('page', ['0', '4', 'two'])
+    def test_page_out_of_range_is_404(self, client, letter, page):
+        assert client.get(self.url(letter), {'page': page}).status_code == 404
+
+    def test_pages_deleted_with_attachment(self, client, letter, django_capture_on_commit_callbacks):
+        client.get(self.url(letter), {'page': 2})
+        storage = letter.attachment_2.storage
+
+        with django_capture_on_commit_callbacks(execute=True):
+            letter.delete()
+
+        assert not storage.exists(page_name(letter.attachment_2.name, 2))
+        assert not storage.exists(rendition_name(letter.attachment_2.name, 'thumb'))
+
+    def test_viewer_turns_pages(self, client, letter):
+        response = client.get(reverse('view_letter_images', args=[letter.pk]))
+
+        url = self.url(letter)
+        attachment, = response.context['attachments']
+        assert attachment['kind'] == 'pages'
+        assert attachment['pages'] == 3
+        assert attachment['full'] == f'{url}?page=1'
+        # Later pages are only fetched by the page controls
+        assert f'{url}?page=2' not in response.content.decode()
@@ -0,0 +1,217 @@
+from datetime import date
+from io import BytesIO
+
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.urls import reverse
+
+from letters.models import Letter, SectorProfile
+from letters.search import (
+    search_letters, fuzzy_search_letters, build_search_query, is_ranked, parse_date_range, date_search_letters,
+)
+
+requires_postgres = pytest.mark.skipif(
+    connection.vendor != 'postgresql', reason="Full-text search needs PostgreSQL"
+)
+
+
+@pytest.mark.django_db
+class TestSearchLetters:
+    # Tests for the shared search backend - behaviour common to every database
+
+    def test_blank_query_returns_everything(self):
+        Letter.objects.create(serial_number=1, sender_details='Kiri Banda')
+        Letter.objects.create(serial_number=2, sender_details='Sunil Perera')
+
+        assert search_letters(Letter.objects.all(), '   ').count() == 2
+
+    def test_matches_sender_subject_and_serial(self):
+        Letter.objects.create(serial_number=4821, sender_details='Kiri Banda', letter_type='Tax')
+        Letter.objects.create(serial_number=2, sender_details='Sunil Perera', letter_type='Building approval')
+
+        assert list(search_letters(Letter.objects.all(), 'Kiri').values_list('serial_number', flat=True)) == [4821]
+        assert list(search_letters(Letter.objects.all(), 'Building').values_list('serial_number', flat=True)) == [2]
+        assert list(search_letters(Letter.objects.all(), '4821').values_list('serial_number', flat=True)) == [4821]
+
+    def test_matches_sinhala_sender(self):
+        Letter.objects.create(serial_number=1, sender_details='කිරි බණ්ඩා, ග්‍රාම නිලධාරී')
+        Letter.objects.create(serial_number=2, sender_details='Sunil Perera')
+
+        assert list(search_letters(Letter.objects.all(), 'බණ්ඩා').values_list('serial_number', flat=True)) == [1]
+
+    def test_query_syntax_characters_are_harmless(self):
+        Letter.objects.create(serial_number=1, sender_details='Kiri Banda')
+
+        assert search_letters(Letter.objects.all(), "Kiri (Banda) & | ! ' \\").count() in (0, 1)
+        assert build_search_query("&|!():*") is None
+
+    def test_respects_existing_filters(self):
+        Letter.objects.create(serial_number=1, sender_details='Kiri Banda', target_sector='HEALTH')
+        Letter.objects.create(serial_number=2, sender_details='Kiri Banda', target_sector='REVENUE')
+
+        letters = Letter.objects.filter(target_sector='HEALTH')
+        assert list(search_letters(letters, 'Kiri').values_list('serial_number', flat=True)) == [1]
+
+
+@requires_postgres
+@pytest.mark.django_db
+class TestFullTextSearch:
+    # Tests for the PostgreSQL tsvector path
+
+    def test_trigger_maintains_search_vector(self):
+        letter = Letter.objects.create(serial_number=1, sender_details='Kiri Banda', target_sector='HEALTH')
+        letter.refresh_from_db()
+        assert 'kiri' in letter.search_vector
+
+        letter.sender_details = 'Sunil Perera'
+        letter.save()
+        letter.refresh_from_db()
+        assert 'kiri' not in letter.search_vector
+        assert 'sunil' in letter.search_vector
+
+    def test_prefix_matching_while_typing(self):
+        Letter.objects.create(serial_number=1, sender_details='Kiribanda Wijesinghe')
+
+        assert search_letters(Letter.objects.all(), 'Kiri').count() == 1
+
+    def test_sector_labels_in_both_languages(self):
+        Letter.objects.create(serial_number=1, target_sector='HEALTH')
+        Letter.objects.create(serial_number=2, target_sector='REVENUE')
+
+        assert list(search_letters(Letter.objects.all(), 'Health').values_list('serial_number', flat=True)) == [1]
+        assert list(search_letters(Letter.objects.all(), 'ආදායම්').values_list('serial_number', flat=True)) == [2]
+
+    def test_results_are_ranked(self):
+        Letter.objects.create(serial_number=1, sender_details='Ruwan', letter_type='Building approval for Kiri')
+        Letter.objects.create(serial_number=2, sender_details='Kiri Banda', letter_type='Tax')
+
+        results = search_letters(Letter.objects.all(), 'Kiri')
+
+        assert is_ranked(results)
+        # A sender match weighs more than a subject match
+        assert list(results.values_list('serial_number', flat=True)) == [2, 1]
+
+    def test_ranked_search_opens_on_first_page(self, client):
+        user = User.objects.create_user(username='ranked_user', password='pass')
+        SectorProfile.objects.create(user=user, sector='HEALTH')
+        client.force_login(user)
+
+        for i in range(25):
+            Letter.objects.create(serial_number=i + 1, sender_details=f'Kiri Banda {i}')
+
+        response = client.get(reverse('sector_dashboard'), {'q': 'Kiri', 'search_type': 'all'})
+
+        assert response.context['letters'].number == 1
+        assert response.context['total'] == 25
+
+
+@pytest.mark.django_db
+class TestFuzzySearch:
+    # Tests for the "did you mean" search mode
+
+    def test_fuzzy_search_from_dashboard(self, client):
+        user = User.objects.create_user(username='fuzzy_user', password='pass')
+        SectorProfile.objects.create(user=user, sector='HEALTH')
+        client.force_login(user)
+
+        Letter.objects.create(serial_number=1, sender_details='Sunil Perera')
+        Letter.objects.create(serial_number=2, sender_details='Kamala Jayawardena')
+
+        response = client.get(reverse('sector_dashboard'), {'q': 'Perera', 'search_type': 'fuzzy'})
+
+        assert response.status_code == 200
+        assert response.context['total'] == 1
+        assert response.context['search_type'] == 'fuzzy'
+
+    @requires_postgres
+    def test_misspelt_name_is_found(self):
+        Letter.objects.create(serial_number=1, sender_details='Ananda Wickramasinghe, Water Board')
+        Letter.objects.create(serial_number=2, sender_details='Kamala Jayawardena')
+
+        results = fuzzy_search_letters(Letter.objects.all(), 'Wickremasinghe')
+
+        assert list(results.values_list('serial_number', flat=True)) == [1]
+
+    @requires_postgres
+    def test_closest_match_first(self):
+        Letter.objects.create(serial_number=1, sender_details='Jayasekara Mudalige')
+        Letter.objects.create(serial_number=2, sender_details='Jayasekera Mudalige')
+
+        results = fuzzy_search_letters(Letter.objects.all(), 'Jayasekera')
+
+        assert is_ranked(results)
+        assert list(results.values_list('serial_number', flat=True))[0] == 2
+
+
+class TestParseDateRange:
+    # Tests for the date search syntax
+
+    @pytest.mark.parametrize('text, expected', [
+        ('2026-03-14', (date(2026, 3, 14), date(2026, 3, 14))),
+        ('2026-03', (date(2026, 3, 1), date(2026, 3, 31))),
+        ('2024-02', (date(2024, 2, 1), date(2024, 2, 29))),
+        ('2026', (date(2026, 1, 1), date(2026, 12, 31))),
+        ('2026/3/4', (date(2026, 3, 4), date(2026, 3, 4))),
+        (' 2026-01-01..2026-02-15 ', (date(2026, 1, 1), date(2026, 2, 15))),
+        ('2026-01..2026-03', (date(2026, 1, 1), date(2026, 3, 31))),
+        ('2026-03..', (date(2026, 3, 1), None)),
+        ('..2025', (None, date(2025, 12, 31))),
+        ('2026-02..2026-01', (date(2026, 1, 1), date(2026, 2, 28))),
+    ])
+    def test_valid(self, text, expected):
+        assert parse_date_range(text) == expected
+
+    @pytest.mark.parametrize('text', ['', '..', 'March', '2026-13', '2026-02-30', '26-01-01', '2026-01..soon'])
+    def test_invalid(self, text):
+        assert parse_date_range(text) is None
+
+
+@pytest.mark.django_db
+class TestDateSearch:
+    # Tests for filtering letters by received date
+
+    @pytest.fixture(autouse=True)
+    def letters(self):
+        Letter.objects.create(serial_number=1, date_received=date(2025, 12, 31))
+        Letter.objects.create(serial_number=2, date_received=date(2026, 1, 15))
+        Letter.objects.create(serial_number=3, date_received=date(2026, 2, 15))
+        Letter.objects.create(serial_number=4, date_received=date(2026, 2, 16))
+        Letter.objects.create(serial_number=5)
+
+    def found(self, text):
+        return list(date_search_letters(Letter.objects.all(), text).values_list('serial_number', flat=True))
+
+    def test_range_is_inclusive(self):
+        assert self.found('2026-01-01..2026-02-15') == [2, 3]
+
+    def test_month_and_year(self):
+        assert self.found('2026-02') == [3, 4]
+        assert self.found('2026') == [2, 3, 4]
+
+    def test_open_range(self):
+        assert self.found('2026-02-16..') == [4]
+        assert self.found('..2026-01') == [1, 2]
+
+    def test_not_a_date_matches_nothing(self):
+        assert self.found('yesterday') == []
+
+    def test_admin_listing_date_range(self, client):
+        admin = User.objects.create_superuser(username='admin', password='pass')
+        client.force_login(admin)
+
+        response = client.get(reverse('custom_admin_letters'), {'q': '2026-01..2026-02', 'search_type': 'date'})
+
+        assert response.context['total_letters'] == 3
+
+    def test_export_uses_the_same_date_filter(self, client):
+        from openpyxl import load_workbook
+
+        admin = User.objects.create_superuser(username='admin', password='pass')
+        client.force_login(admin)
+
+        response = client.get(reverse('export_letters_excel'), {'q': '2026-02', 'search_type': 'date'})
+
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        serials = [row[0] for row in sheet.iter_rows(values_only=True) if isinstance(row[0], int)]
+        assert serials == [3, 4]
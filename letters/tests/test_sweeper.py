@@ -0,0 +1,130 @@
+import io
+
+import pytest
+from django.core.management import call_command
+
+from letters.models import Blob, Letter, StorageSweep
+from letters.renditions import rendition_name
+from letters.tests.conftest import photo
+
+
+def sweep(*args):
+    out = io.StringIO()
+    call_command('sweep_attachments', '--min-age', '0', *args, stdout=out)
+    return out.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def sync(settings):
+    settings.ATTACHMENT_PROCESSING = 'sync'
+
+
+def put(media, name, data=b'x' * 1000):
+    path = media / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+@pytest.mark.django_db
+class TestSweepAttachmentsCommand:
+    # Tests for finding orphaned and missing attachment files
+
+    def test_reports_orphans_without_deleting(self, media):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+        orphan = put(media, 'blobs/ab/' + 'ab' * 32 + '.jpg')
+        put(media, 'blobs/ab/' + 'ab' * 32 + '.thumb.jpg', b'x' * 500)
+
+        out = sweep()
+
+        assert f"orphan: blobs/ab/{'ab' * 32}.jpg" in out
+        assert f"orphan: blobs/ab/{'ab' * 32}.thumb.jpg" in out
+        assert letter.attachment_1.name not in out
+        assert 'Checked 5 file(s): 2 orphan(s) taking 1.5\xa0KB, 0 missing file(s).' in out
+        assert orphan.exists()
+        assert not StorageSweep.objects.exists()
+
+    def test_delete_reclaims_space(self, media):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo())
+        orphan = put(media, 'blobs/ab/' + 'ab' * 32 + '.jpg')
+
+        out = sweep('--delete')
+
+        assert not orphan.exists()
+        assert (media / letter.attachment_1.name).exists()
+        assert (media / rendition_name(letter.attachment_1.name, 'thumb')).exists()
+        assert 'Reclaimed 1000\xa0bytes (1000 bytes).' in out
+
+    def test_legacy_directories(self, media):
+        letter = Letter.objects.create(serial_number=7)
+        put(media, 'letters/7/Attachment_7_1.jpg')
+        put(media, 'letters/7/Attachment_7_1.thumb.jpg')
+        put(media, 'letters/7/Attachment_7_2.jpg')
+        Letter.objects.filter(pk=letter.pk).update(attachment_1='letters/7/Attachment_7_1.jpg')
+        # Stored under its old serial number
+        renumbered = Letter.objects.create(serial_number=12)
+        put(media, 'letters/8/Attachment_8_1.pdf')
+        Letter.objects.filter(pk=renumbered.pk).update(attachment_1='letters/8/Attachment_8_1.pdf')
+
+        out = sweep()
+
+        assert 'orphan: letters/7/Attachment_7_2.jpg' in out
+        assert '2 orphan(s)' not in out and '1 orphan(s)' in out
+
+    def test_recent_files_are_left_alone(self, media):
+        put(media, 'blobs/ab/' + 'ab' * 32 + '.jpg')
+        out = io.StringIO()
+
+        call_command('sweep_attachments', stdout=out)
+
+        assert '0 orphan(s)' in out.getvalue()
+
+    def test_missing_files(self, media):
+        letter = Letter.objects.create(serial_number=7, attachment_1=photo(), attachment_2=photo(color='blue'))
+        (media / letter.attachment_2.name).unlink()
+
+        out = sweep()
+        assert f"missing: {letter.attachment_2.name} (attachment_2 of letter id {letter.pk})" in out
+        assert '1 missing file(s)' in out
+
+        sweep('--clear-missing')
+        letter.refresh_from_db()
+        assert letter.attachment_1 and not letter.attachment_2
+        assert 'attachment_2' not in letter.attachment_meta
+        assert list(Blob.objects.values_list('name', flat=True)) == [letter.attachment_1.name]
+
+    def test_clearing_missing_files_releases_their_blob(self, media):
+        first = Letter.objects.create(serial_number=7, attachment_1=photo())
+        Letter.objects.create(serial_number=8, attachment_1=photo())
+        (media / first.attachment_1.name).unlink()
+
+        sweep('--clear-missing')
+
+        # Both letters pointed at the missing blob; each cleared one drops a reference
+        assert not Letter.objects.exclude(attachment_1='').exists()
+        assert not Blob.objects.exists()
+
+    def test_resumes_from_checkpoint(self, media):
+        Letter.objects.create(serial_number=7, attachment_1=photo())
+        put(media, 'blobs/00/' + '00' * 32 + '.jpg')
+        put(media, 'letters/9/Attachment_9_1.jpg')
+
+        first = sweep('--limit', '1')
+        assert 'Stopped after blobs/00; run again to continue.' in first
+        assert StorageSweep.objects.get().position == 'blobs/00'
+
+        second = sweep()
+        assert 'Resuming the sweep' in second
+        assert 'blobs/00/' not in second
+        assert 'orphan: letters/9/Attachment_9_1.jpg' in second
+        # Totals for the whole pass
+        assert '2 orphan(s)' in second
+        assert not StorageSweep.objects.exists()
+
+    def test_reads_letters_in_batches(self, media):
+        letters = [Letter.objects.create(serial_number=serial_number) for serial_number in range(1, 6)]
+
+        out = sweep('--batch-size', '2', '--limit', '2')
+
+        assert f'Stopped after {letters[3].pk}; run again to continue.' in out
+        assert StorageSweep.objects.get().phase == StorageSweep.LETTERS
@@ -132,10 +132,11 @@ class TestSectorDashboardView:
         response = client.get(reverse('sector_dashboard'))
 
         assert response.status_code == 200
-        assert len(response.context['letters']) == 20  # First page has 20
+        assert len(response.context['letters']) == 20  # Opens on the latest 20
 
-        response_page2 = client.get(reverse('sector_dashboard'), {'page': 2})
-        assert len(response_page2.context['letters']) == 5  # Second page has 5
+        previous_cursor = response.context['letters'].previous_cursor
+        response_page2 = client.get(reverse('sector_dashboard'), {'cursor': previous_cursor})
+        assert len(response_page2.context['letters']) == 5  # Older page has the remaining 5
 
     def test_sector_dashboard_counts_pending_resolved(self, client):
         # Dashboard should calculate pending and resolved counts correctly
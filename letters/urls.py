@@ -36,6 +36,9 @@ urlpatterns = [
     path('custom-admin/letters/edit/<path:pk>/', views.edit_letter, name='edit_letter'),
     path('custom-admin/letters/delete/<path:pk>/', views.delete_letter, name='delete_letter'),
     path('custom-admin/letters/export/', views.export_letters_excel, name='export_letters_excel'),
+    path('custom-admin/exports/start/', views.start_export, name='start_export'),
+    path('custom-admin/exports/status/', views.export_jobs_status, name='export_jobs_status'),
+    path('custom-admin/exports/<int:pk>/download/', views.download_export, name='download_export'),
 
     path('custom-admin/letters/<int:pk>/audit/', views.admin_letter_audit_log, name='admin_letter_audit'),
     path('custom-admin/audit-logs/', views.admin_global_audit, name='admin_global_audit'),
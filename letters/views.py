@@ -9,16 +9,25 @@ from django.contrib.auth.models import User
 from django.contrib import messages
 from django.contrib.auth import logout  # <--- Needed for logout
 
-import openpyxl
-from openpyxl import Workbook
-from django.http import HttpResponse, FileResponse, Http404
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header
 from datetime import datetime
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 
-from .models import BackupSettings
+from .models import BackupSettings, ExportJob
 from .utils import run_db_backup
+from .counters import ALL_SECTORS, count_letters, sector_counters, status_counters
+from .delivery import add_cache_headers, deliver
+from .export_jobs import submit_export
+from .exports import EXPORT_FORMATS, XLSX_CONTENT_TYPE, filtered_letters
+from .imaging import INLINE_TYPES, PDF, UNKNOWN
+from .pagination import KeysetPaginator
+from .renditions import VARIANTS, page_rendition, rendition_or_original
+from .search import apply_search, is_ranked
+
+# Exports listed on the admin dashboard
+RECENT_EXPORTS = 5
 
 # --- PUBLIC PORTAL ---
 
@@ -45,43 +54,43 @@ def sector_dashboard(request):
     search_query = request.GET.get('q', '')
     search_type = request.GET.get('search_type', 'all')
     page_number = request.GET.get('page')
+    cursor = request.GET.get('cursor')
     highlight_serial = None
+    serial_matches = None
 
     if selected_sector != "ALL":
         letters = letters.filter(target_sector=selected_sector)
 
     if search_query:
         if search_type == 'serial':
-            target = letters.filter(serial_number__iexact=search_query).first()
+            serial_matches = apply_search(letters, search_query, 'serial')
+            target = serial_matches.first()
             if target:
-                highlight_serial = int(target.serial_number)
+                highlight_serial = target.serial_number
 
-                if not page_number:
-                    position = letters.filter(serial_number__lt=target.serial_number).count()
-                    page_number = (position // 20) + 1
+                if not cursor:
+                    cursor = KeysetPaginator(letters, 20).cursor_ending_at(highlight_serial)
 
             else:
                 letters = letters.none()
 
-
-        elif search_type == 'date':
-            letters = letters.filter(date_received__icontains=search_query)
         else:
-            letters = letters.filter(
-                Q(serial_number__icontains=search_query) |
-                Q(sender_details__icontains=search_query) |
-                Q(letter_type__icontains=search_query)
-
-        )
+            letters = apply_search(letters, search_query, search_type)
 
-    total_count = letters.count()
-    pending_count = letters.filter(status='PENDING').count()
-    resolved_count = total_count - pending_count
+    if serial_matches is not None:
+        # A serial jump matches one letter, the page around it is only context
+        counts = count_letters(serial_matches)
+    elif search_query:
+        counts = count_letters(letters)
+    else:
+        counts = sector_counters(selected_sector)
 
-    paginator = Paginator(letters, 20)
-    if not page_number:
-        page_number = paginator.num_pages
-    page_obj = paginator.get_page(page_number)
+    if is_ranked(letters):
+        # Ranked results open on the best matches
+        page_obj = Paginator(letters, 20).get_page(page_number or 1)
+    else:
+        # The registry opens on the latest letters
+        page_obj = KeysetPaginator(letters, 20).get_page(cursor)
 
     context = {
         'user_sector': user_sector,
@@ -89,9 +98,9 @@ def sector_dashboard(request):
         'search_query': search_query,
         'search_type': search_type,
         'letters': page_obj,
-        'total': total_count,
-        'pending': pending_count,
-        'resolved': resolved_count,
+        'total': counts['total'],
+        'pending': counts['pending'],
+        'resolved': counts['resolved'],
         'highlight_serial': highlight_serial,
     }
 
@@ -200,7 +209,8 @@ def letter_detail(request, pk):
 
     return render(request, 'letters/user/letter_detail.html', {
         'letter': letter,
-        'user_sector': user_sector
+        'user_sector': user_sector,
+        'processing': letter.attachment_processing(),
     })
 
 @login_required
@@ -222,7 +232,26 @@ def view_letter_images(request, pk):
     attachments = []
     for field_name in attachment_fields:
         if getattr(letter, field_name):
-            attachments.append(reverse('serve_attachment', args=[letter.pk, field_name]))
+            url = reverse('serve_attachment', args=[letter.pk, field_name])
+            meta = letter.attachment_meta.get(field_name, {})
+            pages = meta.get('pages', 0)
+            # A PDF is shown a page at a time (fetched when turned to); one
+            # that cannot be rendered is only offered as a document.
+            if meta.get('content_type') == PDF:
+                kind = 'pages' if pages else 'document'
+            elif meta and meta.get('content_type') not in INLINE_TYPES:
+                # Not a scan: only offered as a download
+                kind = 'document'
+            else:
+                kind = 'image'
+            attachments.append({
+                'url': url,
+                'kind': kind,
+                'pages': pages,
+                'full': f"{url}?page=1" if kind == 'pages' else url,
+                'thumb': f"{url}?variant=thumb",
+                'preview': f"{url}?variant=preview",
+            })
 
     return render(request, 'letters/common/letter_images.html', {
         'letter': letter,
@@ -240,6 +269,10 @@ def serve_attachment(request, pk, field_name):
     if field_name not in allowed_fields:
         raise Http404()
 
+    variant = request.GET.get('variant')
+    if variant and variant not in VARIANTS:
+        raise Http404()
+
     if not request.user.is_superuser:
         try:
             user_sector = request.user.sectorprofile.sector
@@ -253,7 +286,43 @@ def serve_attachment(request, pk, field_name):
     if not file_field:
         raise Http404()
 
-    return FileResponse(file_field.open('rb'), content_type='image/jpeg')
+    # Validators from the fingerprint taken at processing time, so a 304
+    # never opens the file; each rendition and PDF page has its own tag.
+    try:
+        fingerprint = letter.attachment_fingerprint(field_name)
+    except FileNotFoundError:
+        raise Http404()
+    last_modified = datetime.fromisoformat(fingerprint['modified']).timestamp()
+
+    page = request.GET.get('page')
+    if page:
+        if not page.isdigit() or not 1 <= int(page) <= fingerprint.get('pages', 0):
+            raise Http404()
+        etag = f'"{fingerprint["sha256"]}.page{page}"'
+    else:
+        name = rendition_or_original(file_field, variant)
+        etag = f'"{fingerprint["sha256"]}"' if name == file_field.name else f'"{fingerprint["sha256"]}.{variant}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if page:
+            response = deliver(file_field.storage, page_rendition(file_field, int(page)), 'image/jpeg', request, etag)
+        elif name == file_field.name:
+            content_type = fingerprint['content_type']
+            if content_type in INLINE_TYPES:
+                response = deliver(file_field.storage, name, content_type, request, etag)
+            else:
+                # Anything else (an uploaded .html or .svg, or a type recorded
+                # before types were only sniffed) is never rendered from this
+                # origin: it is downloaded, as bytes.
+                response = deliver(file_field.storage, name, UNKNOWN, request, etag)
+                response['Content-Disposition'] = content_disposition_header(
+                    as_attachment=True, filename=f"Attachment_{letter.serial_number}_{field_name[-1]}.bin"
+                )
+        else:
+            response = deliver(file_field.storage, name, 'image/jpeg', request, etag)
+    response['X-Content-Type-Options'] = 'nosniff'
+    return add_cache_headers(response, etag, last_modified)
 
 
 
@@ -268,6 +337,7 @@ def custom_admin_dashboard(request):
 
     context = {
         'backup_settings': backup_settings,
+        'export_jobs': ExportJob.objects.all()[:RECENT_EXPORTS],
     }
 
     return render(request, 'letters/admin/pages/admin_dashboard.html', context)
@@ -303,7 +373,9 @@ def custom_admin_letters(request):
     filter_status = request.GET.get('status', 'all')
 
     page_number = request.GET.get('page')
+    cursor = request.GET.get('cursor')
     highlight_serial = None
+    serial_matches = None
 
     if filter_sector != 'all':
         letters_list = letters_list.filter(target_sector=filter_sector)
@@ -312,34 +384,32 @@ def custom_admin_letters(request):
 
     if search_query:
         if search_type == 'serial':
-            target = letters_list.filter(serial_number__iexact=search_query).first()
+            serial_matches = apply_search(letters_list, search_query, 'serial')
+            target = serial_matches.first()
             if target:
-                highlight_serial = int(target.serial_number)
-                if not page_number:
-                    position = letters_list.filter(serial_number__lt=target.serial_number).count()
-                    page_number = (position // 20) + 1
+                highlight_serial = target.serial_number
+                if not cursor:
+                    cursor = KeysetPaginator(letters_list, 20).cursor_ending_at(highlight_serial)
 
             else:
                 letters_list = letters_list.none()
 
-        elif search_type == 'date':
-            letters_list = letters_list.filter(date_received__icontains=search_query)
         else:
-            letters_list = letters_list.filter(
-            Q(serial_number__icontains=search_query) |
-            Q(sender_details__icontains=search_query) |
-            Q(letter_type__icontains=search_query) |
-            Q(target_sector__icontains=search_query)
-        )
+            letters_list = apply_search(letters_list, search_query, search_type)
 
-    total_letters = letters_list.count()
-    pending_letters = letters_list.filter(status='PENDING').count()
-    replied_letters = total_letters - pending_letters
+    if serial_matches is not None:
+        counts = count_letters(serial_matches)
+    elif search_query:
+        counts = count_letters(letters_list)
+    else:
+        counts = sector_counters(ALL_SECTORS if filter_sector == 'all' else filter_sector)
+        if filter_status != 'all':
+            counts = status_counters(counts, filter_status)
 
-    paginator = Paginator(letters_list, 20)
-    if not page_number:
-        page_number = paginator.num_pages
-    letters = paginator.get_page(page_number)
+    if is_ranked(letters_list):
+        letters = Paginator(letters_list, 20).get_page(page_number or 1)
+    else:
+        letters = KeysetPaginator(letters_list, 20).get_page(cursor)
 
     context = {
         'letters': letters,
@@ -349,9 +419,9 @@ def custom_admin_letters(request):
         'filter_status': filter_status,
         'SECTOR_CHOICES': SECTOR_CHOICES,
         'STATUS_CHOICES': STATUS_CHOICES,
-        'total_letters': total_letters,
-        'pending_letters': pending_letters,
-        'replied_letters': replied_letters,
+        'total_letters': counts['total'],
+        'pending_letters': counts['pending'],
+        'replied_letters': counts['resolved'],
         'highlight_serial': highlight_serial,
     }
 
@@ -373,7 +443,10 @@ def admin_user_detail(request, user_id):
 def admin_letter_detail(request, pk):
     if not request.user.is_superuser: return redirect('sector_dashboard')
     letter = get_object_or_404(Letter, pk=pk)
-    return render(request, 'letters/admin/pages/admin_letter_detail.html', {'letter': letter})
+    return render(request, 'letters/admin/pages/admin_letter_detail.html', {
+        'letter': letter,
+        'processing': letter.attachment_processing(),
+    })
 
 
 # --- ACTION VIEWS ---
@@ -497,188 +570,72 @@ def logout_view(request):
 def export_letters_excel(request):
     if not request.user.is_superuser: return redirect('sector_dashboard')
 
-    #1) Get the data (Apply search filter if it exists)
-    letters = Letter.objects.all().order_by('serial_number')
-    search_query = request.GET.get('q', '')
-    filter_sector = request.GET.get('sector', 'all')
-    filter_status = request.GET.get('status', 'all')
-
-    if search_query:
-        letters = letters.filter(
-            Q(serial_number__icontains=search_query) |
-            Q(sender_details__icontains=search_query) |
-            Q(letter_type__icontains=search_query) |
-            Q(target_sector__icontains=search_query)
-        )
-
-        clean_query = "".join([c for c in search_query if c.isalnum() or c in (' ', '-', '_')]).strip()
-        filename = f"Search_Results_{clean_query}.xlsx"
-
-    else:
-        year = datetime.now().year
-        filename = f"Weligepola_Pradeshiya_sabha_letters_database_{year}.xlsx"
-
-    if filter_sector != 'all':
-        letters = letters.filter(target_sector=filter_sector)
+    try:
+        content_type, extension, chunks = EXPORT_FORMATS[request.GET.get('format', 'xlsx')]
+    except KeyError:
+        raise Http404()
 
-    if filter_status != 'all':
-        letters = letters.filter(status=filter_status)
+    # Same filters as the admin letter list; built row by row, see letters/exports.py
+    letters, filename = filtered_letters(request.GET)
 
+    response = StreamingHttpResponse(chunks(letters), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    return response
 
-    # 2) Create the Excel Workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Letters Data"
 
-    # --- Styles added 2026-01-29 ---
+@never_cache
+@login_required
+def start_export(request):
+    if not request.user.is_superuser: return redirect('sector_dashboard')
+    if request.method != 'POST':
+        return redirect('custom_admin_letters')
+
+    # Built by the export worker, see letters/export_jobs.py
+    job, reused = submit_export(request.POST, request.user)
+    if reused and job.status == ExportJob.DONE:
+        messages.success(request, "The same export was made a few minutes ago; it is ready to download below.")
+    elif reused:
+        messages.success(request, "The same export is already being prepared.")
+    else:
+        messages.success(request, "Export queued. It will be ready to download below.")
+    return redirect('custom_admin_dashboard')
 
-    sector_colors = {
-        'ADMINISTRATION': 'bf716f',
-        'HEALTH': '8e74ad',
-        'DEVELOPMENT': 'e46c0a',
-        'REVENUE': 'ffff00',
-        'ACCOUNTS': '6997cf'
-    }
 
-    sector_map = {
-        'ADMINISTRATION': 'පාලන අංශය',
-        'HEALTH': 'සෞඛ්‍ය අංශය',
-        'DEVELOPMENT': 'සංවර්ධන අංශය',
-        'REVENUE': 'ආදායම් අංශය',
-        'ACCOUNTS': 'ගිණුම් අංශය',
+def export_job_data(job):
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'rows_done': job.rows_done,
+        'rows_total': job.rows_total,
+        'percent': job.percent,
+        'download_url': reverse('download_export', args=[job.pk]) if job.status == ExportJob.DONE else None,
     }
 
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
-                         top=Side(style='thin'), bottom=Side(style='thin') )
-
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    header_fill = PatternFill(start_color='2b2b2b', end_color='2b2b2b', fill_type='solid')
-
-    title_font = Font(bold=True, color="1f4e78", size=16)
-
-    # 3) Add the Title
-    ws.merge_cells('A1:I1')
-    title_cell = ws['A1']
-    title_cell.value = "ලිපි ලේඛන කළමනාකරණ පද්ධතිය - වැලිගෙපොල ප්‍රාදේශීය සභාව"
-    title_cell.font = title_font
-    title_cell.alignment = Alignment(horizontal='center', vertical='center')
-
-    # 4) Add Color Legend
-    ws['A3'] = "වර්ණ දර්ශකය (Color legend)"
-    ws['A3'].font = Font(bold=True, underline="single")
-
-    current_row = 4
-    for sector_code, color_hex in sector_colors.items():
-        label_cell = ws.cell(row=current_row, column=1)
-        label_cell.value = sector_map.get(sector_code, sector_code)
-        label_cell.border = thin_border
-
-        color_cell = ws.cell(row=current_row, column=2)
-        color_cell.fill = PatternFill(start_color=color_hex, end_color=color_hex, fill_type='solid')
-        color_cell.border = thin_border
-
-        current_row += 1
-    start_row = current_row + 2
-
-
-    # 5) Add Headers (In Sinhala)
-    headers = [
-        'ලිපි අංකය (Serial)',
-        'ලැබුණු දිනය (Date)',
-        'එවූ අයගේ විස්තර (Sender Details)',
-        'ලිපියේ වර්ගය (Type)',
-        'අංශය (Sector)',
-        'පරිපාලනය කළේ (Admin By)',
-        'භාරගත් නිලධාරී (Accepting Officer)',
-        'තත්වය (Status)',
-        'පිළිතුරු දුන් දිනය (Replied Date)'
-    ]
-
-    for col_num, header_title in enumerate(headers, 1):
-        cell = ws.cell(row=start_row, column=col_num)
-        cell.value = header_title
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-
-    # 6) Add Rows
-    for letter in letters:
-        start_row += 1
-
-        # CHANGED: Excel export translation for all 4 statuses
-        if letter.status == 'REPLIED':
-            status = "පිළිතුරු යොමු කර ඇත"
-        elif letter.status == 'NOT_REQUIRED':
-            status = "අවශ්‍ය නොවේ"
-        elif letter.status == 'ADMIN_UPDATED':
-            status = "Admin Updated"
-        else:
-            status = "විමර්ශනය වෙමින් පවතී"
 
-        #Translate Sector
-        sector_sinhala = sector_map.get(letter.target_sector, letter.target_sector)
-
-        #Handle Admin By
-        admin_by = letter.get_administrated_by_display()
-
-        #Handle date formatting
-        replied_at = ""
-        if letter.replied_at:
-            replied_at = letter.replied_at.strftime("%Y-%m-%d")
-
-        row_data = [
-            letter.serial_number,
-            letter.date_received,
-            letter.sender_details,
-            letter.letter_type,
-            sector_sinhala,
-            admin_by,
-            letter.accepting_officer_id,
-            status,
-            replied_at
-        ]
-
-        row_color = sector_colors.get(letter.target_sector, "FFFFFF")
-        row_fill = PatternFill(start_color=row_color, end_color=row_color, fill_type='solid')
-
-        for col_num, cell_value in enumerate(row_data, 1):
-            cell = ws.cell(row=start_row, column=col_num)
-            cell.value = cell_value
-            cell.fill = row_fill
-            cell.border = thin_border
-            cell.alignment = Alignment(vertical='center')
-
-            if col_num in  [1, 2, 5, 8, 9]:
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-
-
-    # 7) Auto-adjust column width
-    for col in ws.columns:
-        max_length = 0
-        column = get_column_letter(col[0].column)
-        for cell in col:
-
-            if cell.row < 9:
-                continue
+@never_cache
+@login_required
+def export_jobs_status(request):
+    if not request.user.is_superuser: raise Http404()
 
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
+    # Polled by the admin dashboard while an export is in progress
+    jobs = ExportJob.objects.all()[:RECENT_EXPORTS]
+    return JsonResponse({'jobs': [export_job_data(job) for job in jobs]})
 
-        adjusted_width = min(max_length + 3, 50)
-        ws.column_dimensions[column].width = adjusted_width
 
+@never_cache
+@login_required
+def download_export(request, pk):
+    if not request.user.is_superuser: raise Http404()
 
-    # 6) Prepare the response
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    job = get_object_or_404(ExportJob, pk=pk, status=ExportJob.DONE)
+    if not job.file:
+        raise Http404()
 
-    wb.save(response)
+    response = deliver(job.file.storage, job.file.name, XLSX_CONTENT_TYPE, request)
+    response['Content-Disposition'] = content_disposition_header(True, f"{job.filename or 'Letters_Export'}.xlsx")
     return response
 
+
 @never_cache
 @login_required
 def admin_letter_audit_log(request, pk):
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 """Django's command-line utility for administrative tasks."""
+import multiprocessing
 import os
 import sys
 
@@ -19,4 +20,7 @@ def main():
 
 
 if __name__ == '__main__':
+    # Lets a frozen build start the process pools (letters/imaging.py,
+    # letters/legacy_import.py) of the commands it runs
+    multiprocessing.freeze_support()
     main()